@@ -0,0 +1,209 @@
+"""
+Admission control for write requests, so that bursts of writes queue in the
+process for a bounded time instead of piling up on SQLite's write lock.
+
+AdmissionMiddleware lets at most ADMISSION_WRITE_CONCURRENCY requests with
+unsafe methods run at once per database, in each process. Up to
+ADMISSION_QUEUE_SIZE more wait for a slot, first come first served, for at
+most ADMISSION_QUEUE_TIMEOUT_SECONDS. A write that finds the queue full, or
+times out in it, is shed at once with 503 and a Retry-After header, without
+touching the database. Households have databases of their own (see
+households.py), so the middleware must come after HouseholdMiddleware, and
+writes to one household never wait for another's. Reads are not limited.
+
+Writers in other processes still contend for the same SQLite lock. A write
+that gives up waiting for it fails with "database is locked", which
+responses.exception_response() answers with the same 503, rather than the
+500 that other unexpected errors get.
+
+The limiter exports the admission_queue_depth and admission_active_writes
+gauges, admission_shed_total by reason and the time admitted writes waited,
+at /metrics.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .codec import error
+from .households import current_database
+from .metrics import DURATION_BUCKETS, registry
+from .responses import exception_response, is_lock_error, retry_later
+from .tokens import SAFE_METHODS
+
+OVERLOADED = error('Too many concurrent writes; retry later', status=503)
+
+registry.describe('admission_queue_depth', 'Write requests waiting for an admission slot.')
+registry.describe('admission_active_writes', 'Write requests holding an admission slot.')
+registry.describe('admission_wait_seconds', 'Time admitted write requests waited for a slot.')
+registry.describe('admission_shed_total', 'Write requests refused with 503, by reason.')
+
+
+class _Waiter:
+    """A request queued for a slot. A sync waiter has an event; an async one has a future on its event loop."""
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class Limiter:
+    """
+    A FIFO semaphore with a bounded wait queue, usable from threads and event
+    loops alike. A released slot is handed straight to the oldest waiter.
+    """
+
+    def __init__(self, database, slots, queue_size):
+        self.labels = (('database', database),)
+        self.slots = slots
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    def _publish(self):
+        registry.set('admission_queue_depth', self.labels, len(self.waiters))
+        registry.set('admission_active_writes', self.labels, self.active)
+
+    def _enter(self, make_waiter):
+        """Takes a free slot and returns None, or queues a new waiter and returns it; False if the queue is full."""
+        with self.lock:
+            if self.active < self.slots and not self.waiters:
+                self.active += 1
+                self._publish()
+                return None
+            if len(self.waiters) >= self.queue_size:
+                return False
+            waiter = make_waiter()
+            self.waiters.append(waiter)
+            self._publish()
+            return waiter
+
+    def _abandon(self, waiter):
+        """Leaves the queue early. Returns True if a slot was handed to `waiter` in the meantime."""
+        with self.lock:
+            try:
+                self.waiters.remove(waiter)
+            except ValueError:
+                return True
+            self._publish()
+            return False
+
+    def _admitted(self, start):
+        registry.observe('admission_wait_seconds', self.labels, time.perf_counter() - start, DURATION_BUCKETS)
+        return None
+
+    def _shed(self, reason):
+        registry.increment('admission_shed_total', self.labels + (('reason', reason),))
+        return reason
+
+    def acquire(self, timeout):
+        """Waits up to `timeout` seconds for a slot. Returns None once admitted, or the reason for shedding."""
+        start = time.perf_counter()
+        waiter = self._enter(_Waiter)
+        if waiter is None:
+            return self._admitted(start)
+        if waiter is False:
+            return self._shed('queue_full')
+        if waiter.event.wait(timeout) or self._abandon(waiter):
+            return self._admitted(start)
+        return self._shed('timeout')
+
+    async def aacquire(self, timeout):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        waiter = self._enter(lambda: _Waiter(loop))
+        if waiter is None:
+            return self._admitted(start)
+        if waiter is False:
+            return self._shed('queue_full')
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                return self._shed('timeout')
+        except asyncio.CancelledError:
+            # The client went away (Django cancels the request task); give back a slot handed over meanwhile.
+            if self._abandon(waiter):
+                self.release()
+            raise
+        return self._admitted(start)
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                waiter = self.waiters.popleft()
+            else:
+                waiter = None
+                self.active -= 1
+            self._publish()
+        if waiter is not None:
+            waiter.grant()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(database):
+    """The write limiter of `database` in this process."""
+    with _limiters_lock:
+        if database not in _limiters:
+            _limiters[database] = Limiter(
+                database,
+                getattr(settings, 'ADMISSION_WRITE_CONCURRENCY', 2),
+                getattr(settings, 'ADMISSION_QUEUE_SIZE', 32)
+            )
+        return _limiters[database]
+
+
+class AdmissionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.timeout = getattr(settings, 'ADMISSION_QUEUE_TIMEOUT_SECONDS', 2.0)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if request.method in SAFE_METHODS:
+            return self.get_response(request)
+
+        writes = limiter(current_database())
+        if writes.acquire(self.timeout) is not None:
+            return retry_later(OVERLOADED)
+        try:
+            return self.get_response(request)
+        finally:
+            writes.release()
+
+    async def __acall__(self, request):
+        if request.method in SAFE_METHODS:
+            return await self.get_response(request)
+
+        writes = limiter(current_database())
+        if await writes.aacquire(self.timeout) is not None:
+            return retry_later(OVERLOADED)
+        try:
+            return await self.get_response(request)
+        finally:
+            writes.release()
+
+    def process_exception(self, request, exception):
+        # Lock errors raised outside the views' own handlers, such as by @idempotent.
+        return exception_response(exception) if is_lock_error(exception) else None
@@ -0,0 +1,370 @@
+"""
+Request parsing and response building for the inventory endpoints, shared by
+the sync views in views.py and the async views in async_views.py.
+
+Query parsers take the request and return the view's arguments as a tuple, or
+raise ValueError with a client-facing message (see schema.validate_request).
+Response builders turn results into JSON responses, so that both view layers
+answer byte for byte the same.
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import datetime, timedelta
+from .catalog import FORMATS
+from .codec import dumps, error, error_response, json_response, success
+from .households import read_database
+from .models import ItemType, IndividualItem, ParLevel, ShoppingList
+import base64
+import json
+
+EXPIRING_ITEMS_MAX_LIMIT = 10000
+EXPIRING_ITEMS_MAX_DAYS = 3650
+ITEM_TYPES_MAX_LIMIT = 10000
+STOCK_MAX_TYPES = 500
+SEARCH_MAX_LIMIT = 100
+
+ITEM_ADDED = success('Item added successfully')
+ITEM_DELETED = success('Item deleted successfully')
+MISSING_ID = error('Missing required field: ID')
+MISSING_FILTER = error('At least one of expiredBefore, itemType, idFrom or idTo is required')
+TYPE_ADDED = success('Type added successfully')
+TYPE_REMOVED = success('Type removed successfully')
+TYPE_IN_USE = error('Cannot remove type because items of this type exist')
+AMOUNT_TYPE_MISSING = error('Amount type does not exist')
+ITEM_TYPE_MISSING = error('Item type does not exist')
+ADDED_TO_SHOPPING_LIST = success('Item added to shopping list successfully')
+REMOVED_FROM_SHOPPING_LIST = success('Item removed from shopping list successfully')
+PURCHASED = success('Item purchased and added to fridge successfully')
+
+
+def build_items(rows, errors, known_barcodes):
+    """Returns unsaved IndividualItems for the rows whose barcode is known, reporting the rest in errors."""
+    items = []
+    for index, row in rows:
+        if row['itemType'] not in known_barcodes:
+            errors.append({'index': index, 'message': 'Item type does not exist'})
+            continue
+        items.append(IndividualItem(
+            item_type_id=row['itemType'],
+            amount=row['amount'],
+            expiration_date=row['expirationDate']
+        ))
+    return items
+
+
+def batch_response(message, created, total, errors):
+    return json_response({
+        'status': 'success',
+        'message': f'{created} of {total} {message}',
+        'created': created,
+        'errors': sorted(errors, key=lambda error: error['index'])
+    })
+
+
+def delete_response(report, errors=None):
+    """Reports a deletion, with the per-index messages of invalid rows when the body was a list."""
+    if errors is not None:
+        report = {**report, 'errors': sorted(errors, key=lambda error: error['index'])}
+    return json_response({'status': 'success', 'message': 'Items deleted successfully', **report})
+
+
+def filter_items(data):
+    """Returns the IndividualItems matched by an ITEM_FILTER body, or None if it has no predicate."""
+    lookups = {
+        'expiredBefore': 'expiration_date__lt',
+        'itemType': 'item_type_id',
+        'idFrom': 'id__gte',
+        'idTo': 'id__lte',
+    }
+    filters = {lookup: data[field] for field, lookup in lookups.items() if field in data}
+    return IndividualItem.objects.filter(**filters) if filters else None
+
+
+def consume_response(report, message):
+    if message:
+        return error_response(message)
+    return json_response({'status': 'success', 'message': 'Items consumed successfully', **report})
+
+
+def encode_expiry_cursor(item):
+    key = [item.expiration_date.isoformat(), item.item_type_id, item.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_expiry_cursor(cursor):
+    expiration_date, item_type, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.strptime(expiration_date, '%Y-%m-%d').date(), item_type, int(item_id)
+
+
+def expiring_item_json(item):
+    return dumps({
+        'ID': item.id,
+        'itemType': item.item_type_id,
+        'name': item.item_type.name,
+        'amountType': item.item_type.amount_type.name,
+        'amount': item.amount,
+        'expirationDate': item.expiration_date.isoformat()
+    })
+
+
+def expiring_items_query(request):
+    """
+    Builds the page of expiring items described by the query parameters.
+    Returns (items, limit), or raises ValueError with a client-facing message.
+    """
+    params = request.GET
+    try:
+        days = int(params.get('days', 7))
+        limit = int(params.get('limit', 100))
+    except ValueError:
+        raise ValueError('Days and limit must be integers')
+
+    if not 0 <= days <= EXPIRING_ITEMS_MAX_DAYS:
+        raise ValueError(f'Days must be between 0 and {EXPIRING_ITEMS_MAX_DAYS}')
+    if not 0 < limit <= EXPIRING_ITEMS_MAX_LIMIT:
+        raise ValueError(f'Limit must be between 1 and {EXPIRING_ITEMS_MAX_LIMIT}')
+
+    items = IndividualItem.objects.using(read_database()).select_related('item_type__amount_type').filter(
+        expiration_date__lte=timezone.localdate() + timedelta(days=days)
+    ).order_by('expiration_date', 'item_type', 'id')
+
+    if 'after' in params:
+        try:
+            after_date, after_type, after_id = decode_expiry_cursor(params['after'])
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+
+        items = items.filter(
+            Q(expiration_date__gt=after_date) |
+            Q(expiration_date=after_date, item_type__gt=after_type) |
+            Q(expiration_date=after_date, item_type=after_type, id__gt=after_id)
+        )
+
+    return items[:limit], limit
+
+
+def stock_barcodes(params):
+    """Returns the barcodes requested by the query parameters, or raises ValueError with a client-facing message."""
+    barcodes = params.getlist('itemType')
+
+    if not barcodes:
+        raise ValueError('Missing required parameter: itemType')
+    if len(barcodes) > STOCK_MAX_TYPES:
+        raise ValueError(f'At most {STOCK_MAX_TYPES} item types can be requested at once')
+
+    return barcodes
+
+
+def stock_query(request):
+    return (stock_barcodes(request.GET),)
+
+
+def stock_response(barcodes, summaries, known_barcodes):
+    """
+    Answers a stock request from the summaries found for `barcodes`. Item types
+    without a summary have no items in stock; barcodes that are not item types
+    at all are listed as unknown.
+    """
+    stock = []
+    unknown = []
+    for barcode in barcodes:
+        summary = summaries.get(barcode)
+        if summary is not None:
+            stock.append({
+                'itemType': barcode,
+                'totalAmount': summary.total_amount,
+                'itemCount': summary.item_count,
+                'earliestExpiry': summary.earliest_expiry.isoformat()
+            })
+        elif barcode in known_barcodes:
+            stock.append({'itemType': barcode, 'totalAmount': 0, 'itemCount': 0, 'earliestExpiry': None})
+        else:
+            unknown.append(barcode)
+
+    return json_response({'status': 'success', 'stock': stock, 'unknown': unknown})
+
+
+def stock_time(params):
+    """Returns the time requested by the `at` parameter, or raises ValueError with a client-facing message."""
+    value = params.get('at')
+    if not value:
+        raise ValueError('Missing required parameter: at')
+
+    try:
+        at = parse_datetime(value)
+    except ValueError:
+        at = None
+    if at is None:
+        raise ValueError('Invalid at. Use an ISO 8601 date and time')
+
+    return at if timezone.is_aware(at) else timezone.make_aware(at)
+
+
+def stock_at_query(request):
+    return stock_barcodes(request.GET), stock_time(request.GET)
+
+
+def stock_at_response(barcodes, at, stock):
+    """
+    Answers a stock-at-time request from the result of history.stock_at.
+    Barcodes without history had no stock; `exact` is false for amounts only
+    known as of the start of the day.
+    """
+    return json_response({
+        'status': 'success',
+        'at': at.isoformat(),
+        'stock': [
+            {'itemType': barcode, 'totalAmount': stock[barcode][0], 'exact': stock[barcode][1]}
+            for barcode in barcodes
+        ]
+    })
+
+
+def catalog_import_format(request):
+    """Returns (catalog format of the request body,), or raises ValueError with a client-facing message."""
+    for format, content_type in FORMATS.items():
+        if request.content_type == content_type:
+            return (format,)
+    raise ValueError('Content type must be text/csv or application/x-ndjson')
+
+
+def catalog_export_format(request):
+    """Returns (requested export format,), or raises ValueError with a client-facing message."""
+    format = request.GET.get('format', 'ndjson')
+    if format not in FORMATS:
+        raise ValueError('Format must be csv or ndjson')
+    return (format,)
+
+
+def import_response(report):
+    return json_response({
+        'status': 'success',
+        'message': f"{report['imported']} of {report['total']} item types imported successfully",
+        **report
+    })
+
+
+def item_types_query(request):
+    """
+    Builds the page of item types described by the query parameters, in
+    barcode order after the `after` barcode. Returns (item types, limit), or
+    raises ValueError with a client-facing message.
+    """
+    params = request.GET
+    try:
+        limit = int(params.get('limit', 100))
+    except ValueError:
+        raise ValueError('Limit must be an integer')
+
+    if not 0 < limit <= ITEM_TYPES_MAX_LIMIT:
+        raise ValueError(f'Limit must be between 1 and {ITEM_TYPES_MAX_LIMIT}')
+
+    item_types = ItemType.objects.using(settings.READ_DATABASE).order_by('unique_barcode')
+    if 'after' in params:
+        item_types = item_types.filter(unique_barcode__gt=params['after'])
+
+    return item_types.values_list('unique_barcode', 'name', 'amount_type_id')[:limit], limit
+
+
+def item_types_response(rows, limit):
+    return json_response({
+        'status': 'success',
+        'itemTypes': [
+            {'unique_barcode': barcode, 'name': name, 'amount_type': amount_type}
+            for barcode, name, amount_type in rows
+        ],
+        'next': rows[-1][0] if len(rows) == limit else None
+    })
+
+
+def search_query(request):
+    """Returns (search text, limit) from the query parameters, or raises ValueError with a client-facing message."""
+    params = request.GET
+    text = params.get('q', '').strip()
+    if not text:
+        raise ValueError('Missing query parameter: q')
+
+    try:
+        limit = int(params.get('limit', 20))
+    except ValueError:
+        raise ValueError('Limit must be an integer')
+
+    if not 0 < limit <= SEARCH_MAX_LIMIT:
+        raise ValueError(f'Limit must be between 1 and {SEARCH_MAX_LIMIT}')
+
+    return text, limit
+
+
+def search_response(rows):
+    return json_response({
+        'status': 'success',
+        'itemTypes': [
+            {'unique_barcode': barcode, 'name': name, 'amount_type': amount_type}
+            for barcode, name, amount_type in rows
+        ]
+    })
+
+
+def type_in_use(database, barcode):
+    """The items of `barcode` in one fridge. An item type is in use while any household has items of it."""
+    return IndividualItem.objects.using(database).filter(item_type_id=barcode)
+
+
+def shopping_list_query():
+    entries = ShoppingList.objects.using(read_database()).order_by('item_type_id')
+    return entries.values_list('item_type_id', 'item_type__name', 'amount')
+
+
+def shopping_list_response(rows):
+    return json_response({
+        'status': 'success',
+        'items': [{'itemType': barcode, 'name': name, 'amount': amount} for barcode, name, amount in rows]
+    })
+
+
+def last_event_id(request):
+    """EventSource sends Last-Event-ID when it reconnects; lastEventId lets a client resume on its first request."""
+    return request.headers.get('Last-Event-ID') or request.GET.get('lastEventId')
+
+
+def changes_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def sum_shopping_list_deltas(rows, errors, known_barcodes):
+    """Returns the summed delta per known barcode, reporting rows with unknown barcodes in errors."""
+    deltas = {}
+    for index, row in rows:
+        if row['itemType'] not in known_barcodes:
+            errors.append({'index': index, 'message': 'Item type does not exist'})
+            continue
+        deltas[row['itemType']] = deltas.get(row['itemType'], 0) + row['amount']
+    return deltas
+
+
+def build_par_levels(rows, errors, known_barcodes):
+    """Returns unsaved ParLevels for the rows whose barcode is known, reporting the rest in errors."""
+    levels = []
+    for index, row in rows:
+        if row['itemType'] not in known_barcodes:
+            errors.append({'index': index, 'message': 'Item type does not exist'})
+            continue
+        levels.append(ParLevel(
+            item_type_id=row['itemType'],
+            amount=row['amount'],
+            expiry_horizon_days=row.get('expiryHorizonDays')
+        ))
+    return levels
+
+
+PAR_LEVEL_CONFLICTS = {
+    'update_conflicts': True,
+    'unique_fields': ['item_type'],
+    'update_fields': ['amount', 'expiry_horizon_days'],
+}
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class AppConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "app"
+
+    def ready(self):
+        from . import cache  # noqa: F401  (connects the cache invalidation signals)
+        from . import metrics  # noqa: F401  (times queries on every new connection)
+        from . import versions  # noqa: F401  (counts writes to the tables behind conditional GETs)
@@ -0,0 +1,179 @@
+"""
+Async versions of the inventory endpoints whose I/O can run on the event loop,
+routed by mysite/async_urls.py when the site is served through mysite/asgi.py.
+
+Request parsing and validation run on the event loop, single statements use
+Django's async ORM and cache, and responses are streamed from async
+iterators. Parsing and responses come from api.py, as for the sync views.
+Django has no async transactions, so an endpoint whose work is one transaction
+in inventory.py has no async version here: app/routes.py serves its sync view,
+which Django runs in its thread pool.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
+from . import events, views
+from .api import (
+    AMOUNT_TYPE_MISSING, ITEM_ADDED, ITEM_TYPE_MISSING, PAR_LEVEL_CONFLICTS, TYPE_ADDED, TYPE_IN_USE, TYPE_REMOVED,
+    batch_response, build_items, build_par_levels, catalog_export_format, changes_response, encode_expiry_cursor,
+    expiring_item_json, expiring_items_query, item_types_query, item_types_response, last_event_id,
+    shopping_list_query, shopping_list_response, stock_query, stock_response, sum_shopping_list_deltas, type_in_use
+)
+from .cache import aget_amount_type, aget_item_types
+from .catalog import FORMATS, aexport_catalog
+from .codec import dumps, json_response
+from .households import current_database, databases, delete_item_types, read_database
+from .idempotency import aidempotent
+from .inventory import store_items, upsert_shopping_list
+from .models import ItemType, ParLevel, ShoppingList, StockSummary
+from .schema import ITEM, NEW_TYPE, PAR_LEVEL, SHOPPING_LIST_DELTA, TYPE_BARCODE, validate_body, validate_request
+from .versions import conditional_on
+
+
+@require_http_methods(['PUT'])
+@aidempotent(views.add_item)
+@validate_body(ITEM)
+async def add_item(request, data):
+    errors = []
+    items = build_items([(0, data)], errors, (await aget_item_types({data['itemType']})).keys())
+
+    if errors:
+        return ITEM_TYPE_MISSING.response()
+
+    await sync_to_async(store_items)(items)
+    return ITEM_ADDED.response()
+
+
+@require_http_methods(['PUT'])
+@aidempotent(views.add_items)
+@validate_body(ITEM, many=True)
+async def add_items(request, rows, errors):
+    total = len(rows) + len(errors)
+    known_barcodes = (await aget_item_types({row['itemType'] for _, row in rows})).keys()
+    items = await sync_to_async(store_items)(build_items(rows, errors, known_barcodes))
+
+    return batch_response('items added successfully', len(items), total, errors)
+
+
+async def _astream_expiring_items(items, limit):
+    yield b'{"status": "success", "items": ['
+
+    count = 0
+    last_item = None
+    async for item in items:
+        yield (b', ' if count else b'') + expiring_item_json(item)
+        count += 1
+        last_item = item
+
+    next_cursor = encode_expiry_cursor(last_item) if count == limit else None
+    yield b'], "next": ' + dumps(next_cursor) + b'}'
+
+
+@require_http_methods(['GET'])
+@validate_request(expiring_items_query)
+async def expiring_items(request, items, limit):
+    return StreamingHttpResponse(
+        _astream_expiring_items(items, limit),
+        content_type='application/json'
+    )
+
+
+@require_http_methods(['GET'])
+@validate_request(stock_query)
+async def stock(request, barcodes):
+    summaries = await StockSummary.objects.using(read_database()).ain_bulk(barcodes)
+    missing = set(barcodes) - summaries.keys()
+
+    return stock_response(barcodes, summaries, (await aget_item_types(missing)).keys() if missing else ())
+
+
+@require_http_methods(['PUT'])
+@aidempotent(views.new_type)
+@validate_body(NEW_TYPE)
+async def new_type(request, data):
+    amount_type = await aget_amount_type(data['amount_type'])
+
+    if amount_type is None:
+        return AMOUNT_TYPE_MISSING.response()
+
+    await ItemType.objects.acreate(
+        unique_barcode=data['unique_barcode'],
+        name=data['name'],
+        amount_type=amount_type)
+
+    return TYPE_ADDED.response()
+
+
+@require_http_methods(['GET'])
+@conditional_on(ItemType)
+@validate_request(catalog_export_format)
+async def export_types(request, format):
+    return StreamingHttpResponse(aexport_catalog(format, settings.READ_DATABASE), content_type=FORMATS[format])
+
+
+@require_http_methods(['GET'])
+@conditional_on(ItemType)
+@validate_request(item_types_query)
+async def item_types(request, rows, limit):
+    return item_types_response([row async for row in rows], limit)
+
+
+@require_http_methods(['DELETE'])
+@aidempotent(views.remove_type)
+@validate_body(TYPE_BARCODE)
+async def remove_type(request, data):
+    unique_barcode = data['unique_barcode']
+
+    for database in databases():
+        if await type_in_use(database, unique_barcode).aexists():
+            return TYPE_IN_USE.response()
+
+    await sync_to_async(delete_item_types)([unique_barcode], DEFAULT_DB_ALIAS)
+    return TYPE_REMOVED.response()
+
+
+@require_http_methods(['GET'])
+@conditional_on(ShoppingList, ItemType)
+@validate_request()
+async def shopping_list(request):
+    return shopping_list_response([row async for row in shopping_list_query()])
+
+
+@require_http_methods(['GET'])
+async def changes(request):
+    """
+    Streams the change feed as server-sent events. An idle client is one
+    suspended generator waiting on its queue, woken for heartbeats only.
+    """
+    return changes_response(events.stream(last_event_id(request), current_database()))
+
+
+@require_http_methods(['PATCH'])
+@aidempotent(views.update_shopping_list)
+@validate_body(SHOPPING_LIST_DELTA, many=True)
+async def update_shopping_list(request, rows, errors):
+    known_barcodes = (await aget_item_types({row['itemType'] for _, row in rows})).keys()
+    await sync_to_async(upsert_shopping_list)(sum_shopping_list_deltas(rows, errors, known_barcodes))
+
+    return json_response({
+        'status': 'success',
+        'message': 'Shopping list updated successfully',
+        'errors': sorted(errors, key=lambda error: error['index'])
+    })
+
+
+@require_http_methods(['PUT'])
+@aidempotent(views.set_par_levels)
+@validate_body(PAR_LEVEL, many=True)
+async def set_par_levels(request, rows, errors):
+    total = len(rows) + len(errors)
+    known_barcodes = (await aget_item_types({row['itemType'] for _, row in rows})).keys()
+    levels = build_par_levels(rows, errors, known_barcodes)
+
+    await ParLevel.objects.abulk_create(levels, **PAR_LEVEL_CONFLICTS)
+
+    return batch_response('par levels set successfully', len(levels), total, errors)
+
+
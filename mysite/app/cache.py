@@ -0,0 +1,155 @@
+"""
+Cached lookups of item types by barcode and amount types by name.
+
+Entries live in the REFERENCE_CACHE cache of Django's cache framework for
+REFERENCE_CACHE_TTL seconds. With more than one server process, point it at a
+shared backend (memcached, redis, ...) so that a type deleted or changed
+through one process is dropped for all of them; the default local-memory cache
+is per process. Saves and deletes drop their entries at once and again when
+their transaction commits, and lookups made inside a transaction do not fill
+the cache, so a rolled-back write never leaves a type behind that does not
+exist. Hits and misses are counted in reference_cache_lookups_total.
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .metrics import registry
+from .models import AmountType, ItemType
+
+registry.describe('reference_cache_lookups_total', 'Item and amount type lookups, by cache hit or miss.')
+
+
+def _cache():
+    return caches[getattr(settings, 'REFERENCE_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'REFERENCE_CACHE_TTL', 300)
+
+
+def _key(kind, name):
+    # Barcodes may hold characters or lengths that memcached does not accept in keys.
+    return f'{kind}:{hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()}'
+
+
+def _count(kind, hits, misses):
+    if hits:
+        registry.increment('reference_cache_lookups_total', (('kind', kind), ('result', 'hit')), hits)
+    if misses:
+        registry.increment('reference_cache_lookups_total', (('kind', kind), ('result', 'miss')), misses)
+
+
+def _cacheable(model):
+    """Rows read inside a transaction may yet be rolled back, so they are not cached."""
+    return not connections[model.objects.db].in_atomic_block
+
+
+def _split(kind, names, cached):
+    """Returns ({name: cached value}, [names missing from the cache]) for a get_many result."""
+    found = {}
+    misses = []
+    for name in names:
+        value = cached.get(_key(kind, name))
+        if value is None:
+            misses.append(name)
+        else:
+            found[name] = value
+    _count(kind, len(found), len(misses))
+    return found, misses
+
+
+def get_item_types(barcodes):
+    """Returns a dict of barcode to ItemType for the barcodes that exist, querying only cache misses."""
+    barcodes = set(barcodes)
+    if not barcodes:
+        return {}
+    cache = _cache()
+    found, misses = _split('item_type', barcodes, cache.get_many([_key('item_type', code) for code in barcodes]))
+
+    if misses:
+        loaded = {
+            item_type.unique_barcode: item_type for item_type in ItemType.objects.filter(unique_barcode__in=misses)
+        }
+        if loaded and _cacheable(ItemType):
+            cache.set_many({_key('item_type', code): item_type for code, item_type in loaded.items()}, _timeout())
+        found.update(loaded)
+
+    return found
+
+
+def get_item_type(barcode):
+    """Returns the ItemType with the given barcode, or None if it does not exist."""
+    return get_item_types([barcode]).get(barcode)
+
+
+def get_amount_type(name):
+    """Returns the AmountType with the given name, or None if it does not exist."""
+    cache = _cache()
+    amount_type = cache.get(_key('amount_type', name))
+    _count('amount_type', amount_type is not None, amount_type is None)
+    if amount_type is None:
+        amount_type = AmountType.objects.filter(name=name).first()
+        if amount_type is not None and _cacheable(AmountType):
+            cache.set(_key('amount_type', name), amount_type, _timeout())
+    return amount_type
+
+
+async def aget_item_types(barcodes):
+    """Async version of get_item_types."""
+    barcodes = set(barcodes)
+    if not barcodes:
+        return {}
+    cache = _cache()
+    found, misses = _split(
+        'item_type', barcodes, await cache.aget_many([_key('item_type', code) for code in barcodes])
+    )
+
+    if misses:
+        loaded = {
+            item_type.unique_barcode: item_type
+            async for item_type in ItemType.objects.filter(unique_barcode__in=misses)
+        }
+        if loaded:
+            await cache.aset_many(
+                {_key('item_type', code): item_type for code, item_type in loaded.items()}, _timeout()
+            )
+        found.update(loaded)
+
+    return found
+
+
+async def aget_amount_type(name):
+    """Async version of get_amount_type."""
+    cache = _cache()
+    amount_type = await cache.aget(_key('amount_type', name))
+    _count('amount_type', amount_type is not None, amount_type is None)
+    if amount_type is None:
+        amount_type = await AmountType.objects.filter(name=name).afirst()
+        if amount_type is not None:
+            await cache.aset(_key('amount_type', name), amount_type, _timeout())
+    return amount_type
+
+
+def _forget(keys, using):
+    cache = _cache()
+    cache.delete_many(keys)
+    # A lookup made before the change committed may have cached the old row again.
+    transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+def forget_item_types(barcodes, using='default'):
+    """Drops the cached item types of `barcodes`, now and when the current transaction on `using` commits."""
+    _forget([_key('item_type', barcode) for barcode in barcodes], using)
+
+
+@receiver([post_save, post_delete], sender=ItemType)
+def invalidate_item_type(sender, instance, using, **kwargs):
+    forget_item_types([instance.unique_barcode], using)
+
+
+@receiver([post_save, post_delete], sender=AmountType)
+def invalidate_amount_type(sender, instance, using, **kwargs):
+    _forget([_key('amount_type', instance.name)], using)
@@ -0,0 +1,168 @@
+"""
+Streaming import and export of the ItemType catalog as CSV or NDJSON.
+
+Both formats carry the fields of the new_type endpoint: unique_barcode, name
+and amount_type. Imports read their input one record at a time and upsert it
+in batches, each in its own transaction, so memory use and lock hold times stay
+constant however long the file is. Exports stream the catalog in barcode order.
+"""
+import csv
+import io
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from .cache import forget_item_types
+from .codec import dumps
+from .households import replicate_on_commit
+from .models import AmountType, ItemType
+from .schema import NEW_TYPE, NOT_UTF8_LINE, read_ndjson
+
+CATALOG_BATCH_SIZE = 2000
+CATALOG_MAX_ERRORS = 100
+CATALOG_FIELDS = ('unique_barcode', 'name', 'amount_type')
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def read_csv(lines):
+    """
+    Yields (line number, record) for each row of a CSV file with a header row,
+    and (line number, NOT_UTF8_LINE) for each line that is not valid UTF-8. Those
+    lines are read as blank, which the CSV reader skips.
+    """
+    undecodable = []
+
+    def decoded():
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                try:
+                    line = line.decode('utf-8')
+                except UnicodeDecodeError:
+                    undecodable.append(number)
+                    line = '\n'
+            yield line
+
+    reader = csv.DictReader(decoded())
+    for record in reader:
+        while undecodable:
+            yield undecodable.pop(0), NOT_UTF8_LINE
+        yield reader.line_num, record
+    for number in undecodable:
+        yield number, NOT_UTF8_LINE
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+def import_catalog(records, batch_size=CATALOG_BATCH_SIZE):
+    """
+    Upserts the ItemTypes described by `records`, an iterable of (line number,
+    record) pairs from one of the READERS.
+
+    Amount types that do not exist yet are created. Each batch is one
+    transaction holding a bulk_create(update_conflicts=True) of its item types;
+    when a barcode appears twice in a batch the later record wins. Invalid
+    records are skipped and reported, up to CATALOG_MAX_ERRORS of them.
+    Returns a report dict.
+    """
+    report = {'imported': 0, 'total': 0, 'batches': 0, 'amountTypesCreated': 0, 'errorCount': 0, 'errors': []}
+    records = iter(records)
+
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            return report
+
+        batch = {}
+        for line, record in chunk:
+            cleaned, message = NEW_TYPE.clean(record)
+            if message:
+                report['errorCount'] += 1
+                if len(report['errors']) < CATALOG_MAX_ERRORS:
+                    report['errors'].append({'line': line, 'message': message})
+                continue
+            batch[cleaned['unique_barcode']] = cleaned
+
+        report['total'] += len(chunk)
+        if batch:
+            report['amountTypesCreated'] += _upsert_item_types(batch.values())
+            report['imported'] += len(batch)
+            report['batches'] += 1
+
+
+def _upsert_item_types(rows):
+    """Upserts one batch of cleaned rows. Returns the number of amount types created."""
+    names = {row['amount_type'] for row in rows}
+
+    with transaction.atomic():
+        existing = set(AmountType.objects.filter(name__in=names).values_list('name', flat=True))
+        AmountType.objects.bulk_create([AmountType(name=name) for name in names - existing], ignore_conflicts=True)
+        ItemType.objects.bulk_create(
+            [
+                ItemType(unique_barcode=row['unique_barcode'], name=row['name'], amount_type_id=row['amount_type'])
+                for row in rows
+            ],
+            update_conflicts=True,
+            unique_fields=['unique_barcode'],
+            update_fields=['name', 'amount_type'],
+        )
+        replicate_on_commit(row['unique_barcode'] for row in rows)
+
+    # bulk_create sends no post_save signals, so drop the cached copies here.
+    forget_item_types([row['unique_barcode'] for row in rows])
+
+    return len(names - existing)
+
+
+def _catalog_rows(using):
+    items = ItemType.objects.using(using).order_by('unique_barcode')
+    return items.values_list('unique_barcode', 'name', 'amount_type_id')
+
+
+def _encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CATALOG_FIELDS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _encode_ndjson(rows):
+    return b''.join(dumps(dict(zip(CATALOG_FIELDS, row))) + b'\n' for row in rows)
+
+
+def _next_batch(rows):
+    return list(islice(rows, CATALOG_BATCH_SIZE))
+
+
+def export_catalog(format, using='default'):
+    """Yields the catalog as chunks of CSV or NDJSON, reading CATALOG_BATCH_SIZE item types at a time."""
+    encode = _encode_csv if format == 'csv' else _encode_ndjson
+    if format == 'csv':
+        yield _encode_csv([], header=True)
+
+    rows = _catalog_rows(using).iterator(chunk_size=CATALOG_BATCH_SIZE)
+    while batch := _next_batch(rows):
+        yield encode(batch)
+
+
+async def aexport_catalog(format, using='default'):
+    """
+    Async version of export_catalog. Each batch is read in one sync_to_async
+    call; QuerySet.aiterator() would run the values_list() query on the event
+    loop.
+    """
+    encode = _encode_csv if format == 'csv' else _encode_ndjson
+    if format == 'csv':
+        yield _encode_csv([], header=True)
+
+    rows = _catalog_rows(using).iterator(chunk_size=CATALOG_BATCH_SIZE)
+    next_batch = sync_to_async(_next_batch)
+    while batch := await next_batch(rows):
+        yield encode(batch)
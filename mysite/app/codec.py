@@ -0,0 +1,74 @@
+"""
+JSON encoding and decoding for the API.
+
+The fastest installed backend is used (orjson, then msgspec, then the standard
+library) unless settings.JSON_BACKEND names one explicitly. `dumps` always
+returns bytes.
+"""
+import json
+from django.conf import settings
+from django.http import HttpResponse
+
+
+def _stdlib_backend():
+    return json.loads, lambda obj: json.dumps(obj).encode(), (json.JSONDecodeError,)
+
+
+def _orjson_backend():
+    import orjson
+    return orjson.loads, orjson.dumps, (orjson.JSONDecodeError,)
+
+
+def _msgspec_backend():
+    import msgspec
+    return msgspec.json.decode, msgspec.json.encode, (msgspec.DecodeError,)
+
+
+BACKENDS = {
+    'orjson': _orjson_backend,
+    'msgspec': _msgspec_backend,
+    'json': _stdlib_backend,
+}
+
+
+def _load_backend():
+    name = getattr(settings, 'JSON_BACKEND', None)
+    if name:
+        return name, BACKENDS[name]()
+
+    for name in ['orjson', 'msgspec']:
+        try:
+            return name, BACKENDS[name]()
+        except ImportError:
+            continue
+    return 'json', _stdlib_backend()
+
+
+BACKEND, (loads, dumps, JSONDecodeError) = _load_backend()
+
+
+def json_response(payload, status=200):
+    return HttpResponse(dumps(payload), status=status, content_type='application/json')
+
+
+def error_response(message, status=400):
+    return json_response({'status': 'error', 'message': message}, status=status)
+
+
+class Payload:
+    """A constant response body, serialized once when the module is imported."""
+
+    def __init__(self, payload, status=200):
+        self.content = dumps(payload)
+        self.status = status
+
+    def response(self):
+        return HttpResponse(self.content, status=self.status, content_type='application/json')
+
+
+def success(message):
+    return Payload({'status': 'success', 'message': message})
+
+
+def error(message, status=400):
+    return Payload({'status': 'error', 'message': message}, status=status)
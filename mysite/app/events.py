@@ -0,0 +1,238 @@
+"""
+Change feed for the fridge and the shopping list, served as server-sent events.
+
+The write paths in inventory.py publish an event once their transaction has
+committed:
+
+    items.added            {"itemTypes": [{"itemType", "amount", "count"}, ...]}
+    items.removed          {"itemTypes": [{"itemType", "amount", "count"}, ...]}
+    shopping-list.changed  {"itemTypes": ["<barcode>", ...]}
+
+"itemTypes" is null when an event touches more than EVENTS_MAX_ITEM_TYPES item
+types; clients should then refetch what they show.
+
+Events are encoded once and fanned out by an in-process bus to every
+subscribed client, each through a bounded queue. A client that falls
+EVENTS_CLIENT_QUEUE_SIZE events behind is sent an `overflow` event and
+disconnected, rather than buffering without limit; it reconnects with the
+Last-Event-ID header and is replayed whatever is still in the bus's buffer of
+the last EVENTS_REPLAY_SIZE events. If its position is no longer available,
+or it was issued by another process, it is sent a `reset` event first,
+meaning "refetch everything".
+
+EVENTS_BROKER names the class that carries events between processes. The
+default LocalBroker only serves the process the write happened in;
+UnixSocketBroker relays events between the worker processes of one host.
+Sequence numbers are per process in either case.
+
+Each household (app/households.py) has a feed of its own. Events are published
+under the database alias of the transaction that made them, and a stream only
+receives the events of the database it was opened for.
+"""
+import asyncio
+import glob
+import os
+import secrets
+import socket
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.module_loading import import_string
+from .codec import dumps, loads
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Subscription:
+    """One connected client: a bounded queue of encoded events of one topic, fed on its event loop."""
+
+    def __init__(self, topic, last_seq, max_size):
+        self.topic = topic
+        self.queue = asyncio.Queue(max_size)
+        self.last_seq = last_seq
+        self.overflowed = False
+
+    def push(self, topic, seq, message):
+        if self.overflowed or topic != self.topic or seq <= self.last_seq:
+            return
+        try:
+            self.queue.put_nowait(message)
+            self.last_seq = seq
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventBus:
+    """Numbers, buffers and fans out events to the subscriptions of this process."""
+
+    def __init__(self, replay_size):
+        self.id = secrets.token_hex(4)
+        self.seq = 0
+        self.replay = deque(maxlen=replay_size)
+        self.subscriptions = {}  # event loop -> set of Subscriptions
+        self.lock = threading.Lock()
+
+    def publish(self, kind, data, topic=DEFAULT_DB_ALIAS):
+        """Delivers an event to every subscription to `topic`. Safe to call from any thread."""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            message = f'id: {self.id}-{seq}\nevent: {kind}\ndata: '.encode() + dumps(data) + b'\n\n'
+            self.replay.append((seq, topic, message))
+            loops = list(self.subscriptions.items())
+
+        # One callback per event loop, however many clients it serves.
+        for loop, subscriptions in loops:
+            loop.call_soon_threadsafe(self._deliver, subscriptions, topic, seq, message)
+
+    @staticmethod
+    def _deliver(subscriptions, topic, seq, message):
+        for subscription in list(subscriptions):
+            subscription.push(topic, seq, message)
+
+    def subscribe(self, last_event_id, topic=DEFAULT_DB_ALIAS):
+        """
+        Registers a subscription to `topic` on the running event loop. Returns
+        it with the messages to send first: buffered events of the topic after
+        `last_event_id`, or a reset event if they are not all available.
+        """
+        loop = asyncio.get_running_loop()
+        bus_id, _, seq = (last_event_id or '').partition('-')
+
+        with self.lock:
+            oldest = self.replay[0][0] if self.replay else self.seq + 1
+            resumable = bus_id == self.id and seq.isdigit() and oldest - 1 <= int(seq) <= self.seq
+            after = int(seq) if resumable else self.seq
+            backlog = [
+                message for event_seq, event_topic, message in self.replay
+                if event_seq > after and event_topic == topic
+            ] if resumable else []
+            subscription = Subscription(topic, self.seq, _setting('EVENTS_CLIENT_QUEUE_SIZE', 100))
+            self.subscriptions.setdefault(loop, set()).add(subscription)
+
+        if last_event_id and not resumable:
+            backlog.insert(0, f'id: {self.id}-{after}\nevent: reset\ndata: {{}}\n\n'.encode())
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            subscriptions = self.subscriptions.get(loop, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(loop, None)
+
+
+class LocalBroker:
+    """Delivers events to the bus of the publishing process only."""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def publish(self, kind, data, topic=DEFAULT_DB_ALIAS):
+        self.bus.publish(kind, data, topic)
+
+
+class UnixSocketBroker(LocalBroker):
+    """
+    Also relays events to the other processes on this host that use the same
+    EVENTS_BROKER_DIR, as datagrams between per-process Unix sockets. Each
+    process receives on a daemon thread.
+    """
+
+    def __init__(self, bus):
+        super().__init__(bus)
+        self.directory = _setting('EVENTS_BROKER_DIR', '/tmp/mysite-events')
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f'{os.getpid()}.sock')
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        threading.Thread(target=self._receive, name='events-broker', daemon=True).start()
+
+    def publish(self, kind, data, topic=DEFAULT_DB_ALIAS):
+        super().publish(kind, data, topic)
+        datagram = dumps([kind, data, topic])
+        for peer in glob.glob(os.path.join(self.directory, '*.sock')):
+            if peer == self.path:
+                continue
+            try:
+                self.socket.sendto(datagram, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The process that owned the socket has exited.
+                try:
+                    os.remove(peer)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _receive(self):
+        while True:
+            kind, data, topic = loads(self.socket.recv(1 << 20))
+            self.bus.publish(kind, data, topic)
+
+
+bus = EventBus(_setting('EVENTS_REPLAY_SIZE', 1000))
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(_setting('EVENTS_BROKER', 'app.events.LocalBroker'))(bus)
+    return _broker
+
+
+def _item_types(values):
+    return values if len(values) <= _setting('EVENTS_MAX_ITEM_TYPES', 500) else None
+
+
+def publish_on_commit(kind, data, using=None):
+    """
+    Publishes the event to the topic of database `using` once its current
+    transaction commits, or now outside of one.
+    """
+    topic = using or DEFAULT_DB_ALIAS
+    transaction.on_commit(lambda: broker().publish(kind, data, topic), using=topic)
+
+
+def items_changed(kind, stock, using=None):
+    """Publishes items.added or items.removed for (barcode, amount, count) triples."""
+    publish_on_commit(kind, {'itemTypes': _item_types([
+        {'itemType': barcode, 'amount': amount, 'count': count} for barcode, amount, count in stock
+    ])}, using)
+
+
+def shopping_list_changed(barcodes, using=None):
+    publish_on_commit('shopping-list.changed', {'itemTypes': _item_types(sorted(barcodes))}, using)
+
+
+async def stream(last_event_id=None, topic=DEFAULT_DB_ALIAS):
+    """
+    Subscribes to `topic` on the bus and yields SSE messages, starting after
+    `last_event_id`, until the client disconnects or overflows. A comment is
+    sent every EVENTS_HEARTBEAT_SECONDS so that proxies keep idle streams open.
+    """
+    heartbeat = _setting('EVENTS_HEARTBEAT_SECONDS', 15)
+    broker()  # A broker that relays between processes starts receiving here.
+    subscription, backlog = bus.subscribe(last_event_id, topic)
+    try:
+        yield b'retry: 1000\n\n' + b''.join(backlog)
+
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                yield b'event: overflow\ndata: {}\n\n'
+                return
+            try:
+                yield await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+    finally:
+        bus.unsubscribe(subscription)
@@ -0,0 +1,136 @@
+"""
+The inventory history: an append-only log of every change to the fridge and
+the shopping list, rolled up into one row per item type per day.
+
+The write paths in inventory.py call record() in their own transaction, so an
+event is stored exactly when its change commits. A write appends all of its
+events with one multi-row INSERT per batch, one row per (operation, item type,
+expiry). Fridge events carry the signed change in stock; "listed" events carry
+the signed change to the shopping list and do not count towards stock.
+
+compact(), run by `manage.py compact_history`, replaces the events of each
+UTC day before a cutoff with DailyStock rows holding the day's additions,
+consumption, removals and shopping list changes, and the stock at the end of
+the day. One day is compacted per transaction, so the write lock is never held
+for long.
+
+stock_at() answers stock at a point in time from the last DailyStock row
+before that day plus the events still in the log, which are found on the
+(item_type, occurred_at) index: only the uncompacted tail of the history is
+read, however long ago it started. Within a compacted day, changes are only
+known to the day, and the stock at the start of that day is returned.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db import connections, transaction
+from django.utils import timezone
+from .models import DailyStock, InventoryEvent
+
+# Fridge operations; "baseline" records the stock that was already there when the history began.
+STOCK_OPS = ('baseline', 'added', 'purchased', 'consumed', 'removed')
+OPS = STOCK_OPS + ('listed',)
+
+
+def record(op, entries, using):
+    """
+    Appends an `op` event for each (barcode, delta, expiration date) in
+    `entries` to the log of `using`, with a single INSERT per batch. Must run
+    in the transaction that makes the change.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(InventoryEvent._meta.db_table)
+    occurred_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (occurred_at, op, barcode, delta, connection.ops.adapt_datefield_value(expiration_date))
+        for barcode, delta, expiration_date in entries
+    ]
+    batch_size = connection.features.max_query_params // 5
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} (occurred_at, op, item_type, delta, expiration_date) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))}',
+                [param for row in batch for param in row]
+            )
+
+
+def _start_of(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def compact(before, using):
+    """
+    Rolls the events of every UTC day before the date `before` in the log of
+    `using` into DailyStock rows and deletes them, oldest day first and one day
+    per transaction. Returns the number of days and of events compacted.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(InventoryEvent._meta.db_table)
+    daily_table = connection.ops.quote_name(DailyStock._meta.db_table)
+    stock_ops = ', '.join(f"'{op}'" for op in STOCK_OPS)
+    days = 0
+    compacted = 0
+
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f'SELECT date(MIN(occurred_at)) FROM {table}')
+            oldest, = cursor.fetchone()
+            if oldest is None or datetime.strptime(oldest, '%Y-%m-%d').date() >= before:
+                return days, compacted
+
+            day = datetime.strptime(oldest, '%Y-%m-%d').date()
+            end = connection.ops.adapt_datetimefield_value(_start_of(day + timedelta(days=1)))
+            cursor.execute(
+                f'INSERT INTO {daily_table} (item_type, day, added, consumed, removed, listed, amount) '
+                f'SELECT event.item_type, %s, '
+                f"SUM(CASE WHEN op IN ('added', 'purchased') THEN delta ELSE 0 END), "
+                f"-SUM(CASE WHEN op = 'consumed' THEN delta ELSE 0 END), "
+                f"-SUM(CASE WHEN op = 'removed' THEN delta ELSE 0 END), "
+                f"SUM(CASE WHEN op = 'listed' THEN delta ELSE 0 END), "
+                f'COALESCE(('
+                f'SELECT previous.amount FROM {daily_table} AS previous '
+                f'WHERE previous.item_type = event.item_type ORDER BY previous.day DESC LIMIT 1'
+                f'), 0) + SUM(CASE WHEN op IN ({stock_ops}) THEN delta ELSE 0 END) '
+                f'FROM {table} AS event WHERE occurred_at < %s GROUP BY event.item_type',
+                [connection.ops.adapt_datefield_value(day), end]
+            )
+            cursor.execute(f'DELETE FROM {table} WHERE occurred_at < %s', [end])
+            days += 1
+            compacted += cursor.rowcount
+
+
+def stock_at(barcodes, at, using):
+    """
+    Returns {barcode: (amount, exact)} with the stock of each barcode at the
+    aware datetime `at`. `exact` is False when the barcode changed during a
+    compacted day containing `at`; its amount is then the stock at the start
+    of that day.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(InventoryEvent._meta.db_table)
+    daily_table = connection.ops.quote_name(DailyStock._meta.db_table)
+    stock_ops = ', '.join(f"'{op}'" for op in STOCK_OPS)
+    day = connection.ops.adapt_datefield_value(at.astimezone(dt_timezone.utc).date())
+    at = connection.ops.adapt_datetimefield_value(at)
+    batch_size = connection.features.max_query_params - 3
+    stock = {}
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(barcodes), batch_size):
+            batch = barcodes[start:start + batch_size]
+            cursor.execute(
+                f'SELECT requested.column1, COALESCE(('
+                f'SELECT amount FROM {daily_table} '
+                f'WHERE item_type = requested.column1 AND day < %s ORDER BY day DESC LIMIT 1'
+                f'), 0) + COALESCE(('
+                f'SELECT SUM(delta) FROM {table} '
+                f'WHERE item_type = requested.column1 AND occurred_at <= %s AND op IN ({stock_ops})'
+                f'), 0), NOT EXISTS ('
+                f'SELECT 1 FROM {daily_table} WHERE item_type = requested.column1 AND day = %s'
+                f') FROM (VALUES {", ".join(["(%s)"] * len(batch))}) AS requested',
+                [day, at, day] + batch
+            )
+            stock.update((barcode, (amount, bool(exact))) for barcode, amount, exact in cursor.fetchall())
+
+    return stock
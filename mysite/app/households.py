@@ -0,0 +1,239 @@
+"""
+Households, each with a fridge in a SQLite database of its own.
+
+settings.HOUSEHOLDS names the households, and each one has a database alias
+"household_<name>" (see mysite/settings.py). Requests choose a household with
+the X-Household header. HouseholdMiddleware resolves it into a context
+variable, like the request metrics in metrics.py, and HouseholdRouter sends
+every query on the fridge models (IndividualItem, ShoppingList, StockSummary,
+ParLevel, the idempotency keys and the inventory history) to that household's
+database. Writes to different households therefore never wait for the same
+SQLite write lock. Requests without the header, management commands and
+scripts use the "default" database, as they did before there were households.
+
+The catalog (ItemType and AmountType) is only written to "default". Every
+household database holds a read-only replica of it for its foreign keys and
+joins: catalog writes copy the rows they changed into the replicas when their
+transaction commits, and `manage.py sync_households` creates the household
+databases and copies the whole catalog into them.
+"""
+import contextvars
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from . import events, history
+from .codec import error
+from .models import (
+    AmountType, DailyStock, IdempotencyKey, IndividualItem, InventoryEvent, ItemType, ParLevel, ShoppingList, StockSummary
+)
+
+HOUSEHOLD_HEADER = 'X-Household'
+FRIDGE_MODELS = frozenset([
+    DailyStock, IdempotencyKey, IndividualItem, InventoryEvent, ParLevel, ShoppingList, StockSummary
+])
+UNKNOWN_HOUSEHOLD = error('Unknown household')
+
+_database = contextvars.ContextVar('household_database', default=DEFAULT_DB_ALIAS)
+
+
+def database_for(household):
+    return f'household_{household}'
+
+
+def household_databases():
+    """The database aliases of settings.HOUSEHOLDS."""
+    return [database_for(household) for household in getattr(settings, 'HOUSEHOLDS', [])]
+
+
+def databases():
+    """Every database holding a fridge: "default" and those of the households."""
+    return [DEFAULT_DB_ALIAS] + household_databases()
+
+
+def current_database():
+    """The database of the household being served."""
+    return _database.get()
+
+
+def read_database():
+    """Where the household being served reads its fridge from: READ_DATABASE for "default"."""
+    database = _database.get()
+    return settings.READ_DATABASE if database == DEFAULT_DB_ALIAS else database
+
+
+@contextmanager
+def using(database):
+    """Serves the household whose database is `database` for the duration of the block."""
+    token = _database.set(database)
+    try:
+        yield
+    finally:
+        _database.reset(token)
+
+
+@contextmanager
+def atomic(catalog=False):
+    """
+    A transaction on the current household's database and, with `catalog`,
+    one on "default" as well, for requests made on a household's behalf that
+    write catalog rows. Without it only the household's write lock is taken;
+    catalog writes made anyway commit on their own and are replicated then.
+    The catalog commits first, so item types it adds are replicated to the
+    household before the household commits rows that refer to them. Yields
+    the databases, for transaction.set_rollback().
+    """
+    databases = list(dict.fromkeys([_database.get(), DEFAULT_DB_ALIAS] if catalog else [_database.get()]))
+    with ExitStack() as transactions:
+        for database in databases:
+            transactions.enter_context(transaction.atomic(using=database))
+        yield databases
+
+
+class HouseholdRouter:
+    """Routes the fridge models to the current household's database, and catalog writes to "default"."""
+
+    def db_for_read(self, model, **hints):
+        return _database.get() if model in FRIDGE_MODELS else None
+
+    def db_for_write(self, model, **hints):
+        return _database.get() if model in FRIDGE_MODELS else DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Fridge rows refer to item types by barcode, which is the same in every replica.
+        return True
+
+
+def _request_database(request):
+    """Returns the database of the household named by the request, or None if there is no such household."""
+    household = request.headers.get(HOUSEHOLD_HEADER)
+    if not household:
+        return DEFAULT_DB_ALIAS
+    if household not in getattr(settings, 'HOUSEHOLDS', []):
+        return None
+    return database_for(household)
+
+
+def _vary(response):
+    if getattr(settings, 'HOUSEHOLDS', []):
+        patch_vary_headers(response, [HOUSEHOLD_HEADER])
+    return response
+
+
+class HouseholdMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        database = _request_database(request)
+        if database is None:
+            return UNKNOWN_HOUSEHOLD.response()
+        with using(database):
+            return _vary(self.get_response(request))
+
+    async def __acall__(self, request):
+        database = _request_database(request)
+        if database is None:
+            return UNKNOWN_HOUSEHOLD.response()
+        with using(database):
+            return _vary(await self.get_response(request))
+
+
+def _batches(values, size):
+    values = iter(values)
+    while batch := list(islice(values, size)):
+        yield batch
+
+
+def _replicate_into(database, amount_types, item_types, stale):
+    """Applies one household's share of replicate_catalog in a transaction on its database."""
+    with transaction.atomic(using=database):
+        AmountType.objects.using(database).bulk_create(amount_types, ignore_conflicts=True)
+        for batch in _batches(item_types, connections[database].features.max_query_params // 3):
+            ItemType.objects.using(database).bulk_create(
+                batch, update_conflicts=True, unique_fields=['unique_barcode'], update_fields=['name', 'amount_type']
+            )
+
+        for batch in _batches(stale, connections[database].features.max_query_params):
+            delete_item_types(batch, database)
+        AmountType.objects.using(database).exclude(name__in=[amount_type.name for amount_type in amount_types]).delete()
+
+
+def delete_item_types(barcodes, database):
+    """
+    Deletes the item types in `barcodes` from `database`. Deleting through the
+    collector also removes the fridge rows that refer to them; the shopping
+    list entries among those are logged as "listed" events and published.
+    """
+    with transaction.atomic(using=database):
+        listed = list(
+            ShoppingList.objects.using(database).filter(item_type_id__in=barcodes).values_list('item_type_id', 'amount')
+        )
+        ItemType.objects.using(database).filter(unique_barcode__in=barcodes).delete()
+        if listed:
+            events.shopping_list_changed([barcode for barcode, _ in listed], database)
+            history.record('listed', [(barcode, -amount, None) for barcode, amount in listed], database)
+
+
+def replicate_catalog(barcodes=None):
+    """
+    Copies the catalog from "default" into the replica of every household: all
+    amount types, and the item types in `barcodes`, or all of them when it is
+    None. Item types that are no longer in the catalog are deleted from the
+    replicas, together with the household rows that refer to them. Returns the
+    number of item types copied.
+    """
+    amount_types = list(AmountType.objects.using(DEFAULT_DB_ALIAS))
+    item_types = ItemType.objects.using(DEFAULT_DB_ALIAS).order_by('unique_barcode')
+    if barcodes is None:
+        item_types = list(item_types)
+    else:
+        barcodes = list(barcodes)
+        batch_size = connections[DEFAULT_DB_ALIAS].features.max_query_params
+        item_types = [
+            item_type for batch in _batches(barcodes, batch_size)
+            for item_type in item_types.filter(unique_barcode__in=batch)
+        ]
+
+    present = {item_type.unique_barcode for item_type in item_types}
+    for database in household_databases():
+        if barcodes is None:
+            replica = ItemType.objects.using(database).values_list('unique_barcode', flat=True)
+            stale = set(replica.iterator()) - present
+        else:
+            stale = set(barcodes) - present
+        _replicate_into(database, amount_types, item_types, sorted(stale))
+
+    return len(item_types)
+
+
+def replicate_on_commit(barcodes):
+    """Replicates the item types in `barcodes` once the current transaction on "default" commits."""
+    if household_databases():
+        barcodes = list(barcodes)
+        transaction.on_commit(lambda: replicate_catalog(barcodes), using=DEFAULT_DB_ALIAS)
+
+
+@receiver([post_save, post_delete], sender=ItemType)
+def replicate_item_type(sender, instance, using, **kwargs):
+    # The replicas are written through bulk_create and delete(); only changes to the catalog itself are copied.
+    if using == DEFAULT_DB_ALIAS:
+        replicate_on_commit([instance.unique_barcode])
+
+
+@receiver([post_save, post_delete], sender=AmountType)
+def replicate_amount_type(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        replicate_on_commit([])
@@ -0,0 +1,222 @@
+"""
+Idempotency-Key support for the write endpoints.
+
+A client that may retry a write (a scanner on flaky Wi-Fi, say) sends a unique
+`Idempotency-Key` header with it. The first request with a key runs the view
+and stores its response, in the same transaction, in the IdempotencyKey table
+of the household's database. A retry with the same key is answered with the
+stored response and an `Idempotent-Replayed: true` header, after one lookup by
+key that touches no inventory table. A key sent again with a different method,
+path or body is refused with 422.
+
+Responses with a 5xx status are neither stored nor committed, so the request
+can be retried. With the tuned SQLite profile every transaction begins
+IMMEDIATE, so a retry that arrives while the first attempt is still running
+waits for it and is then answered from the stored response.
+
+Keys expire after IDEMPOTENCY_TTL_SECONDS, and a database keeps at most
+IDEMPOTENCY_MAX_KEYS of them. Every stored response evicts, from among the
+IDEMPOTENCY_EVICT_BATCH oldest keys, those that have expired or are over that
+limit, so eviction costs the same however large the table is.
+
+Sync views are wrapped with @idempotent, or @idempotent(catalog=True) if they
+write the catalog, so that other writes do not take the catalog's write lock.
+The catalog import reads its body as a stream and commits in batches; it is
+wrapped with @idempotent(streamed=True), which hashes the body as it is read.
+Django has no async transactions, so the async views are wrapped with
+@aidempotent(sync_view), which hands requests that carry a key to the matching
+sync view in one sync_to_async call.
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from . import households
+from .codec import error
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_EVICT_BATCH = 100
+STREAM_CHUNK_SIZE = 64 * 1024
+KEY_TOO_LONG = error(f'{IDEMPOTENCY_HEADER} must be at most 255 characters')
+KEY_REUSED = error(f'{IDEMPOTENCY_HEADER} was already used for a different request', status=422)
+
+
+def _digest(request):
+    return hashlib.sha256(f'{request.method} {request.get_full_path()}\n'.encode())
+
+
+def _fingerprint(request):
+    digest = _digest(request)
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+class _HashingStream:
+    """Wraps a request body stream, adding what is read from it to `digest`."""
+
+    def __init__(self, stream, digest):
+        self.stream = stream
+        self.digest = digest
+
+    def read(self, *args, **kwargs):
+        data = self.stream.read(*args, **kwargs)
+        self.digest.update(data)
+        return data
+
+    def readline(self, *args, **kwargs):
+        line = self.stream.readline(*args, **kwargs)
+        self.digest.update(line)
+        return line
+
+
+def _drain(request):
+    while request.read(STREAM_CHUNK_SIZE):
+        pass
+
+
+def _replay(record):
+    fingerprint, status, content_type, content = record
+    response = HttpResponse(bytes(content), status=status, content_type=content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _lookup(key, now):
+    """Returns (fingerprint, status, content type, content) stored for `key`, or None."""
+    connection = connections[households.current_database()]
+    table = connection.ops.quote_name(IdempotencyKey._meta.db_table)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT fingerprint, status, content_type, content FROM {table} '
+            f'WHERE {connection.ops.quote_name("key")} = %s AND expires_at > %s',
+            [key, connection.ops.adapt_datetimefield_value(now)]
+        )
+        return cursor.fetchone()
+
+
+def _store(key, fingerprint, response, now):
+    """Upserts the response to `key` and evicts old keys, with one statement each."""
+    connection = connections[households.current_database()]
+    table = connection.ops.quote_name(IdempotencyKey._meta.db_table)
+    key_column = connection.ops.quote_name('key')
+    expires_at = now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({key_column}, fingerprint, status, content_type, content, expires_at) '
+            f'VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT ({key_column}) DO UPDATE SET fingerprint = excluded.fingerprint, '
+            f'status = excluded.status, content_type = excluded.content_type, content = excluded.content, '
+            f'expires_at = excluded.expires_at '
+            f'RETURNING id',
+            [key, fingerprint, response.status_code, response['Content-Type'], response.content,
+             connection.ops.adapt_datetimefield_value(expires_at)]
+        )
+        newest, = cursor.fetchone()
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT id FROM (SELECT id, expires_at FROM {table} ORDER BY id LIMIT %s) '
+            f'WHERE expires_at <= %s OR id <= %s)',
+            [IDEMPOTENCY_EVICT_BATCH, connection.ops.adapt_datetimefield_value(now),
+             newest - getattr(settings, 'IDEMPOTENCY_MAX_KEYS', 100000)]
+        )
+
+
+def idempotent(view=None, *, catalog=False, streamed=False):
+    """
+    Decorates a sync write view so that requests with an Idempotency-Key are
+    answered once and replayed after. The view runs in a transaction on the
+    household's database, and with @idempotent(catalog=True), for views that
+    write the catalog, on "default" as well (see households.atomic).
+
+    @idempotent(streamed=True) is for views that read the body as a stream and
+    commit as they go: see _streamed_idempotent.
+    """
+    if view is None:
+        return lambda view: idempotent(view, catalog=catalog, streamed=streamed)
+    if streamed:
+        return _streamed_idempotent(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return KEY_TOO_LONG.response()
+
+        fingerprint = _fingerprint(request)
+        now = timezone.now()
+        with households.atomic(catalog) as using:
+            record = _lookup(key, now)
+            if record is not None:
+                return _replay(record) if record[0] == fingerprint else KEY_REUSED.response()
+
+            response = view(request, *args, **kwargs)
+            if response.status_code >= 500 or response.streaming:
+                for database in using:
+                    transaction.set_rollback(True, using=database)
+                return response
+
+            _store(key, fingerprint, response, now)
+        return response
+
+    return wrapper
+
+
+def _streamed_idempotent(view):
+    """
+    Like @idempotent, but the body is hashed as the view reads it instead of
+    being loaded into memory, and the response is stored after the view, in a
+    transaction of its own. A retry that arrives while the first attempt is
+    still running is therefore run as well, so the view must be safe to repeat.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return KEY_TOO_LONG.response()
+
+        digest = _digest(request)
+        request._stream = _HashingStream(request._stream, digest)
+        now = timezone.now()
+        record = _lookup(key, now)
+        if record is not None:
+            _drain(request)
+            return _replay(record) if record[0] == digest.hexdigest() else KEY_REUSED.response()
+
+        response = view(request, *args, **kwargs)
+        if response.status_code >= 500 or response.streaming:
+            return response
+
+        _drain(request)
+        with transaction.atomic(using=households.current_database()):
+            _store(key, digest.hexdigest(), response, now)
+        return response
+
+    return wrapper
+
+
+def aidempotent(sync_view):
+    """
+    Decorates an async write view so that requests with an Idempotency-Key are
+    served by `sync_view`, which must be decorated with @idempotent.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if IDEMPOTENCY_HEADER in request.headers:
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            return await view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,437 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.deletion import Collector
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from . import events, history
+from .cache import get_item_type, get_item_types
+from .households import current_database
+from .models import IndividualItem, ItemType, ParLevel, ShoppingList, StockSummary
+
+DELETE_CHUNK_SIZE = 5000
+CONSUME_FETCH_SIZE = 256
+# Amounts are floats; differences smaller than this count as an exact match.
+CONSUME_TOLERANCE = 1e-9
+
+
+def settle_purchases(rows):
+    """
+    Moves validated purchases from the shopping list into the fridge.
+
+    `rows` is a list of (index, row) pairs where each row has `itemType`,
+    `amount` and a parsed `expirationDate`. Rows are settled in order against
+    the locked shopping list amounts; a row that cannot be settled is reported
+    in the returned errors and does not affect the others. The whole receipt
+    costs a constant number of queries regardless of its length.
+    """
+    errors = []
+    barcodes = {row['itemType'] for _, row in rows}
+    using = current_database()
+
+    with transaction.atomic(using=using):
+        remaining = dict(
+            ShoppingList.objects.select_for_update()
+            .filter(item_type_id__in=barcodes)
+            .values_list('item_type_id', 'amount')
+        ) if barcodes else {}
+
+        missing = barcodes - remaining.keys()
+        known_missing = get_item_types(missing).keys() if missing else set()
+
+        deltas = {}
+        items = []
+        for index, row in rows:
+            barcode = row['itemType']
+            if barcode not in remaining:
+                message = 'Item not found in shopping list' if barcode in known_missing else 'Item type does not exist'
+                errors.append({'index': index, 'message': message})
+                continue
+
+            if remaining[barcode] < row['amount']:
+                errors.append({'index': index, 'message': 'Not enough amount in shopping list'})
+                continue
+
+            remaining[barcode] -= row['amount']
+            deltas[barcode] = deltas.get(barcode, 0) + row['amount']
+            items.append(IndividualItem(
+                item_type_id=barcode,
+                amount=row['amount'],
+                expiration_date=row['expirationDate']
+            ))
+
+        emptied = [barcode for barcode in deltas if remaining[barcode] <= 0]
+        reduced = [barcode for barcode in deltas if remaining[barcode] > 0]
+
+        if reduced:
+            ShoppingList.objects.filter(item_type_id__in=reduced).update(amount=Case(
+                *[When(item_type_id=barcode, then=F('amount') - Value(deltas[barcode])) for barcode in reduced],
+                output_field=FloatField()
+            ))
+
+        if emptied:
+            ShoppingList.objects.filter(item_type_id__in=emptied).delete()
+
+        if deltas:
+            events.shopping_list_changed(deltas, using)
+            history.record('listed', [(barcode, -delta, None) for barcode, delta in deltas.items()], using)
+
+        if items:
+            IndividualItem.objects.bulk_create(items)
+            add_stock(items, 'purchased')
+
+    return items, errors
+
+
+def store_items(items):
+    """Inserts unsaved IndividualItems and adds them to the stock summary in one transaction."""
+    with transaction.atomic(using=current_database()):
+        IndividualItem.objects.bulk_create(items)
+        add_stock(items)
+    return items
+
+
+def add_stock(items, op='added'):
+    """
+    Adds `items` to the stock summary of their item types, creating summaries
+    as needed with a single INSERT ... ON CONFLICT statement per batch, and
+    records them in the inventory history as `op`. Must run in the transaction
+    that inserts the items, which then publishes an items.added event when it
+    commits.
+    """
+    stock = {}
+    added = {}
+    for item in items:
+        total, count, earliest = stock.get(item.item_type_id, (0, 0, item.expiration_date))
+        stock[item.item_type_id] = (total + item.amount, count + 1, min(earliest, item.expiration_date))
+        key = (item.item_type_id, item.expiration_date)
+        added[key] = added.get(key, 0) + item.amount
+
+    connection = connections[current_database()]
+    table = connection.ops.quote_name(StockSummary._meta.db_table)
+    rows = [
+        (barcode, total, count, connection.ops.adapt_datefield_value(earliest))
+        for barcode, (total, count, earliest) in stock.items()
+    ]
+    batch_size = connection.features.max_query_params // 4
+    events.items_changed(
+        'items.added', [(barcode, total, count) for barcode, (total, count, _) in stock.items()], connection.alias
+    )
+    history.record(op, [(barcode, amount, expiry) for (barcode, expiry), amount in added.items()], connection.alias)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} (item_type_id, total_amount, item_count, earliest_expiry) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (item_type_id) DO UPDATE SET '
+                f'total_amount = {table}.total_amount + excluded.total_amount, '
+                f'item_count = {table}.item_count + excluded.item_count, '
+                f'earliest_expiry = MIN({table}.earliest_expiry, excluded.earliest_expiry)',
+                [param for row in batch for param in row]
+            )
+
+
+def _removed_stock(items):
+    """Returns (item type, expiration date, total amount, item count) for the items about to be deleted."""
+    return list(items.order_by().values_list('item_type_id', 'expiration_date').annotate(Sum('amount'), Count('pk')))
+
+
+def _release_stock(removed, using, op='removed'):
+    """
+    Subtracts the result of _removed_stock from the stock summary once the
+    items are gone, with one UPDATE ... FROM (VALUES ...) per batch, and
+    records it in the inventory history as `op`. The earliest expiry of each
+    affected type is looked up again on the (item_type, expiration_date)
+    index, and summaries left without items are deleted. An items.removed
+    event is published when the transaction commits.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(StockSummary._meta.db_table)
+    item_table = connection.ops.quote_name(IndividualItem._meta.db_table)
+    batch_size = connection.features.max_query_params // 3
+    stock = {}
+    for barcode, _, amount, count in removed:
+        total, total_count = stock.get(barcode, (0, 0))
+        stock[barcode] = (total + amount, total_count + count)
+    released = [(barcode, amount, count) for barcode, (amount, count) in stock.items()]
+    if released:
+        events.items_changed('items.removed', released, using)
+        history.record(op, [(barcode, -amount, expiry) for barcode, expiry, amount, _ in removed], using)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(released), batch_size):
+            batch = released[start:start + batch_size]
+            cursor.execute(
+                f'UPDATE {table} SET '
+                f'total_amount = {table}.total_amount - removed.column2, '
+                f'item_count = {table}.item_count - removed.column3, '
+                f'earliest_expiry = COALESCE(('
+                f'SELECT expiration_date FROM {item_table} AS item '
+                f'WHERE item.item_type_id = {table}.item_type_id ORDER BY expiration_date LIMIT 1'
+                f'), {table}.earliest_expiry) '
+                f'FROM (VALUES {", ".join(["(%s, %s, %s)"] * len(batch))}) AS removed '
+                f'WHERE {table}.item_type_id = removed.column1',
+                [param for row in batch for param in row]
+            )
+            StockSummary.objects.using(using).filter(
+                item_type_id__in=[barcode for barcode, _, _ in batch], item_count__lte=0
+            ).delete()
+
+
+def consume(barcode, amount):
+    """
+    Uses up `amount` of the items of `barcode`, earliest expiry first.
+
+    The whole draw-down is one transaction, so the write lock is held from its
+    first statement. The stock summary is checked, then the items are read in
+    (expiration_date, id) order along the (item_type, expiration_date) index,
+    CONSUME_FETCH_SIZE rows at a time and only as far as needed. Every item
+    used up is removed with a single range DELETE up to the last one, and the
+    item that is only partly used has its amount reduced. Returns (report,
+    None), or (None, error message) without consuming anything.
+    """
+    connection = connections[current_database()]
+    table = connection.ops.quote_name(IndividualItem._meta.db_table)
+
+    with transaction.atomic(using=connection.alias):
+        available = StockSummary.objects.filter(item_type_id=barcode).values_list('total_amount', flat=True).first()
+        if available is None and get_item_type(barcode) is None:
+            return None, 'Item type does not exist'
+        if available is None or available < amount - CONSUME_TOLERANCE:
+            return None, 'Not enough stock'
+
+        remaining = amount
+        removed = 0
+        last_removed = None
+        updated = None
+        # (amount, item count) used up per expiration date, for the inventory history.
+        used = {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id, expiration_date, amount FROM {table} '
+                f'WHERE item_type_id = %s ORDER BY expiration_date, id',
+                [barcode]
+            )
+            while updated is None and remaining > CONSUME_TOLERANCE:
+                rows = cursor.fetchmany(CONSUME_FETCH_SIZE)
+                if not rows:
+                    return None, 'Not enough stock'
+                for item_id, expiration_date, item_amount in rows:
+                    used_amount, used_count = used.get(expiration_date, (0, 0))
+                    if item_amount > remaining + CONSUME_TOLERANCE:
+                        updated = {'ID': item_id, 'amount': item_amount - remaining}
+                        used[expiration_date] = (used_amount + remaining, used_count)
+                        remaining = 0
+                        break
+                    used[expiration_date] = (used_amount + item_amount, used_count + 1)
+                    remaining -= item_amount
+                    removed += 1
+                    last_removed = (expiration_date, item_id)
+                    if remaining <= CONSUME_TOLERANCE:
+                        break
+
+        with connection.cursor() as cursor:
+            if last_removed:
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE item_type_id = %s AND (expiration_date, id) <= (%s, %s)',
+                    [barcode, connection.ops.adapt_datefield_value(last_removed[0]), last_removed[1]]
+                )
+            if updated:
+                cursor.execute(f'UPDATE {table} SET amount = %s WHERE id = %s', [updated['amount'], updated['ID']])
+
+        consumed = amount - remaining
+        _release_stock(
+            [(barcode, expiry, used_amount, count) for expiry, (used_amount, count) in used.items()],
+            connection.alias, 'consumed'
+        )
+
+    return {'consumed': consumed, 'removed': removed, 'updated': updated, 'remaining': available - consumed}, None
+
+
+def rebuild_stock():
+    """Recomputes the whole stock summary from IndividualItem. Returns the number of summaries."""
+    connection = connections[current_database()]
+    table = connection.ops.quote_name(StockSummary._meta.db_table)
+    item_table = connection.ops.quote_name(IndividualItem._meta.db_table)
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        StockSummary.objects.all().delete()
+        cursor.execute(
+            f'INSERT INTO {table} (item_type_id, total_amount, item_count, earliest_expiry) '
+            f'SELECT item_type_id, SUM(amount), COUNT(*), MIN(expiration_date) '
+            f'FROM {item_table} GROUP BY item_type_id'
+        )
+        return cursor.rowcount
+
+
+def upsert_shopping_list(deltas):
+    """
+    Adds each signed delta to the shopping list amount of its barcode.
+
+    `deltas` maps barcodes to amounts. Entries are created or incremented with
+    a single INSERT ... ON CONFLICT statement per batch, so concurrent devices
+    never lose updates; entries that drop to zero or below are removed.
+    Barcodes without an ItemType are skipped. Returns the number of barcodes
+    that were applied, and publishes them in a shopping-list.changed event.
+    The history records the change each entry actually went through, so a
+    removed entry is logged as losing only what it held.
+    """
+    connection = connections[current_database()]
+    table = connection.ops.quote_name(ShoppingList._meta.db_table)
+    item_table = connection.ops.quote_name(ItemType._meta.db_table)
+    deltas = list(deltas.items())
+    batch_size = connection.features.max_query_params // 2
+    applied = []
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for start in range(0, len(deltas), batch_size):
+            batch = deltas[start:start + batch_size]
+            values = ', '.join(['(%s, %s)'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} (item_type_id, amount) '
+                f'SELECT item.unique_barcode, delta.column2 '
+                f'FROM (VALUES {values}) AS delta '
+                f'INNER JOIN {item_table} AS item ON item.unique_barcode = delta.column1 '
+                f'WHERE true '
+                f'ON CONFLICT (item_type_id) DO UPDATE SET amount = {table}.amount + excluded.amount '
+                f'RETURNING item_type_id, amount',
+                [param for pair in batch for param in pair]
+            )
+            applied += cursor.fetchall()
+
+        emptied = [barcode for barcode, amount in applied if amount <= 0]
+        if emptied:
+            ShoppingList.objects.filter(item_type_id__in=emptied).delete()
+
+        if applied:
+            events.shopping_list_changed([barcode for barcode, _ in applied], connection.alias)
+            deltas = dict(deltas)
+            # An entry left at `amount` <= 0 is deleted: it went from amount - delta to nothing.
+            changes = [(barcode, deltas[barcode] - min(amount, 0), None) for barcode, amount in applied]
+            history.record('listed', [change for change in changes if change[1]], connection.alias)
+
+    return len(applied)
+
+
+def replenish(today, dry_run=False):
+    """
+    Tops up the shopping list of every item type with a par level.
+
+    The usable stock of a type is its stock summary minus the items that expire
+    within its expiry horizon of `today`; whatever that and the amount already
+    on the shopping list fall short of the par level is added to the list. All
+    shortfalls come from one aggregate query, which reads the expiring items
+    through the (item_type, expiration_date) index, and are applied with
+    upsert_shopping_list. Returns the added amounts keyed by barcode.
+    """
+    connection = connections[current_database()]
+    par_table = connection.ops.quote_name(ParLevel._meta.db_table)
+    stock_table = connection.ops.quote_name(StockSummary._meta.db_table)
+    list_table = connection.ops.quote_name(ShoppingList._meta.db_table)
+    item_table = connection.ops.quote_name(IndividualItem._meta.db_table)
+    today = connection.ops.adapt_datefield_value(today)
+    default_horizon = settings.REPLENISH_EXPIRY_HORIZON_DAYS
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT item_type_id, shortfall FROM ('
+            f'SELECT par.item_type_id, par.amount - COALESCE(stock.total_amount, 0) '
+            f'+ COALESCE(expiring.amount, 0) - COALESCE(list.amount, 0) AS shortfall '
+            f'FROM {par_table} AS par '
+            f'LEFT JOIN {stock_table} AS stock ON stock.item_type_id = par.item_type_id '
+            f'LEFT JOIN {list_table} AS list ON list.item_type_id = par.item_type_id '
+            f'LEFT JOIN ('
+            f'SELECT item.item_type_id, SUM(item.amount) AS amount '
+            f'FROM {par_table} AS par INNER JOIN {item_table} AS item ON item.item_type_id = par.item_type_id '
+            f"AND item.expiration_date <= date(%s, '+' || COALESCE(par.expiry_horizon_days, %s) || ' days') "
+            f'GROUP BY item.item_type_id'
+            f') AS expiring ON expiring.item_type_id = par.item_type_id'
+            f') WHERE shortfall > 0',
+            [today, default_horizon]
+        )
+        deltas = dict(cursor.fetchall())
+
+        if deltas and not dry_run:
+            upsert_shopping_list(deltas)
+
+    return deltas
+
+
+def decrement_shopping_list(barcode, amount):
+    """
+    Removes `amount` from the shopping list entry of `barcode` with an F()
+    update, deleting the entry once it reaches zero; the history then records
+    only what the entry held. Returns an error message if there is no such
+    entry, or None.
+    """
+    using = current_database()
+
+    with transaction.atomic(using=using):
+        if not ShoppingList.objects.filter(item_type_id=barcode).update(amount=F('amount') - amount):
+            if get_item_type(barcode) is None:
+                return 'Item type does not exist'
+            return 'Item not found in shopping list'
+
+        remaining = ShoppingList.objects.filter(item_type_id=barcode).values_list('amount', flat=True).get()
+        if remaining <= 0:
+            ShoppingList.objects.filter(item_type_id=barcode).delete()
+        events.shopping_list_changed([barcode], using)
+        history.record('listed', [(barcode, -amount - min(remaining, 0), None)], using)
+
+    return None
+
+
+def delete_matching(queryset, chunk_size=DELETE_CHUNK_SIZE):
+    """
+    Deletes every row matched by `queryset`, at most `chunk_size` rows per
+    transaction, so a large purge never holds the write lock for long and never
+    loads the rows into memory.
+
+    When nothing cascades from the model and no delete signals are connected,
+    each chunk is a single DELETE ... WHERE pk IN (SELECT pk ... LIMIT n).
+    Otherwise each chunk goes through Django's collector, and the rows it
+    removes from other models are reported as cascades. Deleted IndividualItems
+    are subtracted from the stock summary in the chunk's transaction. Returns
+    a report dict.
+    """
+    using = queryset.db
+    model = queryset.model
+    fast = Collector(using=using, origin=queryset).can_fast_delete(queryset)
+    report = {'deleted': 0, 'chunks': [], 'fastDelete': fast, 'cascades': {}}
+
+    while True:
+        with transaction.atomic(using=using):
+            chunk = model._base_manager.using(using).filter(pk__in=queryset.values('pk')[:chunk_size])
+            # The write lock is held, so the chunk subquery selects the same rows twice.
+            removed = _removed_stock(chunk) if model is IndividualItem else []
+            if fast:
+                count = chunk._raw_delete(using)
+            else:
+                _, per_model = chunk.delete()
+                count = per_model.pop(model._meta.label, 0)
+                for label, cascaded in per_model.items():
+                    report['cascades'][label] = report['cascades'].get(label, 0) + cascaded
+            _release_stock(removed, using)
+
+        if count:
+            report['deleted'] += count
+            report['chunks'].append(count)
+        if count < chunk_size:
+            return report
+
+
+def delete_ids(model, ids):
+    """Deletes the rows of `model` with the given primary keys, in chunks that fit SQLite's variable limit."""
+    ids = list(ids)
+    chunk_size = min(DELETE_CHUNK_SIZE, connections[current_database()].features.max_query_params)
+    report = {'deleted': 0, 'chunks': [], 'fastDelete': True, 'cascades': {}}
+
+    for start in range(0, len(ids), chunk_size):
+        chunk_report = delete_matching(model.objects.filter(pk__in=ids[start:start + chunk_size]), chunk_size)
+        report['deleted'] += chunk_report['deleted']
+        report['chunks'] += chunk_report['chunks']
+        report['fastDelete'] = report['fastDelete'] and chunk_report['fastDelete']
+        for label, cascaded in chunk_report['cascades'].items():
+            report['cascades'][label] = report['cascades'].get(label, 0) + cascaded
+
+    return report
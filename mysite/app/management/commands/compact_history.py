@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app.history import compact
+from app.households import databases
+
+
+class Command(BaseCommand):
+    help = 'Rolls old inventory events into daily per-item-type aggregates, for every household.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days', type=int, default=settings.HISTORY_KEEP_DAYS,
+            help='keep the events of this many recent days, today included'
+        )
+        parser.add_argument('--interval', type=float, help='keep running, once every this many seconds')
+
+    def handle(self, *args, **options):
+        if options['keep_days'] < 1:
+            raise CommandError('--keep-days must be at least 1')
+
+        while True:
+            self.run_once(options['keep_days'])
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, keep_days):
+        before = timezone.now().date() - timedelta(days=keep_days - 1)
+        for database in databases():
+            start = time.perf_counter()
+            days, events = compact(before, database)
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{database}: compacted {events} events into {days} days in {elapsed:.2f}s'
+            ))
@@ -0,0 +1,34 @@
+import contextlib
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.catalog import CATALOG_BATCH_SIZE, READERS, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Upserts item types from a CSV or NDJSON catalog with unique_barcode, name and amount_type fields.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="catalog file, or '-' for standard input")
+        parser.add_argument('--format', choices=sorted(READERS), help='default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=CATALOG_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in READERS:
+            raise CommandError('Cannot tell the catalog format from the file name; pass --format')
+
+        # Read bytes, so that the readers report lines that are not valid UTF-8 instead of failing.
+        with (open(path, 'rb') if path != '-' else contextlib.nullcontext(sys.stdin.buffer)) as lines:
+            report = import_catalog(READERS[format](lines), batch_size=options['batch_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['message']}")
+        if report['errorCount'] > len(report['errors']):
+            self.stderr.write(f"... and {report['errorCount'] - len(report['errors'])} more errors")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['imported']} of {report['total']} item types in {report['batches']} batches, "
+            f"creating {report['amountTypesCreated']} amount types"
+        ))
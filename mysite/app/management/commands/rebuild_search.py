@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from app.search import rebuild_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index over item type names and barcodes.'
+
+    def handle(self, *args, **options):
+        rebuild_search()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the item type search index'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from app.households import databases, using
+from app.inventory import rebuild_stock
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-item-type stock summary from the individual items, for every household.'
+
+    def handle(self, *args, **options):
+        for database in databases():
+            with using(database):
+                count = rebuild_stock()
+            self.stdout.write(self.style.SUCCESS(f'{database}: rebuilt stock summaries for {count} item types'))
@@ -0,0 +1,43 @@
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app.households import databases, using
+from app.inventory import replenish
+
+
+class Command(BaseCommand):
+    help = 'Adds whatever stock falls short of the par levels to the shopping list.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='report the shortfalls without changing the list')
+        parser.add_argument('--date', help='run as of this date (YYYY-MM-DD) instead of today')
+        parser.add_argument('--interval', type=float, help='keep running, once every this many seconds')
+
+    def handle(self, *args, **options):
+        try:
+            today = datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date'] else None
+        except ValueError:
+            raise CommandError('Invalid date format. Use YYYY-MM-DD')
+
+        while True:
+            self.run_once(today or timezone.localdate(), options['dry_run'], options['verbosity'])
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, today, dry_run, verbosity):
+        for database in databases():
+            start = time.perf_counter()
+            with using(database):
+                deltas = replenish(today, dry_run=dry_run)
+            elapsed = time.perf_counter() - start
+
+            if verbosity > 1:
+                for barcode, amount in sorted(deltas.items()):
+                    self.stdout.write(f'{barcode}\t{amount:g}')
+
+            verb = 'Would add' if dry_run else 'Added'
+            self.stdout.write(self.style.SUCCESS(
+                f'{database}: {verb} {sum(deltas.values()):g} to {len(deltas)} shopping list entries in {elapsed:.2f}s'
+            ))
@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from app.snapshot import FORMATS, default_format, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes a columnar snapshot of the fridge, item types and shopping list for analytics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='directory to write one file per table into')
+        parser.add_argument('--format', choices=sorted(FORMATS), help=f'default: {default_format()}')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = write_snapshot(options['directory'], options['format'], options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{count} {table}' for table, count in counts.items())
+            + f' written to {options["directory"]} in {time.perf_counter() - start:.2f}s'
+        ))
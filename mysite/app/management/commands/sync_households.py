@@ -0,0 +1,22 @@
+import os
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from app.households import household_databases, replicate_catalog
+
+
+class Command(BaseCommand):
+    help = 'Creates or migrates the database of every household and copies the item type catalog into it.'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        for database in household_databases():
+            os.makedirs(os.path.dirname(connections[database].settings_dict['NAME']), exist_ok=True)
+            call_command('migrate', database=database, interactive=False, verbosity=0)
+
+        count = replicate_catalog()
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {count} item types into {len(household_databases())} household databases '
+            f'in {time.perf_counter() - start:.2f}s'
+        ))
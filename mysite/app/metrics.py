@@ -0,0 +1,220 @@
+"""
+Per-view request metrics, exported in the Prometheus text format at /metrics.
+
+MetricsMiddleware records, for every request, its wall time, the number of
+database queries it ran and the time spent in them, and the response size,
+into in-process histograms labelled by view. Queries are timed by a database
+execute wrapper installed on every connection as it is created, and are
+attributed to the request through a context variable. That way queries run by
+async views inside sync_to_async threads are counted as well.
+
+Set METRICS_SLOW_QUERY_MS to log every query slower than that, with its SQL
+and the view that ran it, to the 'app.metrics' logger. Bodies of streaming
+responses are produced after the middleware returns, so their size and the
+queries run while streaming are not recorded.
+"""
+import contextvars
+import logging
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.views.decorators.http import require_http_methods
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects them."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms, counters and gauges keyed by metric name and label values."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            key = (name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def increment(self, name, labels, amount=1):
+        with self.lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {count}')
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} counter')
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(labels)} {value}')
+
+            for name in sorted({name for name, _ in self.gauges}):
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} gauge')
+                for (metric, labels), value in sorted(self.gauges.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'Wall time spent handling a request.')
+registry.describe('http_request_db_queries', 'Database queries run by a request.')
+registry.describe('http_request_db_duration_seconds', 'Time a request spent waiting on the database.')
+registry.describe('http_response_size_bytes', 'Size of non-streaming response bodies.')
+registry.describe('http_responses_total', 'Responses sent, by view and status code.')
+
+
+class RequestStats:
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.db_time = 0.0
+
+    @property
+    def view(self):
+        match = self.request.resolver_match
+        return match.view_name if match else 'unmatched'
+
+
+_current_request = contextvars.ContextVar('current_request_stats', default=None)
+
+
+def current_view():
+    """The name of the view handling the current request, for labelling metrics recorded outside this module."""
+    stats = _current_request.get()
+    return stats.view if stats else 'no request'
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current_request.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += duration
+
+        threshold = getattr(settings, 'METRICS_SLOW_QUERY_MS', None)
+        if threshold is not None and duration * 1000 >= threshold:
+            logger.warning(
+                'Slow query in %s (%.1f ms): %s',
+                stats.view if stats else 'no request', duration * 1000, sql
+            )
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats, token, start = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, start = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    def _start(self, request):
+        stats = RequestStats(request)
+        return stats, _current_request.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, start):
+        duration = time.perf_counter() - start
+        labels = (('view', stats.view),)
+
+        registry.observe('http_request_duration_seconds', labels, duration, DURATION_BUCKETS)
+        registry.observe('http_request_db_queries', labels, stats.queries, QUERY_BUCKETS)
+        registry.observe('http_request_db_duration_seconds', labels, stats.db_time, DURATION_BUCKETS)
+        if not response.streaming:
+            registry.observe('http_response_size_bytes', labels, len(response.content), SIZE_BUCKETS)
+        registry.increment('http_responses_total', labels + (('status', response.status_code),))
+
+
+@require_http_methods(['GET'])
+def metrics(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AmountType',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ItemType',
+            fields=[
+                ('unique_barcode', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('amount_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.amounttype')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShoppingList',
+            fields=[
+                ('item_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='app.itemtype')),
+                ('amount', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IndividualItem',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('expiration_date', models.DateField()),
+                ('amount', models.FloatField()),
+                ('item_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.itemtype')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='individualitem',
+            index=models.Index(fields=['expiration_date', 'item_type'], name='individualitem_expiry_idx'),
+        ),
+    ]
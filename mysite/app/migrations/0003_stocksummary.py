@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def summarize_existing_stock(apps, schema_editor):
+    IndividualItem = apps.get_model('app', 'IndividualItem')
+    StockSummary = apps.get_model('app', 'StockSummary')
+    stock = (
+        IndividualItem.objects.using(schema_editor.connection.alias)
+        .values('item_type_id')
+        .annotate(total_amount=Sum('amount'), item_count=Count('id'), earliest_expiry=Min('expiration_date'))
+    )
+    StockSummary.objects.using(schema_editor.connection.alias).bulk_create(
+        [StockSummary(**row) for row in stock], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_individualitem_expiry_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSummary',
+            fields=[
+                ('item_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='app.itemtype')),
+                ('total_amount', models.FloatField()),
+                ('item_count', models.IntegerField()),
+                ('earliest_expiry', models.DateField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='individualitem',
+            index=models.Index(fields=['item_type', 'expiration_date'], name='individualitem_type_expiry_idx'),
+        ),
+        migrations.RunPython(summarize_existing_stock, migrations.RunPython.noop),
+    ]
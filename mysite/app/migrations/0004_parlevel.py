@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_stocksummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParLevel',
+            fields=[
+                ('item_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='app.itemtype')),
+                ('amount', models.FloatField()),
+                ('expiry_horizon_days', models.PositiveIntegerField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Full-text index over ItemType.name and unique_barcode, kept in sync by triggers (see app/search.py).
+
+from django.db import migrations
+
+CREATE_SEARCH = [
+    "CREATE VIRTUAL TABLE app_itemtype_search USING fts5("
+    "name, unique_barcode, content='app_itemtype', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    # Matches in the name rank above matches in the barcode.
+    "INSERT INTO app_itemtype_search(app_itemtype_search, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",
+    "CREATE TRIGGER app_itemtype_search_insert AFTER INSERT ON app_itemtype BEGIN "
+    "INSERT INTO app_itemtype_search(rowid, name, unique_barcode) "
+    "VALUES (new.rowid, new.name, new.unique_barcode); "
+    "END",
+    "CREATE TRIGGER app_itemtype_search_delete AFTER DELETE ON app_itemtype BEGIN "
+    "INSERT INTO app_itemtype_search(app_itemtype_search, rowid, name, unique_barcode) "
+    "VALUES ('delete', old.rowid, old.name, old.unique_barcode); "
+    "END",
+    "CREATE TRIGGER app_itemtype_search_update AFTER UPDATE OF name, unique_barcode ON app_itemtype BEGIN "
+    "INSERT INTO app_itemtype_search(app_itemtype_search, rowid, name, unique_barcode) "
+    "VALUES ('delete', old.rowid, old.name, old.unique_barcode); "
+    "INSERT INTO app_itemtype_search(rowid, name, unique_barcode) "
+    "VALUES (new.rowid, new.name, new.unique_barcode); "
+    "END",
+    "INSERT INTO app_itemtype_search(app_itemtype_search) VALUES ('rebuild')",
+]
+
+DROP_SEARCH = [
+    "DROP TRIGGER app_itemtype_search_update",
+    "DROP TRIGGER app_itemtype_search_delete",
+    "DROP TRIGGER app_itemtype_search_insert",
+    "DROP TABLE app_itemtype_search",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_parlevel'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH, DROP_SEARCH),
+    ]
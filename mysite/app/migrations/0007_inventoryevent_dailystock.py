@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:49
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def record_existing_stock(apps, schema_editor):
+    # The history starts with the stock already in the fridge, so that stock at any later time adds up.
+    InventoryEvent = apps.get_model('app', 'InventoryEvent')
+    StockSummary = apps.get_model('app', 'StockSummary')
+    now = timezone.now()
+    stock = StockSummary.objects.using(schema_editor.connection.alias).values_list('item_type_id', 'total_amount')
+    InventoryEvent.objects.using(schema_editor.connection.alias).bulk_create(
+        [InventoryEvent(occurred_at=now, op='baseline', item_type=barcode, delta=amount) for barcode, amount in stock],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('added', models.FloatField()),
+                ('consumed', models.FloatField()),
+                ('removed', models.FloatField()),
+                ('listed', models.FloatField()),
+                ('amount', models.FloatField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item_type', 'day'), name='dailystock_type_day_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventoryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('occurred_at', models.DateTimeField()),
+                ('op', models.CharField(max_length=10)),
+                ('item_type', models.CharField(max_length=100)),
+                ('delta', models.FloatField()),
+                ('expiration_date', models.DateField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item_type', 'occurred_at'], name='inventoryevent_type_time_idx'), models.Index(fields=['occurred_at'], name='inventoryevent_time_idx')],
+            },
+        ),
+        migrations.RunPython(record_existing_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:21
+
+import random
+import time
+
+from django.db import migrations, models
+
+
+def start_counters(apps, schema_editor):
+    # Counters start from a random value, so the ETags of a recreated database never match old ones.
+    TableVersion = apps.get_model('app', 'TableVersion')
+    TableVersion.objects.using(schema_editor.connection.alias).bulk_create([
+        TableVersion(name=table, version=random.getrandbits(48), modified=time.time())
+        for table in ('app_itemtype', 'app_shoppinglist')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_inventoryevent_dailystock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField()),
+                ('modified', models.FloatField()),
+            ],
+        ),
+        migrations.RunPython(start_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Re-keys the full-text index of migration 0005 on the barcode (see app/search.py).
+# The index referred to app_itemtype rows by their implicit rowid, which a table
+# rebuild or VACUUM renumbers. It now indexes app_itemtype_search_entry, a copy
+# of the names and barcodes with an integer key of its own, looked up by barcode.
+
+from importlib import import_module
+
+from django.db import migrations
+
+rowid_search = import_module('app.migrations.0005_itemtype_search')
+
+CREATE_SEARCH = [
+    "CREATE TABLE app_itemtype_search_entry ("
+    "id INTEGER PRIMARY KEY, unique_barcode TEXT NOT NULL UNIQUE, name TEXT NOT NULL)",
+    "CREATE VIRTUAL TABLE app_itemtype_search USING fts5("
+    "name, unique_barcode, content='app_itemtype_search_entry', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    # Matches in the name rank above matches in the barcode.
+    "INSERT INTO app_itemtype_search(app_itemtype_search, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",
+    # The entries follow app_itemtype...
+    "CREATE TRIGGER app_itemtype_search_insert AFTER INSERT ON app_itemtype BEGIN "
+    "INSERT INTO app_itemtype_search_entry(unique_barcode, name) VALUES (new.unique_barcode, new.name); "
+    "END",
+    "CREATE TRIGGER app_itemtype_search_delete AFTER DELETE ON app_itemtype BEGIN "
+    "DELETE FROM app_itemtype_search_entry WHERE unique_barcode = old.unique_barcode; "
+    "END",
+    "CREATE TRIGGER app_itemtype_search_update AFTER UPDATE OF name, unique_barcode ON app_itemtype BEGIN "
+    "UPDATE app_itemtype_search_entry SET unique_barcode = new.unique_barcode, name = new.name "
+    "WHERE unique_barcode = old.unique_barcode; "
+    "END",
+    # ...and the index follows the entries.
+    "CREATE TRIGGER app_itemtype_search_entry_insert AFTER INSERT ON app_itemtype_search_entry BEGIN "
+    "INSERT INTO app_itemtype_search(rowid, name, unique_barcode) VALUES (new.id, new.name, new.unique_barcode); "
+    "END",
+    "CREATE TRIGGER app_itemtype_search_entry_delete AFTER DELETE ON app_itemtype_search_entry BEGIN "
+    "INSERT INTO app_itemtype_search(app_itemtype_search, rowid, name, unique_barcode) "
+    "VALUES ('delete', old.id, old.name, old.unique_barcode); "
+    "END",
+    "CREATE TRIGGER app_itemtype_search_entry_update AFTER UPDATE ON app_itemtype_search_entry BEGIN "
+    "INSERT INTO app_itemtype_search(app_itemtype_search, rowid, name, unique_barcode) "
+    "VALUES ('delete', old.id, old.name, old.unique_barcode); "
+    "INSERT INTO app_itemtype_search(rowid, name, unique_barcode) VALUES (new.id, new.name, new.unique_barcode); "
+    "END",
+    "INSERT INTO app_itemtype_search_entry(unique_barcode, name) SELECT unique_barcode, name FROM app_itemtype",
+]
+
+DROP_SEARCH = [
+    "DROP TRIGGER app_itemtype_search_entry_update",
+    "DROP TRIGGER app_itemtype_search_entry_delete",
+    "DROP TRIGGER app_itemtype_search_entry_insert",
+    "DROP TRIGGER app_itemtype_search_update",
+    "DROP TRIGGER app_itemtype_search_delete",
+    "DROP TRIGGER app_itemtype_search_insert",
+    "DROP TABLE app_itemtype_search",
+    "DROP TABLE app_itemtype_search_entry",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_tableversion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(rowid_search.DROP_SEARCH, rowid_search.CREATE_SEARCH),
+        migrations.RunSQL(CREATE_SEARCH, DROP_SEARCH),
+    ]
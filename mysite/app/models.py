@@ -26,6 +26,12 @@ class IndividualItem(models.Model):
     item_type = models.ForeignKey(ItemType, on_delete=models.CASCADE)  # Renamed for clarity
     amount = models.FloatField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expiration_date', 'item_type'], name='individualitem_expiry_idx'),
+            models.Index(fields=['item_type', 'expiration_date'], name='individualitem_type_expiry_idx'),
+        ]
+
     def __str__(self):
         return f"{str(self.item_type.name)} (ID: {str(self.id)})"  # Ensuring string conversion
 
@@ -37,3 +43,84 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f"{str(self.item_type.name)} - {str(self.amount)}"  # Ensuring string conversion
+
+
+class StockSummary(models.Model):
+    """The current stock of an item type, maintained by the write paths in inventory.py."""
+    item_type = models.OneToOneField(ItemType, on_delete=models.CASCADE, primary_key=True)
+    total_amount = models.FloatField()
+    item_count = models.IntegerField()
+    earliest_expiry = models.DateField()
+
+    def __str__(self):
+        return f"{str(self.item_type_id)} - {str(self.total_amount)} in {str(self.item_count)} items"
+
+
+class ParLevel(models.Model):
+    """The amount of an item type to keep in stock, counting only items that outlast the expiry horizon."""
+    item_type = models.OneToOneField(ItemType, on_delete=models.CASCADE, primary_key=True)
+    amount = models.FloatField()
+    expiry_horizon_days = models.PositiveIntegerField(null=True)  # None uses REPLENISH_EXPIRY_HORIZON_DAYS
+
+    def __str__(self):
+        return f"{str(self.item_type_id)} - {str(self.amount)}"
+
+
+class IdempotencyKey(models.Model):
+    """The response to a write request sent with an Idempotency-Key header, replayed when it is retried."""
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the method, path and body
+    status = models.PositiveSmallIntegerField()
+    content_type = models.CharField(max_length=100)
+    content = models.BinaryField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{str(self.key)} - {str(self.status)}"
+
+
+class InventoryEvent(models.Model):
+    """One change to the fridge or the shopping list, appended by the write paths in inventory.py."""
+    occurred_at = models.DateTimeField()
+    op = models.CharField(max_length=10)  # One of history.OPS
+    item_type = models.CharField(max_length=100)  # A barcode, not a foreign key: history outlives its item type
+    delta = models.FloatField()
+    expiration_date = models.DateField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item_type', 'occurred_at'], name='inventoryevent_type_time_idx'),
+            models.Index(fields=['occurred_at'], name='inventoryevent_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{str(self.op)} {str(self.item_type)} {str(self.delta)} at {str(self.occurred_at)}"
+
+
+class DailyStock(models.Model):
+    """The inventory events of one item type on one UTC day, rolled up by history.compact()."""
+    item_type = models.CharField(max_length=100)
+    day = models.DateField()
+    added = models.FloatField()
+    consumed = models.FloatField()
+    removed = models.FloatField()
+    listed = models.FloatField()  # Net change to the shopping list
+    amount = models.FloatField()  # Stock at the end of the day
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item_type', 'day'], name='dailystock_type_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"{str(self.item_type)} on {str(self.day)} - {str(self.amount)}"
+
+
+class TableVersion(models.Model):
+    """The change counter of a table behind conditional GETs, bumped by versions.track_writes."""
+    name = models.CharField(max_length=100, primary_key=True)  # The table's db_table
+    version = models.BigIntegerField()
+    modified = models.FloatField()  # Unix time of the last write
+
+    def __str__(self):
+        return f"{str(self.name)} - {str(self.version)}"
@@ -0,0 +1,39 @@
+"""
+Responses to requests that failed for reasons other than a bad request.
+
+A write that gives up waiting for SQLite's write lock fails with "database is
+locked"; exception_response() answers it with 503 and a Retry-After header, so
+clients back off and retry, and counts it in db_lock_errors_total by view.
+Other unexpected exceptions are answered with 500 carrying their message.
+"""
+from django.conf import settings
+from django.db import OperationalError
+from .codec import error, error_response
+from .metrics import current_view, registry
+
+LOCK_ERROR_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+DATABASE_BUSY = error('The database is busy; retry later', status=503)
+
+registry.describe('db_lock_errors_total', 'Requests that failed because the database was locked, by view.')
+
+
+def retry_later(payload):
+    """The response of a 503 payload, with Retry-After set to ADMISSION_RETRY_AFTER_SECONDS."""
+    response = payload.response()
+    response['Retry-After'] = str(getattr(settings, 'ADMISSION_RETRY_AFTER_SECONDS', 1))
+    return response
+
+
+def is_lock_error(exception):
+    return isinstance(exception, OperationalError) and str(exception).startswith(LOCK_ERROR_MESSAGES)
+
+
+def exception_response(exception):
+    """
+    Answers a request that failed with an unexpected exception: 503 with
+    Retry-After if the database was locked, or 500 carrying the message.
+    """
+    if is_lock_error(exception):
+        registry.increment('db_lock_errors_total', (('view', current_view()),))
+        return retry_later(DATABASE_BUSY)
+    return error_response(str(exception), status=500)
@@ -0,0 +1,59 @@
+"""
+The API routes, shared by mysite/urls.py and mysite/async_urls.py.
+
+Each route names its view; urlpatterns() looks the name up in the view modules
+it is given, in order, so the ASGI URLconf serves an async view where
+app/async_views.py has one and the sync view otherwise.
+"""
+from django.apps import apps
+from django.urls import path
+from .metrics import metrics
+
+# (path, view name, URL name)
+ROUTES = [
+    ("v1/additem", "add_item", 'add-item'),
+    ("v1/additems", "add_items", 'add-items'),
+    ("v1/newtype", "new_type", 'new-type'),
+    ("v1/itemtypes", "item_types", 'item-types'),
+    ("v1/searchtypes", "search_types", 'search-types'),
+    ("v1/importtypes", "import_types", 'import-types'),
+    ("v1/exporttypes", "export_types", 'export-types'),
+    ("v1/expiringitems", "expiring_items", 'expiring-items'),
+    ("v1/stock", "stock", 'stock'),
+    ("v1/stockat", "stock_at", 'stock-at'),
+    ("v1/shoppinglist", "shopping_list", 'shopping-list'),
+    ("v1/changes", "changes", 'changes'),
+    ("v1/addtoshoppinglist", "add_to_shopping_list", 'add-to-shopping-list'),
+    ("v1/removefromshoppinglist", "remove_from_shopping_list", 'remove-from-shopping-list'),
+    ("v1/updateshoppinglist", "update_shopping_list", 'update-shopping-list'),
+    ("v1/parlevels", "set_par_levels", 'set-par-levels'),
+    ("v1/purchaseitem", "purchase_item", 'purchase-item'),
+    ("v1/purchaseitems", "purchase_items", 'purchase-items'),
+    ("v1/removeitem", "delete_item", 'delete-item'),
+    ("v1/removeitems", "delete_items", 'delete-items'),
+    ("v1/purgeitems", "purge_items", 'purge-items'),
+    ("v1/consumeitems", "consume_items", 'consume-items'),
+    ("v1/batch", "batch", 'batch'),
+    ("v1/removetype", "remove_type", 'remove-type'),
+]
+
+
+def _view(name, modules):
+    for module in modules:
+        view = getattr(module, name, None)
+        if view is not None:
+            return view
+    raise LookupError(f'No view named {name}')
+
+
+def urlpatterns(*modules):
+    """Routes /metrics, every path in ROUTES to its view in the first of `modules` that has it, and the admin."""
+    patterns = [path("metrics", metrics, name='metrics')]
+    patterns += [path(route, _view(name, modules), name=url_name) for route, name, url_name in ROUTES]
+
+    # The "api" stack profile in mysite/settings.py does not install the admin.
+    if apps.is_installed("django.contrib.admin"):
+        from django.contrib import admin
+
+        patterns.insert(0, path("admin/", admin.site.urls))
+    return patterns
@@ -0,0 +1,324 @@
+"""
+Declarative validation of JSON request bodies and query parameters.
+
+A Schema lists the fields a body must contain and how each one is checked.
+Views decorated with @validate_body(schema) receive the cleaned body instead of
+parsing request.body themselves, and malformed bodies are answered with error
+payloads that were serialized when the schema was declared. Views decorated
+with @validate_request(parse) likewise receive the values parsed from the
+query string, and invalid parameters are answered with 400.
+"""
+from asgiref.sync import iscoroutinefunction
+from datetime import datetime
+from functools import wraps
+from .codec import JSONDecodeError, error, error_response, loads
+from .responses import exception_response
+
+INVALID_JSON = error('Invalid JSON format')
+NOT_A_LIST = error('Request body must be a list')
+NOT_AN_OBJECT_MESSAGE = 'Expected a JSON object'
+
+
+class Field:
+    """A field: `check` returns the cleaned value or raises TypeError/ValueError."""
+
+    def __init__(self, check, message=None, required=True):
+        self.check = check
+        self.message = message
+        self.required = required
+
+
+def _non_empty_string(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError(value)
+    return value
+
+
+def _positive_int(value):
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise ValueError(value)
+    return value
+
+
+def _non_negative_int(value):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError(value)
+    return value
+
+
+def _non_zero_int(value):
+    if not isinstance(value, int) or value == 0:
+        raise ValueError(value)
+    return value
+
+
+def _positive_number(value):
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not value > 0 or value == float('inf'):
+        raise ValueError(value)
+    return value
+
+
+def _iso_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def non_empty_string(message):
+    return Field(_non_empty_string, message)
+
+
+def positive_int(message='Amount must be a positive integer'):
+    return Field(_positive_int, message)
+
+
+def non_negative_int(message):
+    return Field(_non_negative_int, message)
+
+
+def non_zero_int(message='Amount must be a non-zero integer'):
+    return Field(_non_zero_int, message)
+
+
+def positive_number(message='Amount must be a positive number'):
+    return Field(_positive_number, message)
+
+
+def iso_date(message='Invalid date format. Use YYYY-MM-DD'):
+    return Field(_iso_date, message)
+
+
+def any_value():
+    return Field(lambda value: value)
+
+
+def optional(field):
+    """Makes `field` optional: it is only checked when present."""
+    field.required = False
+    return field
+
+
+class InvalidLine:
+    """Stands in for the record of an NDJSON or CSV line that could not be read, with the reason."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+INVALID_JSON_LINE = InvalidLine('Invalid JSON format')
+NOT_UTF8_LINE = InvalidLine('Line is not valid UTF-8')
+
+
+def read_ndjson(lines):
+    """Yields (line number, record) for each non-empty line, or an InvalidLine for lines that cannot be read."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, loads(line.decode('utf-8') if isinstance(line, bytes) else line)
+        except UnicodeDecodeError:
+            yield number, NOT_UTF8_LINE
+        except JSONDecodeError:
+            yield number, INVALID_JSON_LINE
+
+
+class Schema:
+    """The fields of a JSON object, checked for presence first and then in declaration order."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+        messages = [NOT_AN_OBJECT_MESSAGE]
+        messages += [f'Missing required field: {name}' for name, field in fields.items() if field.required]
+        messages += [field.message for field in fields.values() if field.message]
+        self.errors = {message: error(message) for message in messages}
+
+    def clean(self, data):
+        """Returns (cleaned data, None), or (None, error message) for an invalid object or unreadable line."""
+        if isinstance(data, InvalidLine):
+            return None, data.message
+        if not isinstance(data, dict):
+            return None, NOT_AN_OBJECT_MESSAGE
+
+        for name, field in self.fields.items():
+            if field.required and name not in data:
+                return None, f'Missing required field: {name}'
+
+        cleaned = dict(data)
+        for name, field in self.fields.items():
+            if name not in data:
+                continue
+            try:
+                cleaned[name] = field.check(data[name])
+            except (TypeError, ValueError):
+                return None, field.message
+
+        return cleaned, None
+
+
+def _read_body(request, many):
+    # Each NDJSON line is decoded on its own, so a bad line is reported at its index instead of failing the body.
+    if many and request.content_type == 'application/x-ndjson':
+        return [record for _, record in read_ndjson(request)]
+    return loads(request.body)
+
+
+def clean_body(data, schema, many=False):
+    """
+    Validates an already decoded body against `schema`.
+
+    Returns (view arguments, None) or (None, error response). A single object
+    gives (cleaned,). With `many`, the body must be a list and gives (rows,
+    errors): the (index, cleaned) pairs of the valid records and the
+    per-index messages of the invalid ones.
+    """
+    if not many:
+        cleaned, message = schema.clean(data)
+        if message:
+            return None, schema.errors[message].response()
+        return (cleaned,), None
+
+    if not isinstance(data, list):
+        return None, NOT_A_LIST.response()
+
+    rows = []
+    errors = []
+    for index, row in enumerate(data):
+        cleaned, message = schema.clean(row)
+        if message:
+            errors.append({'index': index, 'message': message})
+        else:
+            rows.append((index, cleaned))
+    return (rows, errors), None
+
+
+def parse_body(request, schema, many=False):
+    """
+    Parses and validates the body of `request` against `schema`, as
+    clean_body does. With `many`, the body may also be an NDJSON stream, whose
+    unreadable lines are reported in the errors like invalid records.
+    """
+    try:
+        data = _read_body(request, many)
+    except JSONDecodeError:
+        return None, INVALID_JSON.response()
+
+    return clean_body(data, schema, many)
+
+
+def _validating(view, parse):
+    """
+    Wraps `view` so that it is called as view(request, *arguments) with the
+    arguments from parse(request), which returns (arguments, None) or (None,
+    error response). Unexpected exceptions raised by the view become responses
+    from responses.exception_response: 503 if the database was locked,
+    otherwise 500 with the exception message.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            parsed, response = parse(request)
+            if response:
+                return response
+            try:
+                return await view(request, *parsed, *args, **kwargs)
+            except Exception as e:
+                return exception_response(e)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            parsed, response = parse(request)
+            if response:
+                return response
+            try:
+                return view(request, *parsed, *args, **kwargs)
+            except Exception as e:
+                return exception_response(e)
+    return wrapper
+
+
+def validate_body(schema, many=False):
+    """
+    Decorates a sync or async view so that it is called as
+    view(request, *parse_body(...)) with a valid body, answering unexpected
+    exceptions as _validating does. The schema is recorded on the view as
+    `body_schema`, a (schema, many) pair.
+    """
+    def decorator(view):
+        wrapper = _validating(view, lambda request: parse_body(request, schema, many))
+        wrapper.body_schema = (schema, many)
+        return wrapper
+    return decorator
+
+
+def parse_request(request, parse=None):
+    """
+    Returns (parse(request), None), or (None, error response) when `parse`
+    raises ValueError with a client-facing message (400) or fails unexpectedly.
+    Without `parse`, the view takes no arguments.
+    """
+    if parse is None:
+        return (), None
+    try:
+        return parse(request), None
+    except ValueError as e:
+        return None, error_response(str(e))
+    except Exception as e:
+        return None, exception_response(e)
+
+
+def validate_request(parse=None):
+    """
+    Decorates a sync or async view that takes its arguments from the query
+    string or headers rather than a JSON body: `parse(request)` returns them
+    as a tuple, or raises ValueError with a client-facing message. Unexpected
+    exceptions are answered as _validating does.
+    """
+    return lambda view: _validating(view, lambda request: parse_request(request, parse))
+
+
+ITEM = Schema(
+    itemType=non_empty_string('Item type must be a non-empty string'),
+    expirationDate=iso_date(),
+    amount=positive_int(),
+)
+
+ITEM_ID = Schema(ID=positive_int('ID must be a positive integer'))
+
+NEW_TYPE = Schema(
+    unique_barcode=non_empty_string('Unique barcode must be a non-empty string'),
+    name=non_empty_string('Name must be a non-empty string'),
+    amount_type=non_empty_string('Amount type must be a non-empty string'),
+)
+
+ITEM_FILTER = Schema(
+    expiredBefore=optional(iso_date()),
+    itemType=optional(non_empty_string('Item type must be a non-empty string')),
+    idFrom=optional(positive_int('ID range bounds must be positive integers')),
+    idTo=optional(positive_int('ID range bounds must be positive integers')),
+)
+
+PAR_LEVEL = Schema(
+    itemType=non_empty_string('Item type must be a non-empty string'),
+    amount=positive_int(),
+    expiryHorizonDays=optional(non_negative_int('Expiry horizon must be a non-negative number of days')),
+)
+
+TYPE_BARCODE = Schema(unique_barcode=non_empty_string('Unique barcode must be a non-empty string'))
+
+SHOPPING_LIST_ITEM = Schema(
+    itemType=non_empty_string('Item type must be a non-empty string'),
+    amount=positive_int(),
+)
+
+BATCH_OPERATION = Schema(
+    op=non_empty_string('Operation must be a non-empty string'),
+    body=any_value(),
+)
+
+CONSUMPTION = Schema(
+    itemType=non_empty_string('Item type must be a non-empty string'),
+    amount=positive_number(),
+)
+
+SHOPPING_LIST_DELTA = Schema(
+    itemType=non_empty_string('Item type must be a non-empty string'),
+    amount=non_zero_int(),
+)
@@ -0,0 +1,66 @@
+"""
+Type-ahead search over the ItemType catalog.
+
+Names and barcodes are indexed by app_itemtype_search, an FTS5 table created by
+migration 0009 over app_itemtype_search_entry, which holds a copy of each item
+type's barcode and name under an integer key of its own. Triggers on
+app_itemtype keep the entries in sync, so bulk_create upserts from catalog
+imports and raw SQL writes are indexed as well as new_type and remove_type.
+Search results are joined to app_itemtype on the barcode, so the index
+survives a VACUUM or a migration that rebuilds app_itemtype; such a migration
+drops the triggers, though, which it must recreate before running
+`manage.py rebuild_search`.
+
+Every word of a query is matched as a prefix of a word in the name or barcode,
+so "mil sk" finds "Skimmed Milk". Results are ranked by bm25, with matches in
+the name weighted above matches in the barcode. Ranking costs time for every
+match, so only the first SEARCH_RANK_CANDIDATES matches are ranked: queries
+that match fewer are ranked exactly, and broader ones, like the first letter
+typed, return quickly and are narrowed by the next keystroke.
+"""
+import re
+from django.db import connections, transaction
+from .models import ItemType
+
+SEARCH_TABLE = 'app_itemtype_search'
+ENTRY_TABLE = 'app_itemtype_search_entry'
+SEARCH_RANK_CANDIDATES = 1000
+WORD = re.compile(r'\w+')
+
+
+def match_expression(text):
+    """Returns the FTS5 query matching every word of `text` as a prefix, or None if it has no words."""
+    words = WORD.findall(text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_item_types(text, limit, using='default'):
+    """Returns up to `limit` (barcode, name, amount type) rows matching `text`, best first."""
+    expression = match_expression(text)
+    if expression is None:
+        return []
+
+    connection = connections[using]
+    item_table = connection.ops.quote_name(ItemType._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT item.unique_barcode, item.name, item.amount_type_id FROM ('
+            f'SELECT rowid, rank FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s LIMIT %s'
+            f') AS search INNER JOIN {ENTRY_TABLE} AS entry ON entry.id = search.rowid '
+            f'INNER JOIN {item_table} AS item ON item.unique_barcode = entry.unique_barcode '
+            f'ORDER BY search.rank LIMIT %s',
+            [expression, SEARCH_RANK_CANDIDATES, limit]
+        )
+        return cursor.fetchall()
+
+
+def rebuild_search(using='default'):
+    """Copies the whole catalog into the index entries again and reindexes them."""
+    connection = connections[using]
+    item_table = connection.ops.quote_name(ItemType._meta.db_table)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {ENTRY_TABLE}')
+        cursor.execute(f'INSERT INTO {ENTRY_TABLE}(unique_barcode, name) SELECT unique_barcode, name FROM {item_table}')
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
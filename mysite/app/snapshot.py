@@ -0,0 +1,253 @@
+"""
+Columnar snapshots of the fridge for analytics.
+
+write_snapshot(directory) dumps IndividualItem, ItemType and ShoppingList into
+one file per table, reading each table with values_list() in chunks of
+SNAPSHOT_CHUNK_SIZE rows from a single read transaction, so the tables are
+consistent with each other. read_snapshot(directory) maps the files into
+memory and returns the columns without copying them.
+
+Item types are stored once, in barcode order; the other tables refer to them by
+row number in an int32 `item_type` column. Dates are int32 days since
+1970-01-01.
+
+    items           id int64, item_type int32, amount float64, expiration_date date
+    item_types      unique_barcode, name, amount_type (strings)
+    shopping_list   item_type int32, amount float64
+
+Two formats are supported. As with the JSON backends in codec.py, the best
+installed one is used unless settings.SNAPSHOT_FORMAT names one:
+
+- arrow: Arrow IPC files (<table>.arrow), when pyarrow is installed. They are
+  read back as pyarrow ChunkedArrays through pyarrow.memory_map.
+- columns: a dependency-free layout (<table>.columns) of a JSON header
+  followed by the raw, 8-byte aligned column buffers. Numeric columns are read
+  back as NumPy arrays over the mapped file when NumPy is installed, and as
+  memoryviews otherwise; string columns are decoded on access.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date
+from itertools import islice
+from django.conf import settings
+from django.db import connections
+from .models import IndividualItem, ItemType, ShoppingList
+
+SNAPSHOT_CHUNK_SIZE = 10000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+COLUMNS_MAGIC = b'FRIDGECOLS1\n'
+ALIGNMENT = 8
+
+# Column name -> type code: an `array` typecode, 'date' (stored as 'i') or 'str'.
+TABLES = {
+    'items': {'id': 'q', 'item_type': 'i', 'amount': 'd', 'expiration_date': 'date'},
+    'item_types': {'unique_barcode': 'str', 'name': 'str', 'amount_type': 'str'},
+    'shopping_list': {'item_type': 'i', 'amount': 'd'},
+}
+
+
+def _new_columns(table):
+    return {
+        name: [] if kind == 'str' else array('i' if kind == 'date' else kind)
+        for name, kind in TABLES[table].items()
+    }
+
+
+def _chunks(queryset):
+    rows = queryset.iterator(chunk_size=SNAPSHOT_CHUNK_SIZE)
+    while chunk := list(islice(rows, SNAPSHOT_CHUNK_SIZE)):
+        yield chunk
+
+
+def collect(using='default'):
+    """
+    Reads the three tables into columns, in one read transaction of its own.
+    Must not be called inside transaction.atomic(). Returns {table: {column:
+    values}}.
+    """
+    connection = connections[using]
+    tables = {table: _new_columns(table) for table in TABLES}
+
+    with connection.cursor() as cursor:
+        # A deferred transaction only takes a read lock, so writers are not blocked in WAL mode.
+        cursor.execute('BEGIN DEFERRED')
+        try:
+            codes = {}
+            item_types = tables['item_types']
+            for chunk in _chunks(ItemType.objects.using(using).order_by('unique_barcode').values_list(
+                    'unique_barcode', 'name', 'amount_type_id')):
+                for barcode, name, amount_type in chunk:
+                    codes[barcode] = len(codes)
+                    item_types['unique_barcode'].append(barcode)
+                    item_types['name'].append(name)
+                    item_types['amount_type'].append(amount_type)
+
+            items = tables['items']
+            for chunk in _chunks(IndividualItem.objects.using(using).order_by('id').values_list(
+                    'id', 'item_type_id', 'amount', 'expiration_date')):
+                items['id'].extend(row[0] for row in chunk)
+                items['item_type'].extend(codes[row[1]] for row in chunk)
+                items['amount'].extend(row[2] for row in chunk)
+                items['expiration_date'].extend(row[3].toordinal() - EPOCH_ORDINAL for row in chunk)
+
+            shopping_list = tables['shopping_list']
+            for chunk in _chunks(ShoppingList.objects.using(using).order_by('item_type_id').values_list(
+                    'item_type_id', 'amount')):
+                shopping_list['item_type'].extend(codes[row[0]] for row in chunk)
+                shopping_list['amount'].extend(row[1] for row in chunk)
+        finally:
+            cursor.execute('ROLLBACK')
+
+    return tables
+
+
+def _write_columns(path, columns):
+    """Writes one table in the `columns` layout: magic, header size, JSON header, then the buffers."""
+    header = {'byteorder': sys.byteorder, 'columns': []}
+    buffers = []
+    offset = 0  # Relative to the end of the header.
+    for name, values in columns.items():
+        if isinstance(values, list):
+            encoded = [value.encode() for value in values]
+            offsets = array('q', [0])
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            parts, kind = [offsets.tobytes(), b''.join(encoded)], 'str'
+        else:
+            parts, kind = [values.tobytes()], values.typecode
+
+        locations = []
+        for data in parts:
+            locations.append([offset, len(data)])
+            buffers.append(data + b'\0' * (-len(data) % ALIGNMENT))
+            offset += len(buffers[-1])
+        header['columns'].append({'name': name, 'type': kind, 'length': len(values), 'buffers': locations})
+
+    encoded_header = json.dumps(header).encode()
+    encoded_header += b' ' * (-(len(COLUMNS_MAGIC) + 4 + len(encoded_header)) % ALIGNMENT)
+    with open(path, 'wb') as file:
+        file.write(COLUMNS_MAGIC + struct.pack('<I', len(encoded_header)) + encoded_header)
+        for data in buffers:
+            file.write(data)
+
+
+class StringColumn:
+    """A string column over a mapped file, decoded one value at a time."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode()
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+
+def _numeric_column(buffer, kind, length):
+    try:
+        import numpy
+    except ImportError:
+        return buffer.cast(kind)
+    return numpy.frombuffer(buffer, dtype=numpy.dtype(kind), count=length)
+
+
+def _read_columns(path):
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if bytes(view[:len(COLUMNS_MAGIC)]) != COLUMNS_MAGIC:
+        raise ValueError(f'{path} is not a columns snapshot')
+    start = len(COLUMNS_MAGIC)
+    header_size, = struct.unpack('<I', view[start:start + 4])
+    header = json.loads(bytes(view[start + 4:start + 4 + header_size]))
+    start += 4 + header_size
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'{path} was written on a {header["byteorder"]}-endian machine')
+
+    columns = {}
+    for column in header['columns']:
+        buffers = [view[start + offset:start + offset + size] for offset, size in column['buffers']]
+        if column['type'] == 'str':
+            columns[column['name']] = StringColumn(buffers[0].cast('q'), buffers[1])
+        else:
+            columns[column['name']] = _numeric_column(buffers[0], column['type'], column['length'])
+    return columns
+
+
+def _write_arrow(path, columns):
+    import pyarrow
+
+    arrays = {}
+    for name, values in columns.items():
+        if isinstance(values, list):
+            arrays[name] = pyarrow.array(values, pyarrow.string())
+        else:
+            kind = {'q': pyarrow.int64(), 'i': pyarrow.int32(), 'd': pyarrow.float64()}[values.typecode]
+            if name == 'expiration_date':
+                kind = pyarrow.date32()
+            arrays[name] = pyarrow.Array.from_buffers(kind, len(values), [None, pyarrow.py_buffer(values)])
+    table = pyarrow.table(arrays)
+    with pyarrow.OSFile(path, 'wb') as sink, pyarrow.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=SNAPSHOT_CHUNK_SIZE)
+
+
+def _read_arrow(path):
+    import pyarrow
+
+    table = pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+    return {name: table.column(name) for name in table.column_names}
+
+
+FORMATS = {
+    'arrow': (_write_arrow, _read_arrow),
+    'columns': (_write_columns, _read_columns),
+}
+
+
+def default_format():
+    name = getattr(settings, 'SNAPSHOT_FORMAT', None)
+    if name:
+        return name
+    try:
+        import pyarrow  # noqa: F401
+        return 'arrow'
+    except ImportError:
+        return 'columns'
+
+
+def write_snapshot(directory, format=None, using='default'):
+    """Writes a snapshot into `directory`. Returns {table: row count}."""
+    format = format or default_format()
+    write, _ = FORMATS[format]
+    os.makedirs(directory, exist_ok=True)
+
+    counts = {}
+    for table, columns in collect(using).items():
+        write(os.path.join(directory, f'{table}.{format}'), columns)
+        counts[table] = len(next(iter(columns.values())))
+    return counts
+
+
+def read_snapshot(directory):
+    """Maps the snapshot in `directory` into memory. Returns {table: {column: values}}."""
+    tables = {}
+    for table in TABLES:
+        for format, (_, read) in FORMATS.items():
+            path = os.path.join(directory, f'{table}.{format}')
+            if os.path.exists(path):
+                tables[table] = read(path)
+                break
+        else:
+            raise FileNotFoundError(f'No {table} table in snapshot {directory}')
+    return tables
@@ -0,0 +1,738 @@
+import asyncio
+import importlib.util
+import json
+import os
+import runpy
+import tempfile
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from mysite import settings as settings_module
+from . import admission, async_views, events, history, households, views
+from .admission import Limiter
+from .inventory import (
+    consume, decrement_shopping_list, delete_ids, delete_matching, rebuild_stock, replenish, settle_purchases,
+    store_items, upsert_shopping_list
+)
+from .models import AmountType, IndividualItem, InventoryEvent, ItemType, ParLevel, ShoppingList, StockSummary
+from .search import rebuild_search, search_item_types
+from .snapshot import EPOCH_ORDINAL, read_snapshot, write_snapshot
+
+
+class LimiterTests(SimpleTestCase):
+    def test_cancelled_waiter_leaves_the_queue(self):
+        async def scenario():
+            limiter = Limiter('test', 1, 1)
+            self.assertIsNone(await limiter.aacquire(1))
+            queued = asyncio.create_task(limiter.aacquire(1))
+            await asyncio.sleep(0)
+            self.assertEqual(len(limiter.waiters), 1)
+
+            queued.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await queued
+            self.assertEqual(len(limiter.waiters), 0)
+
+            limiter.release()
+            self.assertEqual(limiter.active, 0)
+            self.assertIsNone(await limiter.aacquire(0.01))
+
+        asyncio.run(scenario())
+
+    def test_slot_granted_to_a_cancelled_waiter_is_released(self):
+        async def scenario():
+            limiter = Limiter('test', 1, 1)
+            await limiter.aacquire(1)
+            queued = asyncio.create_task(limiter.aacquire(1))
+            await asyncio.sleep(0)
+
+            # The slot is handed over, but the request is cancelled before it resumes.
+            limiter.release()
+            queued.cancel()
+            outcome, = await asyncio.gather(queued, return_exceptions=True)
+            if outcome is None:
+                # wait_for may return a result that arrives together with the cancellation; the request then runs.
+                limiter.release()
+            else:
+                self.assertIsInstance(outcome, asyncio.CancelledError)
+            self.assertEqual((limiter.active, len(limiter.waiters)), (0, 0))
+
+        asyncio.run(scenario())
+
+    def test_full_queue_sheds(self):
+        limiter = Limiter('test', 1, 0)
+        self.assertIsNone(limiter.acquire(1))
+        self.assertEqual(limiter.acquire(1), 'queue_full')
+        limiter.release()
+        self.assertEqual(limiter.active, 0)
+
+
+@override_settings(ADMISSION_QUEUE_TIMEOUT_SECONDS=0.01, ADMISSION_RETRY_AFTER_SECONDS=7)
+class AdmissionTests(SimpleTestCase):
+    def put(self):
+        return self.client.put('/v1/additem', b'not json', content_type='application/json')
+
+    def assertShed(self, response):
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(json.loads(response.content)['message'], 'Too many concurrent writes; retry later')
+
+    def test_writes_beyond_the_limit_are_shed(self):
+        for queue_size in (0, 1):  # Shed because the queue is full, then because the wait timed out.
+            writes = Limiter(DEFAULT_DB_ALIAS, 1, queue_size)
+            with mock.patch.dict(admission._limiters, {DEFAULT_DB_ALIAS: writes}):
+                self.assertIsNone(writes.acquire(1))
+                self.assertShed(self.put())
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+                writes.release()
+                self.assertEqual(self.put().status_code, 400)
+                self.assertEqual((writes.active, len(writes.waiters)), (0, 0))
+
+    @override_settings(ROOT_URLCONF='mysite.async_urls')
+    async def test_async_writes_beyond_the_limit_are_shed(self):
+        writes = Limiter(DEFAULT_DB_ALIAS, 1, 0)
+        with mock.patch.dict(admission._limiters, {DEFAULT_DB_ALIAS: writes}):
+            self.assertIsNone(await writes.aacquire(1))
+            self.assertShed(await self.async_client.put('/v1/additem', b'not json', content_type='application/json'))
+            writes.release()
+
+
+class RoutingTests(SimpleTestCase):
+    def test_asgi_routes_prefer_async_views(self):
+        for path, view in [
+            ('/v1/stock', async_views.stock),
+            ('/v1/changes', async_views.changes),
+            ('/v1/consumeitems', views.consume_items),
+            ('/v1/batch', views.batch),
+        ]:
+            self.assertIs(resolve(path, urlconf='mysite.async_urls').func, view)
+        self.assertIs(resolve('/v1/stock').func, views.stock)
+
+
+def api_profile_settings():
+    with mock.patch.dict(os.environ, {'DJANGO_STACK_PROFILE': 'api'}):
+        return runpy.run_path(settings_module.__file__)
+
+
+class ApiProfileTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+
+    def test_profile_drops_the_full_stack(self):
+        profile = api_profile_settings()
+        self.assertEqual(profile['INSTALLED_APPS'], ['app'])
+        self.assertEqual(profile['TEMPLATES'], [])
+        self.assertIn('app.tokens.TokenAuthMiddleware', profile['MIDDLEWARE'])
+        self.assertNotIn('django.middleware.csrf.CsrfViewMiddleware', profile['MIDDLEWARE'])
+
+    def test_writes_need_a_token(self):
+        body = json.dumps({'unique_barcode': 'milk', 'name': 'Milk', 'amount_type': 'kg'})
+        with override_settings(MIDDLEWARE=api_profile_settings()['MIDDLEWARE'], API_TOKENS=['first', 'second']):
+            for headers in [{}, {'Authorization': 'Bearer third'}, {'Authorization': 'Basic second'}]:
+                response = self.client.put('/v1/newtype', body, 'application/json', headers=headers)
+                self.assertEqual((response.status_code, response['WWW-Authenticate']), (401, 'Bearer'))
+            self.assertFalse(ItemType.objects.exists())
+
+            headers = {'Authorization': 'Bearer second'}
+            self.assertEqual(self.client.put('/v1/newtype', body, 'application/json', headers=headers).status_code, 200)
+            self.assertEqual(self.client.get('/v1/itemtypes').status_code, 200)
+
+
+class BatchTests(TransactionTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+
+    def test_rolled_back_type_is_not_cached(self):
+        response = self.client.post('/v1/batch', json.dumps([
+            {'op': 'new-type', 'body': {'unique_barcode': 'eggs', 'name': 'Eggs', 'amount_type': 'kg'}},
+            {'op': 'add-items', 'body': [{'itemType': 'eggs', 'expirationDate': '2030-01-01', 'amount': 1}]},
+            {'op': 'consume-items', 'body': {'itemType': 'milk', 'amount': 1}},
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ItemType.objects.filter(unique_barcode='eggs').exists())
+
+        response = self.client.put('/v1/additems', json.dumps([
+            {'itemType': 'eggs', 'expirationDate': '2030-01-01', 'amount': 1}
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['errors'], [{'index': 0, 'message': 'Item type does not exist'}])
+
+
+class ValidationTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+
+    def request(self, method, path, body):
+        response = getattr(self.client, method)(path, json.dumps(body), content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def test_item_ids_must_be_positive_integers(self):
+        status, body = self.request('delete', '/v1/removeitem', {'ID': 'abc'})
+        self.assertEqual((status, body['message']), (400, 'ID must be a positive integer'))
+
+        status, body = self.request('delete', '/v1/removeitems', [{'ID': 12345}, {'ID': 'abc'}])
+        self.assertEqual(status, 200)
+        self.assertEqual(body['errors'], [{'index': 1, 'message': 'ID must be a positive integer'}])
+
+        status, body = self.request('delete', '/v1/removeitem', {'ID': True})
+        self.assertEqual((status, body['message']), (400, 'ID must be a positive integer'))
+
+    def test_type_barcode_must_be_a_string(self):
+        status, body = self.request('delete', '/v1/removetype', {'unique_barcode': ['milk']})
+        self.assertEqual((status, body['message']), (400, 'Unique barcode must be a non-empty string'))
+        self.assertTrue(ItemType.objects.filter(unique_barcode='milk').exists())
+
+    def test_add_item_stores_the_item(self):
+        item = {'itemType': 'milk', 'expirationDate': '2030-01-01', 'amount': 2}
+        status, body = self.request('put', '/v1/additem', item)
+        self.assertEqual((status, body['message']), (200, 'Item added successfully'))
+        self.assertEqual(list(IndividualItem.objects.values_list('item_type_id', 'amount')), [('milk', 2)])
+
+        status, body = self.request('put', '/v1/additem', dict(item, itemType='bread'))
+        self.assertEqual((status, body['message']), (400, 'Item type does not exist'))
+
+        status, body = self.request('post', '/v1/batch', [
+            {'op': 'add-item', 'body': item},
+            {'op': 'add-item', 'body': dict(item, itemType='bread')},
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual(IndividualItem.objects.count(), 1)
+
+    def test_ndjson_lines_are_decoded_separately(self):
+        body = b'\n'.join([
+            b'{"itemType": "milk", "expirationDate": "2030-01-01", "amount": 1}',
+            b'{"itemType": "milk", ',
+            b'{"itemType": "\xff", "expirationDate": "2030-01-01", "amount": 1}',
+            b'',
+            b'{"itemType": "milk", "expirationDate": "2030-01-02", "amount": 3}',
+        ])
+        response = self.client.put('/v1/additems', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['errors'], [
+            {'index': 1, 'message': 'Invalid JSON format'},
+            {'index': 2, 'message': 'Line is not valid UTF-8'},
+        ])
+        self.assertEqual(sorted(IndividualItem.objects.values_list('amount', flat=True)), [1, 3])
+
+    def test_invalid_query_parameters_are_rejected(self):
+        for path, message in [
+            ('/v1/stock', 'Missing required parameter: itemType'),
+            ('/v1/stockat?itemType=milk&at=yesterday', 'Invalid at. Use an ISO 8601 date and time'),
+            ('/v1/itemtypes?limit=abc', 'Limit must be an integer'),
+            ('/v1/exporttypes?format=xml', 'Format must be csv or ndjson'),
+        ]:
+            response = self.client.get(path)
+            self.assertEqual((response.status_code, json.loads(response.content)['message']), (400, message))
+
+        response = self.client.get('/v1/stock?itemType=milk&itemType=bread')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['unknown'], ['bread'])
+
+
+class ExpiringItemsTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        for barcode in ('bread', 'milk'):
+            ItemType.objects.create(unique_barcode=barcode, name=barcode.title(), amount_type_id='kg')
+
+    def page(self, query):
+        response = self.client.get('/v1/expiringitems?' + query)
+        body = json.loads(b''.join(response.streaming_content))
+        return [item['ID'] for item in body['items']], body['next']
+
+    def test_days_are_bounded(self):
+        for days in ('-1', '3651', '99999999'):
+            response = self.client.get(f'/v1/expiringitems?days={days}')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content)['message'], 'Days must be between 0 and 3650')
+
+        self.assertEqual(self.client.get('/v1/expiringitems?days=3650').status_code, 200)
+
+    def test_items_are_streamed_in_expiry_order_across_pages(self):
+        today = timezone.localdate()
+        ids = {
+            (offset, barcode, copy): IndividualItem.objects.create(
+                item_type_id=barcode, amount=1, expiration_date=today + timedelta(days=offset)
+            ).id
+            for offset, barcode, copy in [
+                (2, 'bread', 0), (0, 'milk', 0), (0, 'bread', 0), (2, 'bread', 1), (9, 'milk', 0)
+            ]
+        }
+        expected = [ids[key] for key in sorted(ids) if key[0] <= 7]
+
+        first, cursor = self.page('limit=3')
+        self.assertEqual(first, expected[:3])
+        self.assertIsNotNone(cursor)
+
+        second, cursor = self.page(f'limit=3&after={cursor}')
+        self.assertEqual(second, expected[3:])
+        self.assertIsNone(cursor)
+
+
+class SearchTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk-1', name='Skimmed Milk', amount_type_id='kg')
+        ItemType.objects.create(unique_barcode='oat-2', name='Oat Milk', amount_type_id='kg')
+
+    def found(self, text):
+        return [barcode for barcode, _, _ in search_item_types(text, 10)]
+
+    def test_index_follows_the_catalog(self):
+        self.assertEqual(sorted(self.found('mil')), ['milk-1', 'oat-2'])
+
+        ItemType.objects.filter(unique_barcode='oat-2').update(name='Oat Drink')
+        ItemType.objects.filter(unique_barcode='milk-1').delete()
+        self.assertEqual(self.found('mil'), [])
+        self.assertEqual(self.found('oat dr'), ['oat-2'])
+
+        rebuild_search()
+        self.assertEqual(self.found('oat dr'), ['oat-2'])
+
+    def test_results_are_keyed_on_the_barcode(self):
+        # A table rebuild renumbers app_itemtype's rowids; the index must still find the right type.
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE app_itemtype SET rowid = rowid + 100')
+        self.assertEqual(self.found('skim'), ['milk-1'])
+
+
+class ChangeFeedTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+
+    def store_milk(self):
+        store_items([IndividualItem(item_type_id='milk', amount=2, expiration_date=timezone.localdate())])
+
+    async def next_message(self, stream):
+        return (await asyncio.wait_for(anext(stream), 5)).decode()
+
+    async def test_committed_writes_are_delivered(self):
+        stream = events.stream()
+        try:
+            self.assertEqual(await self.next_message(stream), 'retry: 1000\n\n')
+            await sync_to_async(self.store_milk)()
+            message = await self.next_message(stream)
+        finally:
+            await stream.aclose()
+
+        self.assertIn('event: items.added\n', message)
+        self.assertIn('data: {"itemTypes":[{"itemType":"milk","amount":2,"count":1}]}', message)
+
+    async def test_reconnecting_client_is_replayed_what_it_missed(self):
+        stream = events.stream()
+        try:
+            await self.next_message(stream)
+            await sync_to_async(self.store_milk)()
+            last_event_id = (await self.next_message(stream)).split('\n')[0].removeprefix('id: ')
+        finally:
+            await stream.aclose()
+
+        await sync_to_async(upsert_shopping_list)({'milk': 1})
+        stream = events.stream(last_event_id)
+        try:
+            self.assertIn('event: shopping-list.changed\n', await self.next_message(stream))
+        finally:
+            await stream.aclose()
+
+        stream = events.stream('elsewhere-1')
+        try:
+            self.assertIn('event: reset\n', await self.next_message(stream))
+        finally:
+            await stream.aclose()
+
+    @override_settings(ROOT_URLCONF='mysite.async_urls')
+    async def test_changes_endpoint_streams_events(self):
+        response = await self.async_client.get('/v1/changes')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await self.next_message(stream), 'retry: 1000\n\n')
+        finally:
+            await response.streaming_content.aclose()
+
+
+class ConditionalGetTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+
+    def test_unchanged_poll(self):
+        etag = self.client.get('/v1/itemtypes')['ETag']
+        self.assertEqual(self.client.get('/v1/itemtypes', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ItemType.objects.create(unique_barcode='eggs', name='Eggs', amount_type_id='kg')
+        self.assertEqual(self.client.get('/v1/itemtypes', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_counters_change_with_the_writing_transaction(self):
+        etag = self.client.get('/v1/shoppinglist')['ETag']
+        with transaction.atomic():
+            upsert_shopping_list({'milk': 1})
+            transaction.set_rollback(True)
+        self.assertEqual(self.client.get('/v1/shoppinglist')['ETag'], etag)
+
+        upsert_shopping_list({'milk': 1})
+        self.assertNotEqual(self.client.get('/v1/shoppinglist')['ETag'], etag)
+
+    @override_settings(ROOT_URLCONF='mysite.async_urls')
+    async def test_unchanged_poll_of_an_async_view(self):
+        etag = (await self.async_client.get('/v1/itemtypes'))['ETag']
+        response = await self.async_client.get('/v1/itemtypes', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+@skipUnless(len(settings.HOUSEHOLDS) >= 2, 'Run DJANGO_HOUSEHOLDS=a,b manage.py test app.tests.HouseholdTests')
+class HouseholdTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.first, self.second = settings.HOUSEHOLDS[:2]
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+
+    def request(self, method, path, body, household=None):
+        headers = {'X-Household': household} if household else {}
+        response = getattr(self.client, method)(path, json.dumps(body), 'application/json', headers=headers)
+        return response.status_code, json.loads(response.content)
+
+    def stock(self, household=None):
+        headers = {'X-Household': household} if household else {}
+        response = self.client.get('/v1/stock?itemType=milk', headers=headers)
+        return json.loads(response.content)['stock'][0]['itemCount']
+
+    def catalog(self, database):
+        return sorted(ItemType.objects.using(database).values_list('unique_barcode', flat=True))
+
+    def test_fridges_are_isolated(self):
+        item = {'itemType': 'milk', 'expirationDate': '2030-01-01', 'amount': 1}
+        self.assertEqual(self.request('put', '/v1/additem', item, self.first)[0], 200)
+        self.assertEqual(self.request('put', '/v1/addtoshoppinglist', item, self.second)[0], 200)
+
+        self.assertEqual((self.stock(self.first), self.stock(self.second), self.stock()), (1, 0, 0))
+        self.assertEqual(IndividualItem.objects.using(households.database_for(self.first)).count(), 1)
+        self.assertFalse(ShoppingList.objects.using(households.database_for(self.first)).exists())
+        self.assertEqual(ShoppingList.objects.using(households.database_for(self.second)).count(), 1)
+        self.assertEqual(self.request('put', '/v1/additem', item, 'nobody')[0], 400)
+
+    def test_catalog_writes_are_replicated(self):
+        new_type = {'unique_barcode': 'eggs', 'name': 'Eggs', 'amount_type': 'kg'}
+        self.assertEqual(self.request('put', '/v1/newtype', new_type, self.first)[0], 200)
+        for database in households.databases():
+            self.assertEqual(self.catalog(database), ['eggs', 'milk'])
+
+        status, body = self.request('post', '/v1/batch', [
+            {'op': 'new-type', 'body': dict(new_type, unique_barcode='rice', name='Rice')},
+            {'op': 'add-item', 'body': {'itemType': 'rice', 'expirationDate': '2030-01-01', 'amount': 1}},
+        ], self.second)
+        self.assertEqual(status, 200, body)
+        self.assertEqual(self.catalog(households.database_for(self.first)), ['eggs', 'milk', 'rice'])
+
+        self.assertEqual(self.request('delete', '/v1/removetype', {'unique_barcode': 'eggs'}, self.first)[0], 200)
+        for database in households.databases():
+            self.assertEqual(self.catalog(database), ['milk', 'rice'])
+
+    def test_only_catalog_writes_lock_the_catalog(self):
+        first = households.database_for(self.first)
+        with households.using(first):
+            with households.atomic() as using:
+                self.assertEqual(using, [first])
+                self.assertFalse(connections[DEFAULT_DB_ALIAS].in_atomic_block)
+            with households.atomic(catalog=True) as using:
+                self.assertEqual(using, [first, DEFAULT_DB_ALIAS])
+
+
+class ShoppingListHistoryTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+
+    def listed(self):
+        return list(InventoryEvent.objects.filter(op='listed').order_by('id').values_list('item_type', 'delta'))
+
+    def test_applied_change_is_recorded(self):
+        upsert_shopping_list({'milk': 3})
+        upsert_shopping_list({'milk': -5, 'bread': 2})
+        self.assertFalse(ShoppingList.objects.exists())
+        self.assertEqual(self.listed(), [('milk', 3), ('milk', -3)])
+
+        upsert_shopping_list({'milk': 2})
+        decrement_shopping_list('milk', 5)
+        self.assertFalse(ShoppingList.objects.exists())
+        self.assertEqual(self.listed()[2:], [('milk', 2), ('milk', -2)])
+
+    def test_entry_removed_with_its_type_is_recorded(self):
+        upsert_shopping_list({'milk': 4})
+        response = self.client.delete('/v1/removetype', json.dumps({'unique_barcode': 'milk'}), 'application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ItemType.objects.exists())
+        self.assertEqual(self.listed(), [('milk', 4), ('milk', -4)])
+
+
+class StockTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+        ItemType.objects.create(unique_barcode='eggs', name='Eggs', amount_type_id='kg')
+        self.today = timezone.localdate()
+
+    def store(self, barcode, *items):
+        """Stores an item of `barcode` per (amount, days until it expires)."""
+        return store_items([
+            IndividualItem(item_type_id=barcode, amount=amount, expiration_date=self.today + timedelta(days=days))
+            for amount, days in items
+        ])
+
+    def summaries(self):
+        return {
+            summary.item_type_id: (summary.total_amount, summary.item_count, summary.earliest_expiry)
+            for summary in StockSummary.objects.all()
+        }
+
+    def assertSummaries(self, expected):
+        """Checks the incrementally maintained summaries, then that rebuild_stock arrives at the same."""
+        expected = {
+            barcode: (total, count, self.today + timedelta(days=days))
+            for barcode, (total, count, days) in expected.items()
+        }
+        self.assertEqual(self.summaries(), expected)
+        self.assertEqual(rebuild_stock(), len(expected))
+        self.assertEqual(self.summaries(), expected)
+
+    def test_stored_items_are_summarised(self):
+        self.store('milk', (2, 10), (1, 3))
+        self.store('milk', (3, 5))
+        self.store('eggs', (6, 20))
+        self.assertSummaries({'milk': (6, 3, 3), 'eggs': (6, 1, 20)})
+
+    def test_partial_consume_uses_the_earliest_expiry_first(self):
+        self.store('milk', (2, 10), (1, 3), (3, 5))
+
+        report, message = consume('milk', 2)
+        self.assertIsNone(message)
+        self.assertEqual((report['consumed'], report['removed'], report['remaining']), (2, 1, 4))
+        self.assertEqual(report['updated']['amount'], 2)
+        self.assertEqual(
+            sorted(IndividualItem.objects.values_list('amount', 'expiration_date')),
+            [(2, self.today + timedelta(days=5)), (2, self.today + timedelta(days=10))]
+        )
+        self.assertSummaries({'milk': (4, 2, 5)})
+
+        report, message = consume('milk', 4)
+        self.assertEqual((report['consumed'], report['removed'], report['updated']), (4, 2, None))
+        self.assertSummaries({})
+
+    def test_insufficient_stock_consumes_nothing(self):
+        self.store('milk', (2, 10), (1, 3))
+
+        self.assertEqual(consume('milk', 4), (None, 'Not enough stock'))
+        self.assertEqual(consume('eggs', 1), (None, 'Not enough stock'))
+        self.assertEqual(consume('bread', 1), (None, 'Item type does not exist'))
+        self.assertEqual(IndividualItem.objects.count(), 2)
+        self.assertSummaries({'milk': (3, 2, 3)})
+
+    def test_deleted_items_are_released(self):
+        earliest, latest = self.store('milk', (1, 3), (2, 10))
+        self.store('eggs', (6, 20))
+
+        delete_ids(IndividualItem, [earliest.id])
+        self.assertSummaries({'milk': (2, 1, 10), 'eggs': (6, 1, 20)})
+
+        delete_ids(IndividualItem, [latest.id])
+        self.assertSummaries({'eggs': (6, 1, 20)})
+
+    def test_purchases_are_added(self):
+        upsert_shopping_list({'milk': 3})
+        items, errors = settle_purchases([
+            (0, {'itemType': 'milk', 'amount': 2, 'expirationDate': self.today + timedelta(days=4)}),
+            (1, {'itemType': 'milk', 'amount': 2, 'expirationDate': self.today + timedelta(days=4)}),
+        ])
+        self.assertEqual((len(items), errors), (1, [{'index': 1, 'message': 'Not enough amount in shopping list'}]))
+        self.assertSummaries({'milk': (2, 1, 4)})
+
+
+class DeleteTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+        ItemType.objects.create(unique_barcode='eggs', name='Eggs', amount_type_id='kg')
+        today = timezone.localdate()
+        self.ids = [item.id for item in store_items([
+            IndividualItem(item_type_id=barcode, amount=1, expiration_date=today)
+            for barcode in ['milk'] * 5 + ['eggs'] * 4
+        ])]
+
+    def test_chunks_are_counted(self):
+        report = delete_matching(IndividualItem.objects.filter(item_type='milk'), chunk_size=2)
+        self.assertEqual((report['deleted'], report['chunks']), (5, [2, 2, 1]))
+
+        report = delete_matching(IndividualItem.objects.filter(item_type='eggs'), chunk_size=2)
+        self.assertEqual((report['deleted'], report['chunks']), (4, [2, 2]))
+        self.assertFalse(IndividualItem.objects.exists())
+        self.assertFalse(StockSummary.objects.exists())
+
+    def test_deleted_counts_are_reported(self):
+        response = self.client.delete('/v1/purgeitems', json.dumps({'itemType': 'milk'}), 'application/json')
+        self.assertEqual(json.loads(response.content)['deleted'], 5)
+
+        response = self.client.delete(
+            '/v1/removeitems', json.dumps([{'ID': self.ids[-1]}, {'ID': self.ids[-1]}, {'ID': 999999}]),
+            'application/json'
+        )
+        self.assertEqual(json.loads(response.content)['deleted'], 1)
+        self.assertEqual(StockSummary.objects.get(item_type='eggs').item_count, 3)
+
+
+class ReplenishTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        for barcode in ('milk', 'eggs', 'rice'):
+            ItemType.objects.create(unique_barcode=barcode, name=barcode.title(), amount_type_id='kg')
+        self.today = timezone.localdate()
+
+    def store(self, barcode, amount, days):
+        expiration_date = self.today + timedelta(days=days)
+        store_items([IndividualItem(item_type_id=barcode, amount=amount, expiration_date=expiration_date)])
+
+    def test_shortfalls_count_only_items_that_outlast_the_horizon(self):
+        # The default horizon is REPLENISH_EXPIRY_HORIZON_DAYS (2): milk expiring in 2 days is not usable stock.
+        ParLevel.objects.create(item_type_id='milk', amount=10)
+        self.store('milk', 4, 2)
+        self.store('milk', 3, 3)
+        upsert_shopping_list({'milk': 1})
+        # A horizon of its own: eggs expiring tomorrow still count.
+        ParLevel.objects.create(item_type_id='eggs', amount=5, expiry_horizon_days=0)
+        self.store('eggs', 5, 1)
+        # No stock at all.
+        ParLevel.objects.create(item_type_id='rice', amount=2)
+
+        self.assertEqual(replenish(self.today, dry_run=True), {'milk': 6, 'rice': 2})
+        self.assertEqual(dict(ShoppingList.objects.values_list('item_type', 'amount')), {'milk': 1})
+
+        self.assertEqual(replenish(self.today), {'milk': 6, 'rice': 2})
+        self.assertEqual(dict(ShoppingList.objects.values_list('item_type', 'amount')), {'milk': 7, 'rice': 2})
+        self.assertEqual(replenish(self.today), {})
+
+
+def snapshot_values(column):
+    """A snapshot column as a list, with dates as days since 1970-01-01 whatever the format."""
+    values = column.to_pylist() if hasattr(column, 'to_pylist') else list(column)
+    return [value.toordinal() - EPOCH_ORDINAL if isinstance(value, date) else value for value in values]
+
+
+class SnapshotTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+        ItemType.objects.create(unique_barcode='eggs', name='Æggs', amount_type_id='kg')
+        self.items = store_items([
+            IndividualItem(item_type_id='milk', amount=1.5, expiration_date=date(2030, 1, 2)),
+            IndividualItem(item_type_id='eggs', amount=6, expiration_date=date(1969, 12, 31)),
+        ])
+        upsert_shopping_list({'milk': 2})
+
+    def assertRoundTrip(self, format):
+        with tempfile.TemporaryDirectory() as directory:
+            counts = write_snapshot(directory, format)
+            self.assertEqual(counts, {'items': 2, 'item_types': 2, 'shopping_list': 1})
+            tables = {
+                table: {name: snapshot_values(column) for name, column in columns.items()}
+                for table, columns in read_snapshot(directory).items()
+            }
+
+        self.assertEqual(tables['item_types'], {
+            'unique_barcode': ['eggs', 'milk'], 'name': ['Æggs', 'Milk'], 'amount_type': ['kg', 'kg']
+        })
+        self.assertEqual(tables['items'], {
+            'id': [item.id for item in self.items],
+            'item_type': [1, 0],
+            'amount': [1.5, 6.0],
+            'expiration_date': [date(2030, 1, 2).toordinal() - EPOCH_ORDINAL, -1],
+        })
+        self.assertEqual(tables['shopping_list'], {'item_type': [1], 'amount': [2.0]})
+
+    def test_columns_round_trip(self):
+        self.assertRoundTrip('columns')
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_arrow_round_trip(self):
+        self.assertRoundTrip('arrow')
+
+
+class StockHistoryTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+        ItemType.objects.create(unique_barcode='milk', name='Milk', amount_type_id='kg')
+        self.day = timezone.now().date() - timedelta(days=3)
+
+    def at(self, days, hour):
+        return datetime.combine(self.day + timedelta(days=days), time(hour), tzinfo=dt_timezone.utc)
+
+    def stock_at(self, days, hour):
+        return history.stock_at(['milk'], self.at(days, hour), 'default')['milk']
+
+    def test_stock_at_before_and_after_compaction(self):
+        expires = timezone.localdate() + timedelta(days=30)
+        store_items([IndividualItem(item_type_id='milk', amount=5, expiration_date=expires)])
+        consume('milk', 2)
+        store_items([IndividualItem(item_type_id='milk', amount=1, expiration_date=expires)])
+        added, consumed, added_again = InventoryEvent.objects.order_by('id')
+        # Spread the events over two days.
+        for event, occurred_at in [(added, self.at(0, 10)), (consumed, self.at(0, 12)), (added_again, self.at(1, 9))]:
+            InventoryEvent.objects.filter(id=event.id).update(occurred_at=occurred_at)
+
+        self.assertEqual(self.stock_at(-1, 12), (0, True))
+        self.assertEqual(self.stock_at(0, 11), (5, True))
+        self.assertEqual(self.stock_at(0, 13), (3, True))
+        self.assertEqual(self.stock_at(1, 10), (4, True))
+
+        self.assertEqual(history.compact(self.day + timedelta(days=1), 'default'), (1, 2))
+        self.assertEqual(self.stock_at(-1, 12), (0, True))
+        self.assertEqual(self.stock_at(0, 11), (0, False))
+        self.assertEqual(self.stock_at(0, 13), (0, False))
+        self.assertEqual(self.stock_at(1, 10), (4, True))
+
+        self.assertEqual(history.compact(self.day + timedelta(days=2), 'default'), (1, 1))
+        self.assertEqual(self.stock_at(1, 10), (3, False))
+        self.assertEqual(self.stock_at(2, 10), (4, True))
+
+
+class CatalogImportTests(TransactionTestCase):
+    def setUp(self):
+        AmountType.objects.create(name='kg')
+
+    def test_lines_that_are_not_utf8_are_reported(self):
+        for content_type, body in [
+            ('text/csv', b'unique_barcode,name,amount_type\nmilk,Milk,kg\neggs,\xff,kg\n'),
+            ('application/x-ndjson',
+             b'{"unique_barcode": "milk", "name": "Milk", "amount_type": "kg"}\n{"unique_barcode": "\xff"}\n'),
+        ]:
+            response = self.client.put('/v1/importtypes', body, content_type=content_type)
+            self.assertEqual(response.status_code, 200)
+            report = json.loads(response.content)
+            self.assertEqual(report['imported'], 1)
+            self.assertEqual(report['errors'][0]['message'], 'Line is not valid UTF-8')
+
+    def test_retried_import_is_replayed(self):
+        body = b'unique_barcode,name,amount_type\nmilk,Milk,kg\nrice,Rice,g\n'
+
+        def put(body):
+            return self.client.put('/v1/importtypes', body, content_type='text/csv', HTTP_IDEMPOTENCY_KEY='import-1')
+
+        first = put(body)
+        self.assertEqual(json.loads(first.content)['amountTypesCreated'], 1)
+
+        retry = put(body)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(put(body + b'eggs,Eggs,kg\n').status_code, 422)
+        self.assertEqual(ItemType.objects.count(), 2)
@@ -0,0 +1,54 @@
+"""
+Bearer token authentication for the "api" stack profile (see mysite/settings.py).
+
+The api profile drops sessions and CSRF protection. Instead, TokenAuthMiddleware
+answers requests with unsafe methods (PUT, PATCH, POST, DELETE) with 401 unless
+they carry an `Authorization: Bearer <token>` header naming one of
+settings.API_TOKENS. Reads stay open, as they are under CSRF. Tokens are
+compared in constant time and never touch the database.
+"""
+import hmac
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .codec import error
+
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'TRACE'])
+UNAUTHORIZED = error('A valid API token is required', status=401)
+
+
+def has_valid_token(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    token = token.strip().encode()
+    # Check every token, so the time taken does not reveal which one matched.
+    return sum(hmac.compare_digest(token, known.encode()) for known in settings.API_TOKENS) > 0
+
+
+def _unauthorized():
+    response = UNAUTHORIZED.response()
+    response['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+class TokenAuthMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if request.method not in SAFE_METHODS and not has_valid_token(request):
+            return _unauthorized()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method not in SAFE_METHODS and not has_valid_token(request):
+            return _unauthorized()
+        return await self.get_response(request)
@@ -0,0 +1,106 @@
+"""
+Per-table change counters for conditional GETs.
+
+Every INSERT, UPDATE or DELETE on a tracked table bumps that table's counter in
+the TableVersion table, in the same transaction as the write, so the counters
+are shared by every process serving the API and never run ahead of the data.
+Writes are spotted by a database execute wrapper installed on every
+connection, like the query timer in metrics.py, so ORM, bulk and raw SQL
+writes are all counted. Read views build their ETag and Last-Modified headers
+from the counters with the @conditional_on(...) decorator, and answer
+unchanged polls with a 304 after one primary key lookup.
+
+Counters start from a random value (see migration 0008), so the ETags of a
+recreated database never match old ones by accident. Each database keeps its
+own counters, so each household (app/households.py) has versions of its own
+and a poll is answered from the counters of the household it names.
+"""
+import random
+import re
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .households import read_database
+from .models import ItemType, ShoppingList, TableVersion
+
+TRACKED_TABLES = frozenset(model._meta.db_table for model in (ItemType, ShoppingList))
+WRITE_STATEMENT = re.compile(r'\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+["`]?(\w+)', re.IGNORECASE)
+BUMP = (
+    f'INSERT INTO {TableVersion._meta.db_table} (name, version, modified) VALUES (%s, %s, %s) '
+    'ON CONFLICT (name) DO UPDATE SET version = version + 1, modified = excluded.modified'
+)
+
+
+def bump(table, connection):
+    """Marks `table` as changed, in the current transaction of `connection`."""
+    with connection.cursor() as cursor:
+        cursor.execute(BUMP, [table, random.getrandbits(48), time.time()])
+
+
+def _versions(tables, rows):
+    etag = '-'.join(format(rows[table].version, 'x') if table in rows else '0' for table in tables)
+    modified = max((rows[table].modified for table in tables if table in rows), default=0)
+    return f'"{etag}"', datetime.fromtimestamp(modified, timezone.utc)
+
+
+def versions(tables, database='default'):
+    """Returns (ETag, last modified datetime) for the current contents of `tables` in `database`."""
+    return _versions(tables, TableVersion.objects.using(database).in_bulk(tables))
+
+
+async def aversions(tables, database='default'):
+    return _versions(tables, await TableVersion.objects.using(database).ain_bulk(tables))
+
+
+def track_writes(execute, sql, params, many, context):
+    result = execute(sql, params, many, context)
+    match = WRITE_STATEMENT.match(sql)
+    if match and match.group(1) in TRACKED_TABLES:
+        bump(match.group(1), context['connection'])
+    return result
+
+
+@receiver(connection_created)
+def install_write_tracker(sender, connection, **kwargs):
+    if track_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_writes)
+
+
+def conditional_on(*models):
+    """
+    Decorates a sync or async read view so that it is only run when one of
+    `models` changed since the version the client (or a proxy) already has.
+    The counters are read before the view runs, so a response is never
+    labelled with a version newer than its data. Async views read them with
+    the async ORM before Django's condition() looks at them.
+    """
+    tables = [model._meta.db_table for model in models]
+
+    def current_versions(request):
+        if not hasattr(request, '_table_versions'):
+            request._table_versions = versions(tables, read_database())
+        return request._table_versions
+
+    def decorator(view):
+        view = condition(
+            etag_func=lambda request, *args, **kwargs: current_versions(request)[0],
+            last_modified_func=lambda request, *args, **kwargs: current_versions(request)[1],
+        )(view)
+        view = cache_control(max_age=getattr(settings, 'READ_CACHE_MAX_AGE', 0), must_revalidate=True)(view)
+        if not iscoroutinefunction(view):
+            return view
+
+        @wraps(view)
+        async def read_versions_first(request, *args, **kwargs):
+            request._table_versions = await aversions(tables, read_database())
+            return await view(request, *args, **kwargs)
+
+        return read_versions_first
+
+    return decorator
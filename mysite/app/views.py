@@ -1,407 +1,395 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
-from datetime import datetime
-from .models import AmountType, ItemType, IndividualItem, ShoppingList
-import json 
+from . import history, households
+from .api import (
+    ADDED_TO_SHOPPING_LIST, AMOUNT_TYPE_MISSING, ITEM_ADDED, ITEM_DELETED, ITEM_TYPE_MISSING, MISSING_FILTER,
+    MISSING_ID, PAR_LEVEL_CONFLICTS, PURCHASED, REMOVED_FROM_SHOPPING_LIST, TYPE_ADDED, TYPE_IN_USE, TYPE_REMOVED,
+    batch_response, build_items, build_par_levels, catalog_export_format, catalog_import_format, consume_response,
+    delete_response, encode_expiry_cursor, expiring_item_json, expiring_items_query, filter_items, import_response,
+    item_types_query, item_types_response, search_query, search_response, shopping_list_query, shopping_list_response,
+    stock_at_query, stock_at_response, stock_query, stock_response, sum_shopping_list_deltas, type_in_use
+)
+from .cache import get_amount_type, get_item_types
+from .catalog import FORMATS, READERS, export_catalog, import_catalog
+from .codec import dumps, error, error_response, json_response
+from .households import databases, read_database
+from .idempotency import idempotent
+from .inventory import (
+    consume, decrement_shopping_list, delete_ids, delete_matching, settle_purchases, store_items, upsert_shopping_list
+)
+from .models import ItemType, IndividualItem, ParLevel, ShoppingList, StockSummary
+from .schema import (
+    BATCH_OPERATION, CONSUMPTION, ITEM, ITEM_FILTER, ITEM_ID, NEW_TYPE, PAR_LEVEL, SHOPPING_LIST_DELTA,
+    SHOPPING_LIST_ITEM, TYPE_BARCODE, clean_body, validate_body, validate_request
+)
+from .responses import exception_response
+from .search import search_item_types
+from .versions import conditional_on
+import inspect
+
+BATCH_MAX_OPERATIONS = 100
+
+CHANGE_FEED_NEEDS_ASGI = error('The change feed is only served by the ASGI application', status=501)
+
 
 @require_http_methods(["PUT"])
-def add_item(request):
-    try:
-        data = json.loads(request.body)
-
-        required_fields = ['itemType', 'expirationDate', 'amount']
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }, status=400)
-            
-        try:
-            expiration_date = datetime.strptime(data['expirationdate'], '%Y-%m-%d').date()
-        except ValueError:
-            return JsonResponse({
-                'status': 'error',
-                'messsage': 'Invalid date format. Use YYYY-MM-DD'
-            }, status=400)
-        
-        if not isinstance(data['amount'], int) or data['amount'] <= 0:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Amount must be a positive integer'
-            }, status=400)
-        
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Item added successfully',
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
-    
+@idempotent
+@validate_body(ITEM)
+def add_item(request, data):
+    errors = []
+    items = build_items([(0, data)], errors, get_item_types({data['itemType']}).keys())
+
+    if errors:
+        return ITEM_TYPE_MISSING.response()
+
+    store_items(items)
+    return ITEM_ADDED.response()
+
+
+@require_http_methods(['PUT'])
+@idempotent
+@validate_body(ITEM, many=True)
+def add_items(request, rows, errors):
+    total = len(rows) + len(errors)
+    items = store_items(build_items(rows, errors, get_item_types({row['itemType'] for _, row in rows}).keys()))
+
+    return batch_response('items added successfully', len(items), total, errors)
+
+
 @require_http_methods(['DELETE'])
-def delete_item(request):
-    try:
-        data = json.loads(request.body)
-
-        if 'ID' not in data:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Missing required field: ID'
-            }, status=400)
-
-        item_id = data['ID']
-
-        IndividualItem.objects.filter(id=item_id).delete()
-
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Item deleted successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
-    
+@idempotent
+@validate_body(ITEM_ID)
+def delete_item(request, data):
+    delete_ids(IndividualItem, [data['ID']])
+    return ITEM_DELETED.response()
+
+
 @require_http_methods(['DELETE'])
-def delete_items(request):
-    try:
-        data = json.loads(request.body)
-
-        if not isinstance(data, list):
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Request body must be a list'
-            }, status=400)
-    
-        item_ids = [item['ID'] for item in data if 'ID' in item]
-
-        if not item_ids:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Missing required field: ID'
-            }, status=400)
-        
-        IndividualItem.objects.filter(id__in=item_ids).delete()
-
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Items deleted successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
+@idempotent
+@validate_body(ITEM_ID, many=True)
+def delete_items(request, rows, errors):
+    item_ids = [row['ID'] for _, row in rows]
+
+    if not item_ids and not errors:
+        return MISSING_ID.response()
+
+    return delete_response(delete_ids(IndividualItem, item_ids), errors)
+
+
+@require_http_methods(['DELETE'])
+@idempotent
+@validate_body(ITEM_FILTER)
+def purge_items(request, data):
+    items = filter_items(data)
+
+    if items is None:
+        return MISSING_FILTER.response()
+
+    return delete_response(delete_matching(items))
+
+
+@require_http_methods(['DELETE'])
+@idempotent
+@validate_body(CONSUMPTION)
+def consume_items(request, data):
+    return consume_response(*consume(data['itemType'], data['amount']))
+
+
+def _stream_expiring_items(items, limit):
+    """Yields the expiring items response as JSON chunks, one item at a time."""
+    yield b'{"status": "success", "items": ['
+
+    count = 0
+    last_item = None
+    for item in items.iterator(chunk_size=500):
+        yield (b', ' if count else b'') + expiring_item_json(item)
+        count += 1
+        last_item = item
+
+    next_cursor = encode_expiry_cursor(last_item) if count == limit else None
+    yield b'], "next": ' + dumps(next_cursor) + b'}'
+
+
+@require_http_methods(['GET'])
+@validate_request(expiring_items_query)
+def expiring_items(request, items, limit):
+    return StreamingHttpResponse(
+        _stream_expiring_items(items, limit),
+        content_type='application/json'
+    )
+
+
+@require_http_methods(['GET'])
+@validate_request(stock_query)
+def stock(request, barcodes):
+    summaries = StockSummary.objects.using(read_database()).in_bulk(barcodes)
+    missing = set(barcodes) - summaries.keys()
+
+    return stock_response(barcodes, summaries, get_item_types(missing).keys() if missing else ())
+
+
+@require_http_methods(['GET'])
+@validate_request(stock_at_query)
+def stock_at(request, barcodes, at):
+    return stock_at_response(barcodes, at, history.stock_at(barcodes, at, read_database()))
+
 
 @require_http_methods(['PUT'])
-def new_type (request):
-    try:
-        data = json.loads(request.body)
-    
-        required_fields = ['unique_barcode', 'name', 'amount_type']
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }, status=400)
-        
-        if not isinstance(data['unique_barcode'], str) or not data['unique_barcode']:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Unique barcode must be a non-empty string'
-            }, status=400)
-        
-        if not isinstance(data['name'], str) or not data['name']:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Name must be a non-empty string'
-            }, status=400)
-        
-        if not isinstance(data['amount_type'], str) or not data['amount_type']:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Amount type must be a non-empty string'
-            }, status=400)
-        
-        if not AmountType.objects.filter(name=data['amount_type']).exists():
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Amount type does not exist'
-            }, status=400)
-        
-        ItemType.objects.create(
-            unique_barcode=data['unique_barcode'],
-            name=data['name'],
-            amount_type=AmountType.objects.get(name=data['amount_type']))
-        
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Type added successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
+@idempotent(catalog=True)
+@validate_body(NEW_TYPE)
+def new_type(request, data):
+    amount_type = get_amount_type(data['amount_type'])
+
+    if amount_type is None:
+        return AMOUNT_TYPE_MISSING.response()
+
+    ItemType.objects.create(
+        unique_barcode=data['unique_barcode'],
+        name=data['name'],
+        amount_type=amount_type)
+
+    return TYPE_ADDED.response()
+
+
+@require_http_methods(['PUT'])
+@idempotent(streamed=True)
+@validate_request(catalog_import_format)
+def import_types(request, format):
+    return import_response(import_catalog(READERS[format](request)))
+
+
+@require_http_methods(['GET'])
+@conditional_on(ItemType)
+@validate_request(catalog_export_format)
+def export_types(request, format):
+    return StreamingHttpResponse(export_catalog(format, settings.READ_DATABASE), content_type=FORMATS[format])
+
+
+@require_http_methods(['GET'])
+@conditional_on(ItemType)
+@validate_request(item_types_query)
+def item_types(request, rows, limit):
+    return item_types_response(list(rows), limit)
+
+
+@require_http_methods(['GET'])
+@conditional_on(ItemType)
+@validate_request(search_query)
+def search_types(request, text, limit):
+    return search_response(search_item_types(text, limit, settings.READ_DATABASE))
+
 
 @require_http_methods(['DELETE'])
-def remove_type(request):
-    try:
-        data = json.loads(request.body)
-
-        if 'unique_barcode' not in data:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Missing required field: unique_barcode'
-            }, status=400)
-        
-        unique_barcode = data['unique_barcode']
-
-        if IndividualItem.objects.filter(item_type__unique_barcode=unique_barcode).exists():
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Cannot remove type because items of this type exist'
-            }, status=400)
-
-        ItemType.objects.filter(unique_barcode=unique_barcode).delete()
-
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Type removed successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
-    
+@idempotent(catalog=True)
+@validate_body(TYPE_BARCODE)
+def remove_type(request, data):
+    unique_barcode = data['unique_barcode']
+
+    if any(type_in_use(database, unique_barcode).exists() for database in databases()):
+        return TYPE_IN_USE.response()
+
+    households.delete_item_types([unique_barcode], DEFAULT_DB_ALIAS)
+    return TYPE_REMOVED.response()
+
+
+@require_http_methods(['GET'])
+@conditional_on(ShoppingList, ItemType)
+@validate_request()
+def shopping_list(request):
+    return shopping_list_response(list(shopping_list_query()))
+
+
+@require_http_methods(['GET'])
+def changes(request):
+    """
+    The change feed (app/events.py). Every open stream would hold a WSGI
+    worker thread, so it is only served by the async view.
+    """
+    return CHANGE_FEED_NEEDS_ASGI.response()
+
+
 @require_http_methods(['PUT'])
-def add_to_shopping_list(request):
-    try:
-        data = json.loads(request.body)
-
-        required_fields = ['itemType', 'amount']
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }, status=400)
-        
-        if not isinstance(data['amount'], int) or data['amount'] <= 0:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Amount must be a positive integer'
-            }, status=400)
-        
-        if not ItemType.objects.filter(unique_barcode=data['itemType']).exists():
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Item type does not exist'
-            }, status=400)
-        
-        item_type = ItemType.objects.get(unique_barcode=data['itemType'])
-        
-        shopping_list_item, created = ShoppingList.objects.get_or_create(
-            item_type=item_type,
-            defaults={'amount': data['amount']}
-        )
-        
-        if not created:
-            shopping_list_item.amount += data['amount']
-            shopping_list_item.save()
-        
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Item added to shopping list successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
+@idempotent
+@validate_body(SHOPPING_LIST_ITEM)
+def add_to_shopping_list(request, data):
+    if not upsert_shopping_list({data['itemType']: data['amount']}):
+        return ITEM_TYPE_MISSING.response()
+
+    return ADDED_TO_SHOPPING_LIST.response()
+
 
 @require_http_methods(['DELETE'])
-def remove_from_shopping_list(request):
-    try:
-        data = json.loads(request.body)
-
-        required_fields = ['itemType', 'amount']
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }, status=400)
-        
-        if not isinstance(data['amount'], int) or data['amount'] <= 0:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Amount must be a positive integer'
-            }, status=400)
-        
-        if not ItemType.objects.filter(unique_barcode=data['itemType']).exists():
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Item type does not exist'
-            }, status=400)
-        
-        item_type = ItemType.objects.get(unique_barcode=data['itemType'])
-
-        try:
-            shopping_list_item = ShoppingList.objects.get(item_type=item_type)
-        except ShoppingList.DoesNotExist:
-            return JsonResponse({
-            'status': 'error',
-            'message': 'Item not found in shopping list'
-            }, status=400)
-
-        shopping_list_item.amount -= data['amount']
-        
-        if shopping_list_item.amount <= 0:
-            shopping_list_item.delete()
-        else:
-            shopping_list_item.save()
-
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Item removed from shopping list successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid JSON format'
-        }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
-    
+@idempotent
+@validate_body(SHOPPING_LIST_ITEM)
+def remove_from_shopping_list(request, data):
+    message = decrement_shopping_list(data['itemType'], data['amount'])
+
+    if message:
+        return error_response(message)
+
+    return REMOVED_FROM_SHOPPING_LIST.response()
+
+
 @require_http_methods(['PATCH'])
-def purchase_item(request):
-    try:
-        data = json.loads(request.body)
-        required_fields = ['itemType', 'amount', 'expirationDate']
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }, status=400)
-        
-        if not isinstance(data['amount'], int) or data['amount'] <= 0:
-            return JsonResponse({
-            'status': 'error',
-            'message': 'Amount must be a positive integer'
-            }, status=400)
-        
-        try:
-            expiration_date = datetime.strptime(data['expirationDate'], '%Y-%m-%d').date()
-        except ValueError:
-            return JsonResponse({
-            'status': 'error',
-            'message': 'Invalid date format. Use YYYY-MM-DD'
-            }, status=400)
-        
-        if not ItemType.objects.filter(unique_barcode=data['itemType']).exists():
-            return JsonResponse({
-            'status': 'error',
-            'message': 'Item type does not exist'
-            }, status=400)
-        
-        item_type = ItemType.objects.get(unique_barcode=data['itemType'])
-
-        try:
-            shopping_list_item = ShoppingList.objects.get(item_type=item_type)
-        except ShoppingList.DoesNotExist:
-            return JsonResponse({
-            'status': 'error',
-            'message': 'Item not found in shopping list'
-            }, status=400)
+@idempotent
+@validate_body(SHOPPING_LIST_DELTA, many=True)
+def update_shopping_list(request, rows, errors):
+    known_barcodes = get_item_types({row['itemType'] for _, row in rows}).keys()
+    upsert_shopping_list(sum_shopping_list_deltas(rows, errors, known_barcodes))
 
-        if shopping_list_item.amount < data['amount']:
-            return JsonResponse({
-            'status': 'error',
-            'message': 'Not enough amount in shopping list'
-            }, status=400)
-
-        shopping_list_item.amount -= data['amount']
-        
-        if shopping_list_item.amount <= 0:
-            shopping_list_item.delete()
-        else:
-            shopping_list_item.save()
-
-        IndividualItem.objects.create(
-            item_type=item_type,
-            amount=data['amount'],
-            expiration_date=expiration_date
-        )
-
-        return JsonResponse({
-            'status': 'success',
-            'message': 'Item purchased and added to fridge successfully'
-        }, status=200)
-    
-    except json.JSONDecodeError:
-        return JsonResponse({
+    return json_response({
+        'status': 'success',
+        'message': 'Shopping list updated successfully',
+        'errors': sorted(errors, key=lambda error: error['index'])
+    })
+
+
+@require_http_methods(['PUT'])
+@idempotent
+@validate_body(PAR_LEVEL, many=True)
+def set_par_levels(request, rows, errors):
+    total = len(rows) + len(errors)
+    levels = build_par_levels(rows, errors, get_item_types({row['itemType'] for _, row in rows}).keys())
+
+    ParLevel.objects.bulk_create(levels, **PAR_LEVEL_CONFLICTS)
+
+    return batch_response('par levels set successfully', len(levels), total, errors)
+
+
+@require_http_methods(['PATCH'])
+@idempotent
+@validate_body(ITEM)
+def purchase_item(request, data):
+    _, errors = settle_purchases([(0, data)])
+
+    if errors:
+        return error_response(errors[0]['message'])
+
+    return PURCHASED.response()
+
+
+@require_http_methods(['PATCH'])
+@idempotent
+@validate_body(ITEM, many=True)
+def purchase_items(request, rows, errors):
+    total = len(rows) + len(errors)
+    items, settle_errors = settle_purchases(rows)
+
+    return batch_response('items purchased and added to fridge successfully', len(items), total, errors + settle_errors)
+
+
+BATCH_OPERATIONS = {
+    'add-item': add_item,
+    'add-items': add_items,
+    'delete-item': delete_item,
+    'delete-items': delete_items,
+    'purge-items': purge_items,
+    'consume-items': consume_items,
+    'new-type': new_type,
+    'remove-type': remove_type,
+    'add-to-shopping-list': add_to_shopping_list,
+    'remove-from-shopping-list': remove_from_shopping_list,
+    'update-shopping-list': update_shopping_list,
+    'set-par-levels': set_par_levels,
+    'purchase-item': purchase_item,
+    'purchase-items': purchase_items,
+}
+CATALOG_OPERATIONS = frozenset(['new-type', 'remove-type'])
+BATCH_HANDLERS = {op: (view.body_schema, inspect.unwrap(view)) for op, view in BATCH_OPERATIONS.items()}
+
+
+def _check_batch(rows, errors):
+    """Returns an error response if the batch cannot be run as a whole, or None."""
+    for index, row in rows:
+        if row['op'] not in BATCH_HANDLERS:
+            errors.append({'index': index, 'message': f"Unknown operation: {row['op']}"})
+
+    if errors:
+        return json_response({
             'status': 'error',
-            'message': 'Invalid JSON format'
+            'message': 'Invalid operations; nothing was run',
+            'errors': sorted(errors, key=lambda error: error['index'])
         }, status=400)
-    
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=500)
-        
\ No newline at end of file
+
+    if not 0 < len(rows) <= BATCH_MAX_OPERATIONS:
+        return error_response(f'A batch must have between 1 and {BATCH_MAX_OPERATIONS} operations')
+
+    return None
+
+
+def _batch_barcodes(rows):
+    bodies = [row['body'] for _, row in rows]
+    records = [record for body in bodies for record in (body if isinstance(body, list) else [body])]
+    return {
+        record.get(field) for record in records if isinstance(record, dict)
+        for field in ('itemType', 'unique_barcode') if isinstance(record.get(field), str)
+    }
+
+
+def _run_batch(request, rows):
+    """
+    Runs the operations of a batch in order, in one transaction, through the
+    same code as their own endpoints. Every barcode in the batch is resolved
+    up front in one query, so the operations find their item types cached.
+    The first operation that fails rolls the whole batch back.
+
+    With a household selected, a batch with catalog operations commits to
+    "default" along with it (see households.atomic); other batches only lock
+    the household's database.
+
+    Returns (result JSON fragments, None), or (result JSON fragments, (index,
+    response)) for the operation that failed.
+    """
+    get_item_types(_batch_barcodes(rows))
+    results = []
+
+    catalog = any(row['op'] in CATALOG_OPERATIONS for _, row in rows)
+    with households.atomic(catalog) as using:
+        for index, row in rows:
+            (schema, many), handler = BATCH_HANDLERS[row['op']]
+            args, response = clean_body(row['body'], schema, many)
+            if response is None:
+                try:
+                    response = handler(request, *args)
+                except Exception as e:
+                    response = exception_response(e)
+
+            results.append(
+                b'{"op": ' + dumps(row['op']) + b', "statusCode": ' + str(response.status_code).encode()
+                + b', "body": ' + response.content + b'}'
+            )
+            if response.status_code >= 400:
+                for database in using:
+                    transaction.set_rollback(True, using=database)
+                return results, (index, response)
+
+    return results, None
+
+
+def _batch_operations_response(results, failure):
+    if failure is None:
+        head = b'{"status": "success", "message": ' + dumps(f'{len(results)} operations applied successfully')
+        status = 200
+    else:
+        index, response = failure
+        head = b'{"status": "error", "message": ' + dumps(f'Operation {index} failed; no changes were made')
+        status = response.status_code
+
+    return HttpResponse(
+        head + b', "results": [' + b', '.join(results) + b']}',
+        content_type='application/json',
+        status=status
+    )
+
+
+@require_http_methods(['POST'])
+@idempotent
+@validate_body(BATCH_OPERATION, many=True)
+def batch(request, rows, errors):
+    response = _check_batch(rows, errors)
+    if response:
+        return response
+
+    return _batch_operations_response(*_run_batch(request, rows))
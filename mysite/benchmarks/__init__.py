@@ -0,0 +1,12 @@
+"""
+Benchmark and load-test suite for the inventory API.
+
+Run from the mysite directory:
+
+    python -m benchmarks --items 10000 --requests 500 --output results.json
+
+The suite seeds a throwaway SQLite database, drives every routed endpoint
+through the Django test client, the ASGI application and local WSGI/ASGI
+servers, and reports throughput, latency percentiles and queries per request.
+The JSON output can be diffed between commits to catch regressions.
+"""
@@ -0,0 +1,126 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark every inventory endpoint.')
+    parser.add_argument('--amount-types', type=int, default=10)
+    parser.add_argument('--item-types', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--shopping-list', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and mode')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent connections for the server modes')
+    parser.add_argument('--modes', default='client,asgi,wsgi-server,asgi-server')
+    parser.add_argument('--scenarios', default='', help='comma-separated URL names (default: all)')
+    parser.add_argument('--database', help='SQLite file to use (default: a temporary file)')
+    parser.add_argument('--settings', default='mysite.settings')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    return parser.parse_args(argv)
+
+
+def setup_django(args):
+    os.environ['DJANGO_SETTINGS_MODULE'] = args.settings
+    from django.conf import settings
+    from .drivers import API_TOKEN
+
+    settings.DATABASES['default']['NAME'] = args.database
+    if settings.READ_DATABASE != 'default':
+        settings.DATABASES[settings.READ_DATABASE]['NAME'] = f'file:{args.database}?mode=ro'
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['localhost', '127.0.0.1']
+    settings.API_TOKENS = [API_TOKEN]
+
+    import django
+    django.setup()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    temporary = args.database is None
+    if temporary:
+        args.database = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    setup_django(args)
+
+    import django
+    from django.core.management import call_command
+    from django.urls import get_resolver
+    from app import codec
+    from .drivers import MODES
+    from .scenarios import SCENARIOS, STREAMS
+    from .seed import seed
+
+    call_command('migrate', verbosity=0)
+    seed(args.amount_types, args.item_types, args.items, args.shopping_list, seed=args.seed)
+
+    routed = [pattern.name for pattern in get_resolver().url_patterns if getattr(pattern, 'name', None)]
+    for name in routed:
+        if name not in SCENARIOS and name not in STREAMS:
+            print(f'warning: no benchmark scenario for URL {name!r}', file=sys.stderr)
+
+    names = args.scenarios.split(',') if args.scenarios else [name for name in routed if name in SCENARIOS]
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'json_backend': codec.BACKEND,
+            'args': vars(args),
+        },
+        'results': {},
+    }
+
+    for mode in args.modes.split(','):
+        server, run = MODES[mode]
+        with server() if server else contextlib.nullcontext() as port:
+            if server and port is None:
+                print(f'skipping {mode}: server not available', file=sys.stderr)
+                continue
+
+            results = report['results'][mode] = {}
+            for name in names:
+                requests = SCENARIOS[name](args.requests, args.item_types, random.Random(args.seed))
+                results[name] = run(port, requests, args.concurrency)
+                print(_format_row(mode, name, results[name]))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if temporary:
+        os.remove(args.database)
+
+
+def _format_row(mode, name, result):
+    queries = result.get('queries_per_request')
+    return (
+        f'{mode:<12} {name:<26} {result["throughput_rps"]:>9.1f} req/s  '
+        f'p50 {result["p50_ms"]:>7.2f} ms  p99 {result["p99_ms"]:>7.2f} ms'
+        + (f'  {queries:>5.1f} queries' if queries is not None else '')
+        + f'  {result["statuses"]}'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Measures write latency under a burst, with and without write admission control.
+
+    python -m benchmarks.admission --writers 32 --requests 50
+
+Each run seeds a fresh database in its own process, then `--writers` threads
+each PATCH receipts to /v1/purchaseitems as fast as they can, like a delivery
+being scanned in on many devices at once. Without app.admission.AdmissionMiddleware
+every writer queues on SQLite's write lock for up to its busy timeout; with it,
+writers beyond the concurrency limit and queue wait in the process or are shed
+with 503 at once. Latencies are reported separately for admitted and shed
+requests.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+
+def _writer(bodies, barrier, latencies, statuses):
+    from django.test import Client
+    from django.db import connections
+    from .drivers import API_TOKEN
+
+    client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {API_TOKEN}')
+    barrier.wait()
+    for body in bodies:
+        start = time.perf_counter()
+        response = client.patch('/v1/purchaseitems', data=body, content_type='application/json')
+        latencies.setdefault(response.status_code, []).append(time.perf_counter() - start)
+        statuses.append(response.status_code)
+    connections.close_all()
+
+
+def run(admission, writers, requests, rows, item_types, seed):
+    directory = tempfile.mkdtemp()
+    args = argparse.Namespace(settings='mysite.settings', database=os.path.join(directory, 'db.sqlite3'))
+    from .__main__ import setup_django
+    setup_django(args)
+
+    import json
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+    from .scenarios import _stock_shopping_list
+    from .seed import barcode, seed as seed_database
+
+    if not admission:
+        settings.MIDDLEWARE = [name for name in settings.MIDDLEWARE if name != 'app.admission.AdmissionMiddleware']
+    call_command('migrate', verbosity=0)
+    seed_database(10, item_types, 0, 0, seed=seed)
+    _stock_shopping_list(barcode(i) for i in range(item_types))
+    connections.close_all()
+
+    rng = random.Random(seed)
+    bodies = [
+        [
+            json.dumps([
+                {
+                    'itemType': barcode(rng.randrange(item_types)),
+                    'expirationDate': (date.today() + timedelta(days=rng.randint(1, 60))).isoformat(),
+                    'amount': 1,
+                }
+                for _ in range(rows)
+            ])
+            for _ in range(requests)
+        ]
+        for _ in range(writers)
+    ]
+    barrier = threading.Barrier(writers + 1)
+    latencies = {}
+    statuses = []
+    threads = [
+        threading.Thread(target=_writer, args=(writer_bodies, barrier, latencies, statuses))
+        for writer_bodies in bodies
+    ]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+    admitted = latencies.get(200, [])
+    shed = latencies.get(503, [])
+    failed = len(statuses) - len(admitted) - len(shed)
+    print(
+        f'admission {"on " if admission else "off"}  {writers:>3} writers  {len(admitted) / wall:>7.1f} ok/s  '
+        + (f'p50 {percentile(admitted, 50):>7.2f} ms  p99 {percentile(admitted, 99):>8.2f} ms  '
+           f'max {max(admitted) * 1000:>8.2f} ms' if admitted else 'nothing admitted')
+        + (f'  {len(shed)} shed (p99 {percentile(shed, 99):.2f} ms)' if shed else '')
+        + (f'  {failed} failed' if failed else '')
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.admission')
+    parser.add_argument('--writers', type=int, default=32, help='concurrent writer threads')
+    parser.add_argument('--requests', type=int, default=50, help='requests per writer')
+    parser.add_argument('--rows', type=int, default=20, help='purchases per request')
+    parser.add_argument('--item-types', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--single', choices=['on', 'off'], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        return run(args.single == 'on', args.writers, args.requests, args.rows, args.item_types, args.seed)
+
+    for admission in ['off', 'on']:
+        subprocess.run([
+            sys.executable, '-m', 'benchmarks.admission', '--single', admission, '--writers', str(args.writers),
+            '--requests', str(args.requests), '--rows', str(args.rows), '--item-types', str(args.item_types),
+            '--seed', str(args.seed),
+        ], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures what idle change feed clients cost and how fast an event reaches them.
+
+    python -m benchmarks.change_feed --clients 100,1000,5000
+
+Each round opens that many /v1/changes streams on the ASGI application in
+process, then reports the memory held per idle stream and the time from
+publishing one event until every stream has been sent it.
+"""
+import argparse
+import asyncio
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+def _scope():
+    return {
+        'type': 'http', 'method': 'GET', 'path': '/v1/changes', 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'http_version': '1.1', 'scheme': 'http',
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+
+
+def _receiver(disconnect):
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    return receive
+
+
+async def _round(application, bus, clients):
+    received = []
+    done = asyncio.Event()
+    marker = b'event: benchmark'
+
+    async def send(message):
+        if marker in message.get('body', b''):
+            received.append(time.perf_counter())
+            if len(received) == clients:
+                done.set()
+
+    disconnect = asyncio.Event()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(application(_scope(), _receiver(disconnect), send)) for _ in range(clients)]
+    while sum(map(len, bus.subscriptions.values())) < clients:
+        await asyncio.sleep(0.01)
+    gc.collect()
+    per_client = (tracemalloc.get_traced_memory()[0] - before) / clients
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    bus.publish('benchmark', {})
+    await done.wait()
+    fan_out = received[-1] - start
+
+    disconnect.set()
+    await asyncio.gather(*tasks)
+    print(f'{clients:>7} clients  {per_client / 1024:>7.1f} KiB per idle stream  fan-out {fan_out * 1000:>8.2f} ms')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.change_feed')
+    parser.add_argument('--clients', default='100,1000,5000', help='comma-separated numbers of streams')
+    args = parser.parse_args(argv)
+
+    from .__main__ import setup_django
+    setup_django(argparse.Namespace(
+        settings='mysite.settings', database=os.path.join(tempfile.mkdtemp(), 'change_feed.sqlite3')
+    ))
+    from mysite.asgi import application
+    from app.events import bus
+
+    async def rounds():
+        for clients in args.clients.split(','):
+            await _round(application, bus, int(clients))
+
+    asyncio.run(rounds())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Ways of sending the scenario requests, each returning the same summary dict.
+
+- client: the Django test client (WSGI handler, sync views), in process, with
+  per-request query counts.
+- asgi: mysite.asgi.application (async views), called in process.
+- wsgi-server / asgi-server: real HTTP against a local wsgiref or uvicorn
+  server, with `concurrency` keep-alive connections.
+"""
+import asyncio
+import contextlib
+import http.client
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+HOST = '127.0.0.1'
+
+# The ASGI and server modes run the site's full middleware stack. Sending the
+# same secret as both the CSRF cookie and header lets unsafe methods through
+# the "full" stack profile; the "api" profile accepts API_TOKEN instead.
+CSRF_TOKEN = 'benchmarkbenchmarkbenchmarkbench'
+API_TOKEN = 'benchmark'
+
+
+def summarize(latencies, statuses, wall, queries=None):
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+
+    result = {
+        'requests': len(ordered),
+        'throughput_rps': len(ordered) / wall if wall else 0.0,
+        'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(50) if ordered else 0.0,
+        'p90_ms': percentile(90) if ordered else 0.0,
+        'p99_ms': percentile(99) if ordered else 0.0,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0,
+        'statuses': counts,
+    }
+    if queries is not None:
+        result['queries_per_request'] = sum(queries) / len(queries) if queries else 0.0
+    return result
+
+
+def run_client(requests, concurrency=1):
+    client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {API_TOKEN}')
+    latencies, statuses, queries = [], [], []
+
+    wall_start = time.perf_counter()
+    for request in requests:
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            if request.method == 'get':
+                response = client.get(request.path)
+            else:
+                response = getattr(client, request.method)(
+                    request.path, data=request.body, content_type=request.content_type
+                )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            latencies.append(time.perf_counter() - start)
+        statuses.append(response.status_code)
+        queries.append(len(captured))
+
+    return summarize(latencies, statuses, time.perf_counter() - wall_start, queries)
+
+
+async def _asgi_request(application, request):
+    path, _, query = request.path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': request.method.upper(),
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'headers': [
+            (b'host', b'localhost'),
+            (b'content-type', request.content_type.encode()),
+            (b'cookie', f'csrftoken={CSRF_TOKEN}'.encode()),
+            (b'x-csrftoken', CSRF_TOKEN.encode()),
+            (b'authorization', f'Bearer {API_TOKEN}'.encode()),
+        ],
+        'server': ('localhost', 80),
+        'client': (HOST, 0),
+    }
+    messages = [{'type': 'http.request', 'body': request.body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def run_asgi(requests, concurrency=1):
+    from mysite.asgi import application
+
+    async def run():
+        latencies, statuses = [], []
+        pending = iter(requests)
+
+        async def worker():
+            for request in pending:
+                start = time.perf_counter()
+                statuses.append(await _asgi_request(application, request))
+                latencies.append(time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return summarize(latencies, statuses, time.perf_counter() - wall_start)
+
+    return asyncio.run(run())
+
+
+def run_http(port, requests, concurrency=1):
+    local = threading.local()
+    headers = {'Cookie': f'csrftoken={CSRF_TOKEN}', 'X-CSRFToken': CSRF_TOKEN, 'Authorization': f'Bearer {API_TOKEN}'}
+
+    def send(request):
+        if not hasattr(local, 'connection'):
+            local.connection = http.client.HTTPConnection(HOST, port)
+        start = time.perf_counter()
+        local.connection.request(
+            request.method.upper(), request.path, body=request.body,
+            headers={**headers, 'Content-Type': request.content_type}
+        )
+        response = local.connection.getresponse()
+        response.read()
+        return time.perf_counter() - start, response.status
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, requests))
+    wall = time.perf_counter() - wall_start
+
+    return summarize([latency for latency, _ in results], [status for _, status in results], wall)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+@contextlib.contextmanager
+def wsgi_server():
+    from mysite.wsgi import application
+
+    server = make_server(HOST, 0, application, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextlib.contextmanager
+def asgi_server():
+    """Runs mysite.asgi under uvicorn, or yields None when uvicorn is not installed."""
+    try:
+        import uvicorn
+    except ImportError:
+        yield None
+        return
+
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(
+        'mysite.asgi:application', host=HOST, port=port, log_level='warning', lifespan='off'
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield port
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+# mode -> (server context manager yielding a port, or None for in-process; runner)
+MODES = {
+    'client': (None, lambda port, requests, concurrency: run_client(requests, concurrency)),
+    'asgi': (None, lambda port, requests, concurrency: run_asgi(requests, concurrency)),
+    'wsgi-server': (wsgi_server, run_http),
+    'asgi-server': (asgi_server, run_http),
+}
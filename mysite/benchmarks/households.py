@@ -0,0 +1,146 @@
+"""
+Measures write throughput as households are spread over more SQLite databases.
+
+    python -m benchmarks.households --shards 1,2,4,8 --writers 8
+
+For each shard count a fresh catalog database and that many household
+databases are created in their own process. `--writers` worker processes then
+each PUT batches of items to /v1/additems through the full middleware stack,
+with the X-Household header spreading them evenly over the households. With
+one household every writer queues for the same SQLite write lock; with one
+household per writer none of them do. Writers only run in parallel on as many
+cores as there are; `--synchronous FULL` makes every commit wait for an fsync,
+as durable deployments do, which other households' writers can overlap.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+
+def _writer(household, requests, rows, item_types, seed, barrier, results):
+    import json
+    from django.test import Client
+    from .drivers import API_TOKEN
+    from .seed import barcode
+
+    rng = random.Random(seed)
+    bodies = [
+        json.dumps([
+            {
+                'itemType': barcode(rng.randrange(item_types)),
+                'expirationDate': (date.today() + timedelta(days=rng.randint(1, 60))).isoformat(),
+                'amount': rng.randint(1, 5),
+            }
+            for _ in range(rows)
+        ])
+        for _ in range(requests)
+    ]
+    client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {API_TOKEN}', HTTP_X_HOUSEHOLD=household)
+
+    latencies = []
+    failures = 0
+    barrier.wait()
+    for body in bodies:
+        start = time.perf_counter()
+        response = client.put('/v1/additems', data=body, content_type='application/json')
+        latencies.append(time.perf_counter() - start)
+        failures += response.status_code != 200
+    results.put((latencies, failures))
+
+
+def run(shards, writers, requests, rows, item_types, synchronous, seed):
+    directory = tempfile.mkdtemp()
+    households = [f'h{i}' for i in range(shards)]
+    os.environ['DJANGO_HOUSEHOLDS'] = ','.join(households)
+    args = argparse.Namespace(settings='mysite.settings', database=os.path.join(directory, 'catalog.sqlite3'))
+    from .__main__ import setup_django
+    setup_django(args)
+
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+    from app.models import IndividualItem
+    from .seed import seed as seed_database
+
+    for household in households:
+        settings.DATABASES[f'household_{household}']['NAME'] = os.path.join(directory, f'{household}.sqlite3')
+    if synchronous:
+        for database in settings.DATABASES.values():
+            options = database['OPTIONS'] = dict(database.get('OPTIONS', {}))
+            options['init_command'] = options.get('init_command', '') + f';PRAGMA synchronous={synchronous}'
+    call_command('migrate', verbosity=0)
+    seed_database(10, item_types, 0, 0, seed=seed)
+    with open(os.devnull, 'w') as devnull:
+        call_command('sync_households', stdout=devnull)
+    connections.close_all()
+
+    # Forked writers inherit the configured Django, and open connections of their own.
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(writers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_writer, args=(
+            households[i % shards], requests, rows, item_types, seed + i, barrier, results
+        ))
+        for i in range(writers)
+    ]
+    for process in processes:
+        process.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    outcomes = [results.get() for _ in processes]
+    wall = time.perf_counter() - start
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for latency_list, _ in outcomes for latency in latency_list)
+    failures = sum(failed for _, failed in outcomes)
+    stored = sum(IndividualItem.objects.using(f'household_{household}').count() for household in households)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    print(
+        f'{shards:>3} shards {writers:>3} writers  {len(latencies) / wall:>8.1f} req/s  {stored / wall:>9.0f} rows/s  '
+        f'p50 {percentile(50):>7.2f} ms  p99 {percentile(99):>7.2f} ms'
+        + (f'  {failures} failed' if failures else '')
+    )
+    connections.close_all()
+    shutil.rmtree(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.households')
+    parser.add_argument('--shards', default='1,2,4,8', help='comma-separated household counts')
+    parser.add_argument('--writers', type=int, default=8, help='concurrent writer processes')
+    parser.add_argument('--requests', type=int, default=200, help='requests per writer')
+    parser.add_argument('--rows', type=int, default=20, help='items per request')
+    parser.add_argument('--item-types', type=int, default=1000)
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL'], help='override PRAGMA synchronous')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        return run(
+            args.single, args.writers, args.requests, args.rows, args.item_types, args.synchronous, args.seed
+        )
+
+    for shards in args.shards.split(','):
+        subprocess.run([
+            sys.executable, '-m', 'benchmarks.households', '--single', shards, '--writers', str(args.writers),
+            '--requests', str(args.requests), '--rows', str(args.rows), '--item-types', str(args.item_types),
+            '--seed', str(args.seed),
+        ] + (['--synchronous', args.synchronous] if args.synchronous else []), check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Times the shopping list replenishment engine against growing catalogs.
+
+    python -m benchmarks.replenishment --item-types 1000,10000,50000
+
+Each catalog size is seeded into a fresh database in its own process, with a
+par level for every item type, and the engine is run once as a dry run and
+once for real.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run(item_types, items_per_type, seed):
+    args = argparse.Namespace(
+        settings='mysite.settings', database=os.path.join(tempfile.mkdtemp(), 'replenishment.sqlite3')
+    )
+    from .__main__ import setup_django
+    setup_django(args)
+
+    from django.core.management import call_command
+    from django.utils import timezone
+    from app.inventory import replenish
+    from app.models import ParLevel
+    from .seed import BATCH_SIZE, barcode, seed as seed_database
+
+    call_command('migrate', verbosity=0)
+    seed_database(10, item_types, item_types * items_per_type, item_types // 10, seed=seed)
+
+    rng = random.Random(seed)
+    ParLevel.objects.bulk_create([
+        ParLevel(item_type_id=barcode(i), amount=rng.randint(1, items_per_type * 10),
+                 expiry_horizon_days=rng.choice([None, 1, 3, 7]))
+        for i in range(item_types)
+    ], batch_size=BATCH_SIZE)
+
+    timings = {}
+    for name, dry_run in (('dry run', True), ('apply', False)):
+        start = time.perf_counter()
+        deltas = replenish(timezone.localdate(), dry_run=dry_run)
+        timings[name] = (time.perf_counter() - start, len(deltas))
+
+    print(f'{item_types:>9} types {item_types * items_per_type:>10} items' + ''.join(
+        f'  {name} {seconds:>7.3f} s ({count} entries)' for name, (seconds, count) in timings.items()
+    ))
+    os.remove(args.database)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replenishment')
+    parser.add_argument('--item-types', default='1000,10000,50000', help='comma-separated catalog sizes')
+    parser.add_argument('--items-per-type', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        return run(args.single, args.items_per_type, args.seed)
+
+    for item_types in args.item_types.split(','):
+        subprocess.run([
+            sys.executable, '-m', 'benchmarks.replenishment', '--single', item_types,
+            '--items-per-type', str(args.items_per_type), '--seed', str(args.seed),
+        ], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Request generators for every routed endpoint, keyed by URL name.
+
+Each scenario prepares whatever rows its requests consume (items to delete,
+shopping list stock to purchase, ...) and returns the requests up front, so
+building bodies is never part of the timed loop.
+"""
+import itertools
+import json
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from django.urls import reverse
+from app.inventory import store_items
+from app.models import IndividualItem, ItemType, ShoppingList
+from .seed import barcode
+
+Request = namedtuple('Request', 'method path body content_type')
+
+BATCH_ROWS = 20
+_run_ids = itertools.count()
+
+
+def _request(method, name, body=None, query=''):
+    path = reverse(name) + (f'?{query}' if query else '')
+    return Request(method, path, json.dumps(body).encode() if body is not None else b'', 'application/json')
+
+
+def _item(rng, item_types):
+    return {
+        'itemType': barcode(rng.randrange(item_types)),
+        'expirationDate': (date.today() + timedelta(days=rng.randint(1, 60))).isoformat(),
+        'amount': rng.randint(1, 5),
+    }
+
+
+def _stock_shopping_list(barcodes):
+    ShoppingList.objects.bulk_create(
+        [ShoppingList(item_type_id=code, amount=1e9) for code in set(barcodes)],
+        update_conflicts=True, unique_fields=['item_type'], update_fields=['amount']
+    )
+
+
+def add_item(count, item_types, rng):
+    return [_request('put', 'add-item', _item(rng, item_types)) for _ in range(count)]
+
+
+def add_items(count, item_types, rng):
+    return [
+        _request('put', 'add-items', [_item(rng, item_types) for _ in range(BATCH_ROWS)])
+        for _ in range(count)
+    ]
+
+
+def delete_item(count, item_types, rng):
+    items = store_items([
+        IndividualItem(item_type_id=barcode(rng.randrange(item_types)), amount=1, expiration_date=date.today())
+        for _ in range(count)
+    ])
+    return [_request('delete', 'delete-item', {'ID': item.id}) for item in items]
+
+
+def delete_items(count, item_types, rng):
+    items = store_items([
+        IndividualItem(item_type_id=barcode(rng.randrange(item_types)), amount=1, expiration_date=date.today())
+        for _ in range(count * BATCH_ROWS)
+    ])
+    return [
+        _request('delete', 'delete-items', [{'ID': item.id} for item in items[start:start + BATCH_ROWS]])
+        for start in range(0, len(items), BATCH_ROWS)
+    ]
+
+
+def purge_items(count, item_types, rng):
+    items = store_items([
+        IndividualItem(item_type_id=barcode(rng.randrange(item_types)), amount=1, expiration_date=date.today())
+        for _ in range(count * BATCH_ROWS)
+    ])
+    return [
+        _request('delete', 'purge-items', {'idFrom': items[start].id, 'idTo': items[start + BATCH_ROWS - 1].id})
+        for start in range(0, len(items), BATCH_ROWS)
+    ]
+
+
+def consume_items(count, item_types, rng):
+    # A few staples with many units each, drawn down a unit and a half at a time.
+    staples = [barcode(rng.randrange(item_types)) for _ in range(3)]
+    store_items([
+        IndividualItem(
+            item_type_id=staples[i % len(staples)], amount=1,
+            expiration_date=date.today() + timedelta(days=rng.randint(1, 60))
+        )
+        for i in range(count * 2)
+    ])
+    return [
+        _request('delete', 'consume-items', {'itemType': staples[i % len(staples)], 'amount': 1.5})
+        for i in range(count)
+    ]
+
+
+def expiring_items(count, item_types, rng):
+    return [_request('get', 'expiring-items', query='days=30&limit=100') for _ in range(count)]
+
+
+def stock(count, item_types, rng):
+    return [
+        _request('get', 'stock', query='&'.join(f'itemType={barcode(rng.randrange(item_types))}' for _ in range(5)))
+        for _ in range(count)
+    ]
+
+
+def stock_at(count, item_types, rng):
+    # Points in the last hour, which the log has not compacted yet.
+    now = datetime.now(timezone.utc)
+    return [
+        _request('get', 'stock-at', query='&'.join(
+            [f'itemType={barcode(rng.randrange(item_types))}' for _ in range(5)]
+            + [f'at={(now - timedelta(seconds=rng.randrange(3600))).strftime("%Y-%m-%dT%H:%M:%SZ")}']
+        ))
+        for _ in range(count)
+    ]
+
+
+def metrics(count, item_types, rng):
+    return [_request('get', 'metrics') for _ in range(count)]
+
+
+def new_type(count, item_types, rng):
+    run = next(_run_ids)
+    return [
+        _request('put', 'new-type', {
+            'unique_barcode': f'bench-new-{run}-{i}', 'name': f'New product {i}', 'amount_type': 'unit-0'
+        })
+        for i in range(count)
+    ]
+
+
+def import_types(count, item_types, rng):
+    run = next(_run_ids)
+    return [
+        Request('put', reverse('import-types'), b''.join(
+            json.dumps({
+                'unique_barcode': f'bench-import-{run}-{i}-{row}', 'name': f'Imported product {row}',
+                'amount_type': f'unit-{row % 3}'
+            }).encode() + b'\n'
+            for row in range(BATCH_ROWS)
+        ), 'application/x-ndjson')
+        for i in range(count)
+    ]
+
+
+def item_types(count, item_types, rng):
+    return [
+        _request('get', 'item-types', query=f'limit=100&after={barcode(rng.randrange(item_types))}')
+        for _ in range(count)
+    ]
+
+
+def search_types(count, item_types, rng):
+    # Type-ahead: successively longer prefixes of seeded product names ("Product 123").
+    queries = [f'prod {rng.randrange(item_types)}' for _ in range(count)]
+    return [
+        _request('get', 'search-types', query=f'q={query[:rng.randint(6, len(query))]}'.replace(' ', '+'))
+        for query in queries
+    ]
+
+
+def export_types(count, item_types, rng):
+    return [_request('get', 'export-types', query=f'format={rng.choice(["csv", "ndjson"])}') for _ in range(count)]
+
+
+def remove_type(count, item_types, rng):
+    run = next(_run_ids)
+    types = ItemType.objects.bulk_create([
+        ItemType(unique_barcode=f'bench-rm-{run}-{i}', name=f'Removed product {i}', amount_type_id='unit-0')
+        for i in range(count)
+    ])
+    return [_request('delete', 'remove-type', {'unique_barcode': item_type.unique_barcode}) for item_type in types]
+
+
+def shopping_list(count, item_types, rng):
+    return [_request('get', 'shopping-list') for _ in range(count)]
+
+
+def add_to_shopping_list(count, item_types, rng):
+    return [
+        _request('put', 'add-to-shopping-list', {'itemType': barcode(rng.randrange(item_types)), 'amount': 1})
+        for _ in range(count)
+    ]
+
+
+def remove_from_shopping_list(count, item_types, rng):
+    barcodes = [barcode(rng.randrange(item_types)) for _ in range(count)]
+    _stock_shopping_list(barcodes)
+    return [
+        _request('delete', 'remove-from-shopping-list', {'itemType': code, 'amount': 1})
+        for code in barcodes
+    ]
+
+
+def update_shopping_list(count, item_types, rng):
+    return [
+        _request('patch', 'update-shopping-list', [
+            {'itemType': barcode(rng.randrange(item_types)), 'amount': rng.choice([-2, -1, 1, 2, 3])}
+            for _ in range(BATCH_ROWS)
+        ])
+        for _ in range(count)
+    ]
+
+
+def set_par_levels(count, item_types, rng):
+    return [
+        _request('put', 'set-par-levels', [
+            {'itemType': barcode(rng.randrange(item_types)), 'amount': rng.randint(1, 20)}
+            for _ in range(BATCH_ROWS)
+        ])
+        for _ in range(count)
+    ]
+
+
+def purchase_item(count, item_types, rng):
+    bodies = [_item(rng, item_types) for _ in range(count)]
+    _stock_shopping_list(body['itemType'] for body in bodies)
+    return [_request('patch', 'purchase-item', body) for body in bodies]
+
+
+def purchase_items(count, item_types, rng):
+    bodies = [[_item(rng, item_types) for _ in range(BATCH_ROWS)] for _ in range(count)]
+    _stock_shopping_list(row['itemType'] for body in bodies for row in body)
+    return [_request('patch', 'purchase-items', body) for body in bodies]
+
+
+def batch(count, item_types, rng):
+    bodies = [_item(rng, item_types) for _ in range(count)]
+    _stock_shopping_list(body['itemType'] for body in bodies)
+    items = store_items([
+        IndividualItem(item_type_id=body['itemType'], amount=1, expiration_date=date.today()) for body in bodies
+    ])
+    return [
+        _request('post', 'batch', [
+            {'op': 'remove-from-shopping-list', 'body': {'itemType': body['itemType'], 'amount': 1}},
+            {'op': 'purchase-item', 'body': body},
+            {'op': 'delete-item', 'body': {'ID': item.id}},
+        ])
+        for body, item in zip(bodies, items)
+    ]
+
+
+# Long-lived streams have no request/response scenario; they are measured by their own module.
+STREAMS = {
+    'changes': 'benchmarks.change_feed',
+}
+
+SCENARIOS = {
+    'add-item': add_item,
+    'add-items': add_items,
+    'delete-item': delete_item,
+    'delete-items': delete_items,
+    'purge-items': purge_items,
+    'consume-items': consume_items,
+    'expiring-items': expiring_items,
+    'stock': stock,
+    'stock-at': stock_at,
+    'metrics': metrics,
+    'new-type': new_type,
+    'item-types': item_types,
+    'search-types': search_types,
+    'import-types': import_types,
+    'export-types': export_types,
+    'remove-type': remove_type,
+    'shopping-list': shopping_list,
+    'add-to-shopping-list': add_to_shopping_list,
+    'remove-from-shopping-list': remove_from_shopping_list,
+    'update-shopping-list': update_shopping_list,
+    'set-par-levels': set_par_levels,
+    'purchase-item': purchase_item,
+    'purchase-items': purchase_items,
+    'batch': batch,
+}
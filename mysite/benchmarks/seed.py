@@ -0,0 +1,41 @@
+import random
+from datetime import date, timedelta
+from app.inventory import rebuild_stock
+from app.models import AmountType, IndividualItem, ItemType, ShoppingList
+
+BATCH_SIZE = 5000
+
+
+def barcode(index):
+    return f'bench-{index:08d}'
+
+
+def seed(amount_types, item_types, items, shopping_list, seed=0):
+    """Fills an empty database with the given number of rows of each model."""
+    rng = random.Random(seed)
+    today = date.today()
+
+    AmountType.objects.bulk_create([AmountType(name=f'unit-{i}') for i in range(amount_types)])
+
+    for start in range(0, item_types, BATCH_SIZE):
+        ItemType.objects.bulk_create([
+            ItemType(unique_barcode=barcode(i), name=f'Product {i}', amount_type_id=f'unit-{i % amount_types}')
+            for i in range(start, min(start + BATCH_SIZE, item_types))
+        ])
+
+    for start in range(0, items, BATCH_SIZE):
+        IndividualItem.objects.bulk_create([
+            IndividualItem(
+                item_type_id=barcode(rng.randrange(item_types)),
+                amount=rng.randint(1, 10),
+                expiration_date=today + timedelta(days=rng.randint(-30, 120))
+            )
+            for _ in range(start, min(start + BATCH_SIZE, items))
+        ])
+
+    ShoppingList.objects.bulk_create([
+        ShoppingList(item_type_id=barcode(i), amount=rng.randint(1, 10))
+        for i in rng.sample(range(item_types), min(shopping_list, item_types))
+    ], batch_size=BATCH_SIZE)
+
+    rebuild_stock()
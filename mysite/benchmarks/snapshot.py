@@ -0,0 +1,114 @@
+"""
+Times columnar snapshots against reading the fridge through model instances.
+
+    python -m benchmarks.snapshot --items 100000,1000000
+
+For each size a fresh database is seeded and a waste report (the amount that
+has expired, per item type) is computed three ways: over IndividualItem
+instances, by writing a snapshot, and by reading the snapshot back from its
+memory map. The report over the snapshot is vectorized when NumPy is
+installed.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _waste_from_models(today):
+    from app.models import IndividualItem
+
+    waste = {}
+    for item in IndividualItem.objects.all():
+        if item.expiration_date < today:
+            waste[item.item_type_id] = waste.get(item.item_type_id, 0) + item.amount
+    return waste
+
+
+def _waste_from_snapshot(tables, today):
+    from app.snapshot import EPOCH_ORDINAL
+
+    items = tables['items']
+    barcodes = tables['item_types']['unique_barcode']
+    cutoff = today.toordinal() - EPOCH_ORDINAL
+    try:
+        import numpy
+    except ImportError:
+        waste = {}
+        for item_type, amount, expiration_date in zip(items['item_type'], items['amount'], items['expiration_date']):
+            if expiration_date < cutoff:
+                waste[item_type] = waste.get(item_type, 0) + amount
+        return {barcodes[code]: amount for code, amount in waste.items()}
+
+    expired = numpy.asarray(items['expiration_date']) < cutoff
+    totals = numpy.bincount(
+        numpy.asarray(items['item_type'])[expired], weights=numpy.asarray(items['amount'])[expired],
+        minlength=len(barcodes)
+    )
+    return {barcodes[int(code)]: float(totals[code]) for code in numpy.flatnonzero(totals)}
+
+
+def run(items, item_types, format, seed):
+    args = argparse.Namespace(
+        settings='mysite.settings', database=os.path.join(tempfile.mkdtemp(), 'snapshot.sqlite3')
+    )
+    from .__main__ import setup_django
+    setup_django(args)
+
+    from django.core.management import call_command
+    from django.utils import timezone
+    from app.snapshot import default_format, read_snapshot, write_snapshot
+    from .seed import seed as seed_database
+
+    call_command('migrate', verbosity=0)
+    seed_database(10, item_types, items, item_types // 10, seed=seed)
+    today = timezone.localdate()
+    directory = tempfile.mkdtemp()
+    format = format or default_format()
+
+    start = time.perf_counter()
+    expected = _waste_from_models(today)
+    models = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_snapshot(directory, format)
+    written = time.perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    start = time.perf_counter()
+    waste = _waste_from_snapshot(read_snapshot(directory), today)
+    read = time.perf_counter() - start
+    assert waste.keys() == expected.keys()
+
+    print(
+        f'{items:>9} items  models {models:>7.3f} s  write {format} {written:>7.3f} s ({size / 2**20:.1f} MiB)'
+        f'  read + report {read:>7.3f} s'
+    )
+    shutil.rmtree(directory)
+    os.remove(args.database)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.snapshot')
+    parser.add_argument('--items', default='100000,1000000', help='comma-separated fridge sizes')
+    parser.add_argument('--item-types', type=int, default=1000)
+    parser.add_argument('--format', help='snapshot format (default: the best installed)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        return run(args.single, args.item_types, args.format, args.seed)
+
+    for items in args.items.split(','):
+        subprocess.run([
+            sys.executable, '-m', 'benchmarks.snapshot', '--single', items, '--item-types', str(args.item_types),
+            '--seed', str(args.seed), *(['--format', args.format] if args.format else []),
+        ], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares the SQLite profiles from mysite/settings.py under concurrent load.
+
+    python -m benchmarks.sqlite_profiles --concurrency 8 --requests 400
+
+Runs the write-heavy endpoints and the expiring items read against the local
+WSGI server once per profile, each in a fresh process and database, and
+prints throughput, p99 latency and error rate side by side.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROFILES = [
+    ('default', {'DJANGO_SQLITE_PROFILE': 'default'}),
+    ('tuned', {'DJANGO_SQLITE_PROFILE': 'tuned'}),
+    ('tuned+readonly', {'DJANGO_SQLITE_PROFILE': 'tuned', 'DJANGO_SQLITE_READ_ALIAS': '1'}),
+]
+SCENARIOS = 'purchase-item,add-to-shopping-list,update-shopping-list,add-items,expiring-items'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.sqlite_profiles')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--mode', default='wsgi-server')
+    args = parser.parse_args(argv)
+
+    reports = {}
+    for name, env in PROFILES:
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            subprocess.run([
+                sys.executable, '-m', 'benchmarks', '--modes', args.mode, '--scenarios', SCENARIOS,
+                '--concurrency', str(args.concurrency), '--requests', str(args.requests), '--output', output.name,
+            ], env={**os.environ, **env}, check=True, stdout=subprocess.DEVNULL)
+            reports[name] = json.load(open(output.name))['results'][args.mode]
+
+    print(f'{"endpoint":<24}' + ''.join(f'{name:>36}' for name, _ in PROFILES))
+    for scenario in SCENARIOS.split(','):
+        cells = []
+        for name, _ in PROFILES:
+            result = reports[name][scenario]
+            failed = sum(count for status, count in result['statuses'].items() if not status.startswith('2'))
+            cells.append(
+                f'{result["throughput_rps"]:>8.0f} rps {result["p99_ms"]:>8.1f} ms p99 {failed / result["requests"]:>5.0%} err'
+            )
+        print(f'{scenario:<24}' + ''.join(f'{cell:>36}' for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Compares the "full" and "api" stack profiles from mysite/settings.py.
+
+    python -m benchmarks.stack_profiles --runs 10 --requests 5000
+
+For each profile it measures, in fresh processes:
+
+- the wall time of `manage.py check`, interpreter start-up included;
+- the time to import mysite.wsgi (django.setup() and the middleware chain) and
+  to serve the first request (URLconf and views imported);
+- the mean time per request through the WSGI and ASGI handlers, in process,
+  for a GET and a PUT that do not touch the database, so that what is left is
+  the cost of the middleware and request handling around the view.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = ('full', 'api')
+REQUESTS = (
+    ('GET', '/metrics', b''),
+    ('PUT', '/v1/additem', b'{"itemType": "b", "expirationDate": "2030-01-01", "amount": 1}'),
+)
+
+
+def _environ(method, path, body):
+    from .drivers import API_TOKEN, CSRF_TOKEN
+    return {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)), 'HTTP_COOKIE': f'csrftoken={CSRF_TOKEN}', 'HTTP_X_CSRFTOKEN': CSRF_TOKEN,
+        'HTTP_AUTHORIZATION': f'Bearer {API_TOKEN}', 'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': False, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        'wsgi.version': (1, 0), 'REMOTE_ADDR': '127.0.0.1',
+    }
+
+
+def _time_wsgi(application, method, path, body, count):
+    statuses = set()
+
+    def start_response(status, headers):
+        statuses.add(status.split()[0])
+
+    start = time.perf_counter()
+    for _ in range(count):
+        b''.join(application(_environ(method, path, body), start_response))
+    return (time.perf_counter() - start) / count, statuses
+
+
+def _time_asgi(method, path, body, count):
+    import asyncio
+
+    from mysite.asgi import application
+    from .drivers import _asgi_request
+
+    request = argparse.Namespace(method=method.lower(), path=path, body=body, content_type='application/json')
+
+    async def run():
+        statuses = set()
+        start = time.perf_counter()
+        for _ in range(count):
+            statuses.add(str(await _asgi_request(application, request)))
+        return (time.perf_counter() - start) / count, statuses
+
+    return asyncio.run(run())
+
+
+def single(requests):
+    """Runs in a fresh process: imports the site, serves the requests and prints the timings as JSON."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+    os.environ.setdefault('DJANGO_API_TOKENS', 'benchmark')
+    start = time.perf_counter()
+    from mysite.wsgi import application
+    timings = {'import mysite.wsgi ms': (time.perf_counter() - start) * 1000}
+
+    method, path, body = REQUESTS[0]
+    start = time.perf_counter()
+    _time_wsgi(application, method, path, body, 1)
+    timings['first request ms'] = (time.perf_counter() - start) * 1000
+
+    for method, path, body in REQUESTS:
+        for handler, (mean, statuses) in (
+            ('wsgi', _time_wsgi(application, method, path, body, requests)),
+            ('asgi', _time_asgi(method, path, body, requests)),
+        ):
+            timings[f'{handler} {method} {path} us'] = mean * 1e6
+            if statuses != {'200'}:
+                timings[f'{handler} {method} {path} statuses'] = sorted(statuses)
+    print(json.dumps(timings))
+
+
+def _check_seconds(profile):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, 'manage.py', 'check'], check=True, capture_output=True,
+        env={**os.environ, 'DJANGO_STACK_PROFILE': profile}
+    )
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.stack_profiles')
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes per profile')
+    parser.add_argument('--requests', type=int, default=5000, help='requests per endpoint and handler')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        return single(args.requests)
+
+    for profile in PROFILES:
+        env = {**os.environ, 'DJANGO_STACK_PROFILE': profile, 'DJANGO_API_TOKENS': 'benchmark'}
+        runs = [
+            json.loads(subprocess.run(
+                [sys.executable, '-m', 'benchmarks.stack_profiles', '--single', '--requests', str(args.requests)],
+                check=True, capture_output=True, text=True, env=env
+            ).stdout)
+            for _ in range(args.runs)
+        ]
+        print(f'{profile}:')
+        check = statistics.median(_check_seconds(profile) for _ in range(args.runs)) * 1000
+        print(f'  {"manage.py check":<32} {check:>9.1f} ms')
+        for name in runs[0]:
+            values = [run[name] for run in runs]
+            label, _, unit = name.rpartition(' ')
+            if unit == 'statuses':
+                print(f'  {label:<32} statuses {values[0]}')
+            else:
+                print(f'  {label:<32} {statistics.median(values):>9.1f} {unit}')
+
+
+if __name__ == '__main__':
+    main()
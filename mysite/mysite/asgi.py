@@ -12,5 +12,17 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+os.environ.setdefault("DJANGO_CONN_MAX_AGE", "0")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+class AsyncURLConfASGIHandler(type(django_application)):
+    """Serves requests with the async views routed by mysite.async_urls."""
+
+    async def get_response_async(self, request):
+        request.urlconf = "mysite.async_urls"
+        return await super().get_response_async(request)
+
+
+application = AsyncURLConfASGIHandler()
@@ -0,0 +1,10 @@
+"""
+URL configuration used when the site is served through mysite/asgi.py.
+
+It routes the same paths as mysite/urls.py (app/routes.py), to the async views
+in app/async_views.py where there is one, so ASGI requests only leave the
+event loop for work that needs a transaction.
+"""
+from app import async_views, routes, views
+
+urlpatterns = routes.urlpatterns(async_views, views)
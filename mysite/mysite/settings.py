@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,9 +38,11 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "app",
 ]
 
 MIDDLEWARE = [
+    "app.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -47,6 +50,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "app.households.HouseholdMiddleware",
+    "app.admission.AdmissionMiddleware",
 ]
 
 ROOT_URLCONF = "mysite.urls"
@@ -67,6 +72,30 @@ TEMPLATES = [
     },
 ]
 
+# Application stack profile, selected with the DJANGO_STACK_PROFILE environment variable.
+# "full" (the default) is the stack above, with the admin, sessions, messages,
+# templates and CSRF protection. "api" serves the JSON API alone: only the inventory
+# app is installed, no template engine is configured, and the middleware is cut
+# down to metrics, security headers and app.tokens.TokenAuthMiddleware, which
+# replaces CSRF protection. Requests with unsafe methods must then send
+# "Authorization: Bearer <token>" with one of API_TOKENS, which are read from the
+# comma-separated DJANGO_API_TOKENS environment variable.
+# python -m benchmarks.stack_profiles compares the two.
+
+STACK_PROFILE = os.environ.get("DJANGO_STACK_PROFILE", "full")
+API_TOKENS = [token for token in os.environ.get("DJANGO_API_TOKENS", "").split(",") if token]
+
+if STACK_PROFILE == "api":
+    INSTALLED_APPS = ["app"]
+    MIDDLEWARE = [
+        "app.metrics.MetricsMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "app.tokens.TokenAuthMiddleware",
+        "app.households.HouseholdMiddleware",
+        "app.admission.AdmissionMiddleware",
+    ]
+    TEMPLATES = []
+
 WSGI_APPLICATION = "mysite.wsgi.application"
 
 
@@ -80,6 +109,145 @@ DATABASES = {
     }
 }
 
+# SQLite performance profile, selected with the DJANGO_SQLITE_PROFILE environment variable.
+# "tuned" (the default) switches to WAL with relaxed fsyncs, a 64 MiB page cache and
+# 256 MiB of memory-mapped reads. It also waits up to 20 s for locks instead of failing
+# with "database is locked", starts every transaction with BEGIN IMMEDIATE so
+# read-then-write transactions cannot deadlock on the lock upgrade, and keeps
+# connections open between requests. "default" keeps SQLite's stock behaviour.
+# Under ASGI, Django opens a connection per request context, so mysite/asgi.py sets
+# DJANGO_CONN_MAX_AGE=0 to close them instead of leaking them.
+#
+# With DJANGO_SQLITE_READ_ALIAS=1, GET endpoints read through a separate read-only
+# connection ("readonly"), so polling clients never queue behind the writer.
+
+SQLITE_PROFILE = os.environ.get("DJANGO_SQLITE_PROFILE", "tuned")
+SQLITE_CONN_MAX_AGE = os.environ.get("DJANGO_CONN_MAX_AGE")
+
+if SQLITE_PROFILE == "tuned":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(SQLITE_CONN_MAX_AGE) if SQLITE_CONN_MAX_AGE else None
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+    DATABASES["default"]["OPTIONS"] = {
+        "timeout": 20,
+        "transaction_mode": "IMMEDIATE",
+        "init_command": (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA cache_size=-65536;"
+            "PRAGMA mmap_size=268435456;"
+            "PRAGMA temp_store=MEMORY"
+        ),
+    }
+
+if os.environ.get("DJANGO_SQLITE_READ_ALIAS") == "1":
+    DATABASES["readonly"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": f"file:{DATABASES['default']['NAME']}?mode=ro",
+        "CONN_MAX_AGE": DATABASES["default"].get("CONN_MAX_AGE", 0),
+        "OPTIONS": {
+            "uri": True,
+            "timeout": 20,
+            "init_command": "PRAGMA query_only=ON;PRAGMA cache_size=-65536;PRAGMA mmap_size=268435456",
+        },
+        "TEST": {"MIRROR": "default"},
+    }
+    READ_DATABASE = "readonly"
+else:
+    READ_DATABASE = "default"
+
+# Households (app/households.py), named by the comma-separated DJANGO_HOUSEHOLDS
+# environment variable. Each household keeps its fridge in a database of its own,
+# HOUSEHOLD_DATABASE_DIR/<name>.sqlite3 with the alias "household_<name>" and the
+# same profile as "default", and requests choose one with the X-Household header.
+# "default" keeps the item type catalog, which is replicated into every household
+# database, and the fridge of requests without the header.
+# Run `manage.py sync_households` after adding a household.
+
+HOUSEHOLDS = [name for name in os.environ.get("DJANGO_HOUSEHOLDS", "").split(",") if name]
+HOUSEHOLD_DATABASE_DIR = BASE_DIR / "households"
+
+for household in HOUSEHOLDS:
+    DATABASES[f"household_{household}"] = {
+        **DATABASES["default"],
+        "NAME": HOUSEHOLD_DATABASE_DIR / f"{household}.sqlite3",
+    }
+
+DATABASE_ROUTERS = ["app.households.HouseholdRouter"]
+
+
+# Request metrics, exported at /metrics
+# Queries slower than this many milliseconds are logged with their SQL; None disables the log.
+
+METRICS_SLOW_QUERY_MS = None
+
+
+# Shopping list replenishment (manage.py replenish)
+# Items expiring within this many days do not count towards a par level,
+# unless the par level sets its own horizon.
+
+REPLENISH_EXPIRY_HORIZON_DAYS = 2
+
+
+# Write admission control (app/admission.py)
+# Each process runs at most ADMISSION_WRITE_CONCURRENCY write requests per database
+# at once, and queues up to ADMISSION_QUEUE_SIZE more for at most
+# ADMISSION_QUEUE_TIMEOUT_SECONDS. Writes beyond that, and writes that fail with
+# "database is locked", are answered with 503 and Retry-After:
+# ADMISSION_RETRY_AFTER_SECONDS. Keep the timeout well below the workers' own.
+
+ADMISSION_WRITE_CONCURRENCY = 2
+ADMISSION_QUEUE_SIZE = 32
+ADMISSION_QUEUE_TIMEOUT_SECONDS = 2.0
+ADMISSION_RETRY_AFTER_SECONDS = 1
+
+
+# Inventory history (app/history.py), served at /v1/stockat
+# `manage.py compact_history` rolls inventory events into daily aggregates once
+# they are older than the last HISTORY_KEEP_DAYS days (UTC), after which stock
+# during those days is only known to the day.
+
+HISTORY_KEEP_DAYS = 7
+
+
+# Item and amount type lookups (app/cache.py)
+# Cached in the REFERENCE_CACHE cache for REFERENCE_CACHE_TTL seconds. With more
+# than one server process it must be a shared cache such as memcached or redis,
+# so that every process drops a type that one of them changed or deleted.
+
+REFERENCE_CACHE = "default"
+REFERENCE_CACHE_TTL = 300
+
+
+# Conditional GETs (app/versions.py)
+# Per-table change counters are kept in each database, next to the tables they
+# count. Read endpoints may be cached by clients and proxies for
+# READ_CACHE_MAX_AGE seconds before they revalidate.
+
+READ_CACHE_MAX_AGE = 2
+
+
+# Idempotent writes (app/idempotency.py)
+# Responses to write requests sent with an Idempotency-Key header are replayed
+# to retries for IDEMPOTENCY_TTL_SECONDS. Each database keeps at most
+# IDEMPOTENCY_MAX_KEYS of them, evicting the oldest first.
+
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_MAX_KEYS = 100000
+
+
+# Change feed (app/events.py), served at /v1/changes under ASGI
+# With more than one worker process, use "app.events.UnixSocketBroker" so that
+# every worker sees the writes made by the others. A client that falls
+# EVENTS_CLIENT_QUEUE_SIZE events behind is disconnected and resumes from the
+# last EVENTS_REPLAY_SIZE events.
+
+EVENTS_BROKER = "app.events.LocalBroker"
+EVENTS_BROKER_DIR = "/tmp/mysite-events"
+EVENTS_REPLAY_SIZE = 1000
+EVENTS_CLIENT_QUEUE_SIZE = 100
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_MAX_ITEM_TYPES = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -14,12 +14,6 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import path
-from . import views
+from app import routes, views
 
-urlpatterns = [
-    path("admin/", admin.site.urls),
-    path("v1/additem", views.add_item, name='add-item'),
-    path("/api/v1/removeitem", views.delete_item, name='delete-item'),
-]
+urlpatterns = routes.urlpatterns(views)